@@ -11,6 +11,12 @@ from modules.audio import *
 from modules.misc import *
 from modules.logger import *
 from modules.media_encoder import *
+from modules.file_index import *
+from modules.audio_cache import *
+from modules.pipeline import *
+from modules.journal import *
+from modules.quarantine import *
+from modules.ingest import *
 
 
 def mkv_auto(args):
@@ -18,7 +24,6 @@ def mkv_auto(args):
     output_dir = check_config(config, 'general', 'output_folder')
     keep_original = check_config(config, 'general', 'keep_original')
     ini_temp_dir = check_config(config, 'general', 'ini_temp_dir')
-    remove_samples = check_config(config, 'general', 'remove_samples')
     hide_cursor = check_config(config, 'general', 'hide_cursor')
 
     # Create the logger
@@ -54,18 +59,52 @@ def mkv_auto(args):
     if args.temp_dir:
         temp_dir = args.temp_dir
 
-    if os.path.exists(temp_dir):
+    # A run that was cut off continues from its journals in TEMP instead of starting over
+    pipeline_mode = check_config(config, 'general', 'pipeline_mode')
+    resumable_run = get_resumable_run(temp_dir) if pipeline_mode == 'streaming' and os.path.isdir(temp_dir) else None
+
+    if os.path.exists(temp_dir) and resumable_run is None:
         try:
             shutil.rmtree(temp_dir)
         except:
             pass
 
-    if not move_files:
+    persistent_index = check_config(config, 'general', 'persistent_index')
+    if persistent_index == 'true' or (persistent_index == 'service' and args.service):
+        index_file = check_config(config, 'general', 'index_file')
+        # If the index location is unchanged from default and
+        # set to run in Docker, keep it inside 'files/' as well
+        if index_file == '.cache/mkv-auto-index.db' and (args.docker or args.service):
+            index_file = 'files/.cache/mkv-auto-index.db'
+        try:
+            open_file_index(index_file, check_config(config, 'general', 'index_max_entries'))
+        except (sqlite3.Error, OSError) as e:
+            custom_print(logger, f"{GREY}[INFO]{RESET} Could not open persistent index '{index_file}': {e}")
+
+    audio_cache = check_config(config, 'audio', 'audio_cache')
+    if audio_cache == 'true' or (audio_cache == 'service' and args.service):
+        audio_cache_dir = check_config(config, 'audio', 'audio_cache_dir')
+        if audio_cache_dir == '.cache/audio' and (args.docker or args.service):
+            audio_cache_dir = 'files/.cache/audio'
+        try:
+            open_audio_cache(audio_cache_dir, check_config(config, 'audio', 'audio_cache_max_size'))
+        except (sqlite3.Error, OSError) as e:
+            custom_print(logger, f"{GREY}[INFO]{RESET} Could not open audio cache '{audio_cache_dir}': {e}")
+
+    if not move_files and resumable_run is None:
         if os.path.exists(temp_dir):
             shutil.rmtree(temp_dir)
         os.mkdir(temp_dir)
 
-    total_files = count_files(input_dir)
+    # Quarantined files whose wait is over are tried again with this run
+    quarantine = Quarantine(logger, input_dir, temp_dir, move_files)
+    if resumable_run is None:
+        released_files = quarantine.release_due_files()
+        if released_files:
+            custom_print(logger, f"{GREY}[INFO]{RESET} Retrying {released_files} quarantined "
+                                 f"{print_multi_or_single(released_files, 'file')}.")
+
+    total_files = count_files(input_dir) if resumable_run is None else count_files(temp_dir)
 
     if total_files == 0:
         if not args.silent:
@@ -73,74 +112,80 @@ def mkv_auto(args):
         exit(0)
 
     filenames_mkv_only = []
+    directories = []
+    ingest = None
     errored = False
 
     try:
-        if move_files:
-            print_with_progress_files(logger, 0, total_files, header='INFO', description='Moving file')
+        if pipeline_mode == 'streaming':
+            # Files are taken from the input folder and processed as soon as each of them is stable
+            ingest = StreamingIngest(logger, debug, input_dir, temp_dir, move_files, args.service, args.silent)
+            update_replacement_lists(logger)
+            if hide_cursor:
+                hide_the_cursor()
+
+        if resumable_run is not None:
+            custom_print(logger, f"{GREY}[INFO]{RESET} Resuming the interrupted run in TEMP.")
+            if move_files:
+                restore_interrupted_ingest(temp_dir, input_dir)
+            clean_interrupted_run(temp_dir, resumable_run)
+            ingest.inventory = list(resumable_run.get('inventory', {}).get('.', []))
+        elif ingest is not None:
+            os.makedirs(temp_dir, exist_ok=True)
+            mark_run_prepared(temp_dir, {'.': []})
         else:
-            print_with_progress_files(logger, 0, total_files, header='INFO', description='Copying file')
+            if move_files:
+                print_with_progress_files(logger, 0, total_files, header='INFO', description='Moving file')
+            else:
+                print_with_progress_files(logger, 0, total_files, header='INFO', description='Copying file')
 
-        done_info = {'skipped_files': 0}
-        total_files_input = 0
-        actual_total_file_sizes = 0.0
-        method = 'moved' if move_files else 'copied'
+            done_info = {'skipped_files': 0}
+            total_files_input = 0
+            actual_total_file_sizes = 0.0
+            method = 'moved' if move_files else 'copied'
 
-        if hide_cursor:
-            hide_the_cursor()
+            if hide_cursor:
+                hide_the_cursor()
 
-        if move_files:
-            remaining_files = wait_for_stable_files(input_dir)
-            while remaining_files:
-                total_files_input += count_files(input_dir)
-                files_in_temp = count_files(temp_dir)
-                all_files = remaining_files + files_in_temp
-                done_info = move_directory_contents(logger, input_dir, temp_dir, total_files=all_files)
+            if move_files:
                 remaining_files = wait_for_stable_files(input_dir)
-                if done_info['skipped_files'] > 0:
-                    break
-            actual_total_file_sizes = get_folder_size(temp_dir)
-        else:
-            remaining_files = wait_for_stable_files(input_dir)
-            total_files_input += count_files(input_dir)
-            done_info = copy_directory_contents(logger, input_dir, temp_dir, total_files=remaining_files)
-            actual_total_file_sizes += done_info[f'actual_{method}_file_sizes']
-
-        desc = "Moving file" if move_files else "Copying file"
-        total_files_temp = count_files(temp_dir)
-        if done_info['skipped_files'] > 0:
-            print_final_spin_files(logger, total_files_temp, total_files_input, header='INFO', description=desc)
-        else:
-            print_final_spin_files(logger, total_files_temp, total_files_temp, header='INFO', description=desc)
-
-        if done_info['skipped_files'] == 0:
-            custom_print(logger, f"{GREY}[INFO]{RESET} "
-                                 f"Successfully {method} {format_size(actual_total_file_sizes, True)} to TEMP.")
-        elif done_info['skipped_files'] > 0:
-            custom_print(logger, f"{GREY}[INFO]{RESET} "
-                                 f"Successfully {method} {format_size(actual_total_file_sizes, True)} to TEMP.")
-            custom_print(logger,
-                         f"{GREY}[INFO]{RESET} {done_info['skipped_files']} media {print_multi_or_single(done_info['skipped_files'], 'file')} "
-                         f"had to be skipped.")
-            custom_print(logger,
-                         f"{GREY}[INFO]{RESET} {format_size(done_info['required_space_gib'], True)} needed (350% of {format_size(done_info['actual_file_sizes'], True)})")
-            custom_print(logger, f"{GREY}[INFO]{RESET} Only {format_size(done_info['available_space_gib'], True)} was available in TEMP.")
-
-        extract_archives(logger, temp_dir)
-        flatten_season_folders(temp_dir)
-        process_extras(temp_dir)
-
-        if remove_samples:
-            remove_sample_files_and_dirs(temp_dir)
-
-        flatten_directories(logger, temp_dir)
-
-        convert_all_videos_to_mkv(logger, debug, temp_dir, args.silent)
-        rename_others_file_to_folder(temp_dir)
+                while remaining_files:
+                    total_files_input += count_files(input_dir)
+                    files_in_temp = count_files(temp_dir)
+                    all_files = remaining_files + files_in_temp
+                    done_info = move_directory_contents(logger, input_dir, temp_dir, total_files=all_files)
+                    remaining_files = wait_for_stable_files(input_dir)
+                    if done_info['skipped_files'] > 0:
+                        break
+                actual_total_file_sizes = get_folder_size(temp_dir)
+            else:
+                remaining_files = wait_for_stable_files(input_dir)
+                total_files_input += count_files(input_dir)
+                done_info = copy_directory_contents(logger, input_dir, temp_dir, total_files=remaining_files)
+                actual_total_file_sizes += done_info[f'actual_{method}_file_sizes']
 
-        fix_episodes_naming(temp_dir)
-        remove_ds_store(temp_dir)
-        remove_wsl_identifiers(temp_dir)
+            desc = "Moving file" if move_files else "Copying file"
+            total_files_temp = count_files(temp_dir)
+            if done_info['skipped_files'] > 0:
+                print_final_spin_files(logger, total_files_temp, total_files_input, header='INFO', description=desc)
+            else:
+                print_final_spin_files(logger, total_files_temp, total_files_temp, header='INFO', description=desc)
+
+            if done_info['skipped_files'] == 0:
+                custom_print(logger, f"{GREY}[INFO]{RESET} "
+                                     f"Successfully {method} {format_size(actual_total_file_sizes, True)} to TEMP.")
+            elif done_info['skipped_files'] > 0:
+                custom_print(logger, f"{GREY}[INFO]{RESET} "
+                                     f"Successfully {method} {format_size(actual_total_file_sizes, True)} to TEMP.")
+                custom_print(logger,
+                             f"{GREY}[INFO]{RESET} {done_info['skipped_files']} media {print_multi_or_single(done_info['skipped_files'], 'file')} "
+                             f"had to be skipped.")
+                custom_print(logger,
+                             f"{GREY}[INFO]{RESET} {format_size(done_info['required_space_gib'], True)} needed (350% of {format_size(done_info['actual_file_sizes'], True)})")
+                custom_print(logger, f"{GREY}[INFO]{RESET} Only {format_size(done_info['available_space_gib'], True)} was available in TEMP.")
+
+            prepare_temp_folder(logger, debug, temp_dir, args.silent)
+            mark_run_prepared(temp_dir)
 
         if total_files == 0:
             if not args.silent:
@@ -164,6 +209,10 @@ def mkv_auto(args):
             """
 
             filenames = [f for f in filenames if not f.startswith('.')]
+            if resumable_run is not None:
+                # Tracks and subtitles a journaled stage produced are not input files
+                journaled_artifacts = get_journaled_artifacts(read_directory_journals(dirpath))
+                filenames = [f for f in filenames if f not in journaled_artifacts]
             filenames_covers = [f for f in filenames if f.lower().endswith(('.png', '.jpg'))
                                 and any(name in f.lower() for name in poster_base_names)]
 
@@ -178,9 +227,10 @@ def mkv_auto(args):
             download_missing_subs = check_config(config, 'subtitles', 'download_missing_subs')
             remove_all_subtitles = check_config(config, 'subtitles', 'remove_all_subtitles')
             enable_media_encoder = check_config(config, 'media-encoder', 'enable_media_encoder')
+            pipeline_mode = check_config(config, 'general', 'pipeline_mode')
 
             if not filenames:
-                exit(0)
+                break
 
             print_media_info(logger, filenames)
 
@@ -197,10 +247,11 @@ def mkv_auto(args):
                         exit(1)
 
             ram_info = get_ram_usage()
+            cpu_usage = get_cpu_usage()
             max_workers = get_worker_thread_count()
 
             custom_print(logger, f"{GREY}[INFO]{RESET} "
-                                 f"CPU {BLUE}{get_block_gradient(psutil.cpu_percent(interval=0.5))}{RESET} {psutil.cpu_percent(interval=0.5):.0f}% "
+                                 f"CPU {BLUE}{get_block_gradient(cpu_usage)}{RESET} {cpu_usage:.0f}% "
                                  f"RAM {BLUE}{get_block_gradient(ram_info['percent_ram'])}{RESET} {ram_info['percent_ram']}%")
             custom_print(logger, f"{GREY}[INFO]{RESET} Using {max_workers} {print_multi_or_single(max_workers, 'worker')} based on system load.")
 
@@ -214,89 +265,109 @@ def mkv_auto(args):
             subtitle_files_all = []
             external_subs_found = False
 
-            need_processing_audio, need_processing_subs, all_missing_subs_langs = trim_audio_in_mkv_files(logger, debug, filenames_mkv_only, dirpath)
-            audio_tracks_to_be_merged, subtitle_tracks_to_be_merged = generate_audio_tracks_in_mkv_files(logger, debug, filenames_mkv_only, dirpath, need_processing_audio)
+            if pipeline_mode == 'streaming':
+                # Folders are processed together once all of them are known
+                external_subs_found = (any(file.endswith(('.srt', '.ass', '.sub', '.idx', '.sup')) for file in filenames)
+                                       and download_missing_subs.lower() != 'override')
+                directories.append(PipelineDirectory(dirpath, all_dirnames, filenames_mkv_only, filenames_covers,
+                                                     external_subs_found))
+                continue
+            else:
+                need_processing_audio, need_processing_subs, all_missing_subs_langs = trim_audio_in_mkv_files(logger, debug, filenames_mkv_only, dirpath, quarantine)
+                if not filenames_mkv_only:
+                    # Every file of the folder was quarantined
+                    if filenames_covers:
+                        move_files_to_output_process(logger, debug, filenames_covers, dirpath, all_dirnames, output_dir, errored)
+                    continue
+                audio_tracks_to_be_merged, subtitle_tracks_to_be_merged = generate_audio_tracks_in_mkv_files(logger, debug, filenames_mkv_only, dirpath, need_processing_audio)
+
+                if any(file.endswith(('.srt', '.ass', '.sub', '.idx', '.sup')) for file in filenames) and download_missing_subs.lower() != 'override':
+                    total_external_subs, all_missing_subs_langs = process_external_subs(logger, debug, dirpath, filenames_mkv_only, all_missing_subs_langs)
+                    if any(sub for sub in total_external_subs):
+                        external_subs_found = True
+
+                if any(need_processing_subs) or external_subs_found:
+                    if download_missing_subs.lower() != 'override':
+                        all_subtitle_files = extract_subs_in_mkv_process(logger, debug, filenames_mkv_only, dirpath)
+
+                    if any(sub for sub in total_external_subs):
+                        all_subtitle_files = merge_subtitles_with_priority(all_subtitle_files, total_external_subs)
+
+                    if not all(sub == ['none'] or sub == [''] or sub == [] for sub in all_missing_subs_langs) and download_missing_subs.lower() != 'false':
+                        all_downloaded_subs = fetch_missing_subtitles_process(logger, debug, filenames_mkv_only, dirpath, total_external_subs,
+                                                                              all_missing_subs_langs)
 
-            if any(file.endswith(('.srt', '.ass', '.sub', '.idx', '.sup')) for file in filenames) and download_missing_subs.lower() != 'override':
-                total_external_subs, all_missing_subs_langs = process_external_subs(logger, debug, dirpath, filenames_mkv_only, all_missing_subs_langs)
-                if any(sub for sub in total_external_subs):
-                    external_subs_found = True
+                        all_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(all_subtitle_files, all_downloaded_subs, fillvalue=[])]
 
-            if any(need_processing_subs) or external_subs_found:
-                if download_missing_subs.lower() != 'override':
-                    all_subtitle_files = extract_subs_in_mkv_process(logger, debug, filenames_mkv_only, dirpath)
+                        if download_missing_subs.lower() == 'override':
+                            subtitle_files_to_process = all_subtitle_files
+                            subtitle_tracks_to_be_merged = get_subtitle_tracks_metadata_for_repack(logger, all_subtitle_files)
 
-                if any(sub for sub in total_external_subs):
-                    all_subtitle_files = merge_subtitles_with_priority(all_subtitle_files, total_external_subs)
+                    downloaded_or_external_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(all_downloaded_subs, total_external_subs, fillvalue=[])]
+                    if downloaded_or_external_subtitle_files:
+                        # Filter the nested lists to only include .srt files
+                        subtitle_files = [[f for f in sublist if f.endswith('.srt')] for sublist in downloaded_or_external_subtitle_files]
+                        if any(sub for sub in subtitle_files):
+                            resync_sub_process(logger, debug, filenames_mkv_only, dirpath, subtitle_files)
 
-                if not all(sub == ['none'] or sub == [''] or sub == [] for sub in all_missing_subs_langs) and download_missing_subs.lower() != 'false':
-                    all_downloaded_subs = fetch_missing_subtitles_process(logger, debug, filenames_mkv_only, dirpath, total_external_subs,
-                                                                          all_missing_subs_langs)
+                    if all_subtitle_files and download_missing_subs.lower() != 'override':
+                        (subtitle_tracks_to_be_merged, subtitle_files_to_process, subtitle_files_all,
+                         all_missing_subs_langs, errored_ocr_list, main_audio_track_langs) = convert_to_srt_process(logger, debug, filenames_mkv_only, dirpath, all_subtitle_files, False)
 
-                    all_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(all_subtitle_files, all_downloaded_subs, fillvalue=[])]
+                    # Additional processing if any OCR subtitles were to fail
+                    if (not all(sub == ['none'] or sub == [''] or sub == [] for sub in all_missing_subs_langs)
+                            and any(sub for sub in errored_ocr_list)):
 
-                    if download_missing_subs.lower() == 'override':
-                        subtitle_files_to_process = all_subtitle_files
-                        subtitle_tracks_to_be_merged = get_subtitle_tracks_metadata_for_repack(logger, all_subtitle_files)
+                        custom_print_no_newline(logger, f"{GREY}[SUBTITLES]{RESET} Limiting simultaneous OCR workers to 1.")
 
-                downloaded_or_external_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(all_downloaded_subs, total_external_subs, fillvalue=[])]
-                if downloaded_or_external_subtitle_files:
-                    # Filter the nested lists to only include .srt files
-                    subtitle_files = [[f for f in sublist if f.endswith('.srt')] for sublist in downloaded_or_external_subtitle_files]
-                    if any(sub for sub in subtitle_files):
-                        resync_sub_process(logger, debug, filenames_mkv_only, dirpath, subtitle_files)
-
-                if all_subtitle_files and download_missing_subs.lower() != 'override':
-                    (subtitle_tracks_to_be_merged, subtitle_files_to_process, subtitle_files_all,
-                     all_missing_subs_langs, errored_ocr_list, main_audio_track_langs) = convert_to_srt_process(logger, debug, filenames_mkv_only, dirpath, all_subtitle_files, False)
-
-                # Additional processing if any OCR subtitles were to fail
-                if (not all(sub == ['none'] or sub == [''] or sub == [] for sub in all_missing_subs_langs)
-                        and any(sub for sub in errored_ocr_list)):
-
-                    custom_print_no_newline(logger, f"{GREY}[SUBTITLES]{RESET} Limiting simultaneous OCR workers to 1.")
-
-                    a, new_subtitle_files_to_process, d, all_missing_subs_langs, b, c = convert_to_srt_process(logger, debug,
-                                                                                                            filenames_mkv_only,
-                                                                                                            dirpath,
-                                                                                                            errored_ocr_list,
-                                                                                                            True)
-                    if (download_missing_subs.lower() != 'false' and
-                            not all(sub == ['none'] or sub == [''] or sub == [] for sub in all_missing_subs_langs)):
-                        all_downloaded_subs = fetch_missing_subtitles_process(logger, debug,
-                                                                              filenames_mkv_only, dirpath,
-                                                                              total_external_subs,
-                                                                              all_missing_subs_langs)
+                        a, new_subtitle_files_to_process, d, all_missing_subs_langs, b, c = convert_to_srt_process(logger, debug,
+                                                                                                                filenames_mkv_only,
+                                                                                                                dirpath,
+                                                                                                                errored_ocr_list,
+                                                                                                                True)
+                        if (download_missing_subs.lower() != 'false' and
+                                not all(sub == ['none'] or sub == [''] or sub == [] for sub in all_missing_subs_langs)):
+                            all_downloaded_subs = fetch_missing_subtitles_process(logger, debug,
+                                                                                  filenames_mkv_only, dirpath,
+                                                                                  total_external_subs,
+                                                                                  all_missing_subs_langs)
 
-                    all_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(subtitle_files_all, new_subtitle_files_to_process, fillvalue=[])]
-                    all_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(all_subtitle_files, all_downloaded_subs, fillvalue=[])]
+                        all_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(subtitle_files_all, new_subtitle_files_to_process, fillvalue=[])]
+                        all_subtitle_files = [[*(a or []), *(b or [])] for a, b in zip_longest(all_subtitle_files, all_downloaded_subs, fillvalue=[])]
 
-                    subtitle_files_to_process = [[*(a or []), *(b or [])] for a, b in zip_longest(subtitle_files_to_process, new_subtitle_files_to_process, fillvalue=[])]
-                    subtitle_files_to_process = [[*(a or []), *(b or [])] for a, b in zip_longest(all_downloaded_subs, subtitle_files_to_process, fillvalue=[])]
+                        subtitle_files_to_process = [[*(a or []), *(b or [])] for a, b in zip_longest(subtitle_files_to_process, new_subtitle_files_to_process, fillvalue=[])]
+                        subtitle_files_to_process = [[*(a or []), *(b or [])] for a, b in zip_longest(all_downloaded_subs, subtitle_files_to_process, fillvalue=[])]
 
-                    if all_downloaded_subs:
-                        # Filter the nested lists to only include .srt files
-                        subtitle_files = [[f for f in sublist if f.endswith('.srt')] for sublist in all_downloaded_subs]
-                        if any(sub for sub in subtitle_files):
-                            resync_sub_process(logger, debug, filenames_mkv_only, dirpath, subtitle_files)
+                        if all_downloaded_subs:
+                            # Filter the nested lists to only include .srt files
+                            subtitle_files = [[f for f in sublist if f.endswith('.srt')] for sublist in all_downloaded_subs]
+                            if any(sub for sub in subtitle_files):
+                                resync_sub_process(logger, debug, filenames_mkv_only, dirpath, subtitle_files)
+
+                        subtitle_tracks_to_be_merged = get_subtitle_tracks_metadata_for_repack(logger, all_subtitle_files)
 
-                    subtitle_tracks_to_be_merged = get_subtitle_tracks_metadata_for_repack(logger, all_subtitle_files)
+                    if subtitle_files_to_process and any(sub for sub in subtitle_files_to_process):
+                        remove_sdh_process(logger, debug, subtitle_files_to_process)
 
-                if subtitle_files_to_process and any(sub for sub in subtitle_files_to_process):
-                    remove_sdh_process(logger, debug, subtitle_files_to_process)
+                if not enable_media_encoder:
+                    plan_output_paths_process(logger, debug, filenames_mkv_only, dirpath, all_dirnames, output_dir)
 
-            if (any(any(value for value in d.values()) for d in audio_tracks_to_be_merged) or
-                    any(any(value for value in d.values()) for d in subtitle_tracks_to_be_merged) or
-                    remove_all_subtitles):
-                repack_mkv_tracks_process(logger, debug, filenames_mkv_only, dirpath, audio_tracks_to_be_merged, subtitle_tracks_to_be_merged)
+                if (any(any(value for value in d.values()) for d in audio_tracks_to_be_merged) or
+                        any(any(value for value in d.values()) for d in subtitle_tracks_to_be_merged) or
+                        remove_all_subtitles):
+                    repack_mkv_tracks_process(logger, debug, filenames_mkv_only, dirpath, audio_tracks_to_be_merged, subtitle_tracks_to_be_merged)
+                elif any(remux_plan_pending(os.path.join(dirpath, file)) for file in filenames_mkv_only):
+                    apply_remux_plans_process(logger, debug, filenames_mkv_only, dirpath)
 
-            filenames_mkv_only = remove_clutter_process(logger, debug, filenames_mkv_only, dirpath)
+                processed_filenames = list(filenames_mkv_only)
+                filenames_mkv_only = remove_clutter_process(logger, debug, filenames_mkv_only, dirpath, quarantine)
 
-            if enable_media_encoder:
-                filenames_mkv_only = encode_media_files(logger, debug, filenames_mkv_only, dirpath)
+                if enable_media_encoder:
+                    filenames_mkv_only = encode_media_files(logger, debug, filenames_mkv_only, dirpath)
 
-            all_filenames = filenames_mkv_only + filenames_covers
-            move_files_to_output_process(logger, debug, all_filenames, dirpath, all_dirnames, output_dir, errored)
+                all_filenames = filenames_mkv_only + filenames_covers
+                move_files_to_output_process(logger, debug, all_filenames, dirpath, all_dirnames, output_dir, errored)
+                quarantine.forget(dirpath, processed_filenames)
 
             end_time = time.time()
             processing_time = end_time - start_time
@@ -309,7 +380,35 @@ def mkv_auto(args):
             if hide_cursor:
                 show_the_cursor()
 
+        if directories or ingest is not None:
+            process_directories_in_pipeline(logger, debug, directories, output_dir, quarantine,
+                                            resume=resumable_run is not None, ingest=ingest)
+            if hide_cursor:
+                show_the_cursor()
+        log_worker_pool_stats(logger)
+        clear_run_marker(temp_dir)
+
     except Exception as e:
+        # Files of folders the pipeline hadn't finished yet
+        unfinished_directories = [(directory, directory.unfinished_files()) for directory in directories
+                                  if directory.unfinished_files()]
+        # Remuxes already written into the output library are finished, they are
+        # neither retried nor moved to the output folder again
+        finished_files = []
+        if unfinished_directories:
+            finished_files = [file for directory, files in unfinished_directories for file in files
+                              if is_written_to_output(os.path.join(directory.dirpath, file))]
+            unfinished_directories = [(directory, [file for file in files if file not in finished_files])
+                                      for directory, files in unfinished_directories]
+            unfinished_directories = [(directory, files) for directory, files in unfinished_directories if files]
+            filenames_mkv_only = [file for directory, files in unfinished_directories for file in files]
+        elif filenames_mkv_only:
+            finished_files = [file for file in filenames_mkv_only if is_written_to_output(os.path.join(dirpath, file))]
+            filenames_mkv_only = [file for file in filenames_mkv_only if file not in finished_files]
+        if finished_files:
+            custom_print(logger, f"{GREY}[INFO]{RESET} {len(finished_files)} "
+                                 f"{print_multi_or_single(len(finished_files), 'file')} already finished in the output folder.")
+
         if isinstance(e, CorruptedFile):
             partial_str = 'copied' if not move_files else 'moved'
             custom_print_no_newline(logger, f"{RED}[ERROR]{RESET} Partially {partial_str} "
@@ -329,10 +428,18 @@ def mkv_auto(args):
                 custom_print(logger, f"{RED}[ERROR]{RESET} An unknown error occured. Moving unprocessed "
                                      f"{print_multi_or_single(len(filenames_mkv_only), 'file')} to destination folder...\n{e}")
                 custom_print(logger, traceback.print_tb(e.__traceback__))
-                move_files_to_output_process(logger, debug, filenames_mkv_only, dirpath, all_dirnames, output_dir, errored)
+                if unfinished_directories:
+                    for directory, files in unfinished_directories:
+                        move_files_to_output_process(logger, debug, files, directory.dirpath, directory.all_dirnames,
+                                                     output_dir, errored)
+                else:
+                    move_files_to_output_process(logger, debug, filenames_mkv_only, dirpath, all_dirnames, output_dir, errored)
             else:
                 custom_print(logger, f"{RED}[ERROR]{RESET} An unknown error occured: {e}")
 
+        if ingest is not None and move_files:
+            restore_interrupted_ingest(temp_dir, input_dir)
+        clear_run_marker(temp_dir)
         print_no_timestamp(logger, '')
         if hide_cursor:
             show_the_cursor()
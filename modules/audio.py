@@ -8,17 +8,25 @@ import uuid
 from datetime import datetime
 
 from modules.misc import *
+from modules.probe import *
+from modules.governor import *
+from modules.pools import *
+from modules.audio_cache import *
 
 
-# Function to extract a single audio track
-def extract_audio_track(debug, filename, track, language, name):
+def get_extracted_audio_filename(filename, track, language):
     base, _, _ = filename.rpartition('.')
     try:
         audio_language = pycountry.languages.get(alpha_3=language).alpha_2
     except:
         audio_language = language[:-1]
 
-    audio_filename = f"{base}.{track}.{audio_language}.mka"
+    return f"{base}.{track}.{audio_language}.mka"
+
+
+# Function to extract a single audio track
+def extract_audio_track(debug, filename, track, language, name):
+    audio_filename = get_extracted_audio_filename(filename, track, language)
 
     command = [
         "ffmpeg",
@@ -32,7 +40,7 @@ def extract_audio_track(debug, filename, track, language, name):
     if debug:
         print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
 
-    result = subprocess.run(command, capture_output=True, text=True)
+    result = run_command(command, capture_output=True, text=True)
 
     if result.returncode != 0:
         # If copy fails, try decoding instead
@@ -45,7 +53,7 @@ def extract_audio_track(debug, filename, track, language, name):
             audio_filename,
             "-y"
         ]
-        result = subprocess.run(command, capture_output=True, text=True)
+        result = run_command(command, capture_output=True, text=True)
 
         if result.returncode != 0:
             raise Exception("Error executing ffmpeg command: " + result.stderr)
@@ -61,8 +69,29 @@ def extract_audio_tracks_in_mkv(internal_threads, debug, filename, track_numbers
     if debug:
         print()
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=internal_threads) as executor:
+    # Copy every track out in a single demux pass over the file
+    audio_filenames = [get_extracted_audio_filename(filename, track, language)
+                       for track, language in zip(track_numbers, audio_languages)]
+    command = ["ffmpeg", "-y", "-i", filename]
+    for track, audio_filename in dict(zip(track_numbers, audio_filenames)).items():
+        command += ["-map", f"0:{track}", "-c", "copy", audio_filename]
+
+    if debug:
+        print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
+
+    result = run_command(command, capture_output=True, text=True)
+
+    if result.returncode == 0:
+        return (tuple(audio_filenames), tuple(audio_languages),
+                tuple(audio_names), tuple('mkv' for _ in track_numbers))
+
+    # If the combined copy fails, extract the tracks one by one,
+    # which falls back to decoding per track
+    if debug:
+        print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}Combined copy failed, extracting tracks separately{RESET}")
+
+    # Run the tasks on the shared worker pool
+    with worker_pool('tracks', internal_threads) as executor:
         # Create a mapping of futures to their inputs for ordering
         futures = {
             executor.submit(extract_audio_track, debug, filename, track, language, name): (track, language, name)
@@ -149,20 +178,15 @@ def channels_to_int(ch):
 
 def detect_source_channels_and_layout(debug, file):
     try:
-        # Use ffprobe to extract audio stream data in JSON format
-        command_probe = [
-            'ffprobe', '-i', file, '-show_streams', '-select_streams', 'a', '-print_format', 'json'
-        ]
-        result = subprocess.run(command_probe, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        audio_info = json.loads(result.stdout)
+        audio_streams = probe_media(file).audio_streams
 
-        if 'streams' not in audio_info or not audio_info['streams']:
+        if not audio_streams:
             return None, None  # No audio streams found
 
         # Assume the first audio stream is the relevant one
-        audio_stream = audio_info['streams'][0]
-        channel_layout = audio_stream.get('channel_layout', '')
-        channels = audio_stream.get('channels', 0)
+        audio_stream = audio_streams[0]
+        channel_layout = audio_stream.channel_layout or ''
+        channels = audio_stream.channels
 
         # Map codec layout strings to the desired format
         channel_map = {
@@ -181,7 +205,7 @@ def detect_source_channels_and_layout(debug, file):
 
         return channels, None  # Default if no match found
 
-    except (subprocess.SubprocessError, json.JSONDecodeError) as e:
+    except (subprocess.SubprocessError, OSError) as e:
         print(f"Error processing file: {e}")
         return None, None
 
@@ -308,13 +332,24 @@ def get_pan_filter_eos_plus(source_channels, layout):
         return None
 
 
-def encode_single_preference(file, index, debug, languages, track_names, transformation, codec, ch_str,
-                             custom_ffmpeg_options):
+EOS_COMPAND_FILTER = (
+    'compand=attacks=0:decays=0.3:soft-knee=6:points=-110.00/-110.00|-101.11/-101.15|-93.93/-93.97|-83.52/-84.05|-74.59/-74.81|-65.18/-65.23|-52.29/-51.54|-42.14/-39.32|-34.35/-27.25|-31.43/-22.64|-27.54/-18.38|-24.29/-15.90|-20.07/-13.77|-13.58/-10.18|-5.15/-8.04|2.64/-6.96|10.76/-5.36|20.17/-4.29:gain=0'
+)
+
+
+def split_audio_filename(file):
     base_and_lang_with_id, _, extension = file.rpartition('.')
     base_with_id, _, lang = base_and_lang_with_id.rpartition('.')
     base, _, original_track_id = base_with_id.rpartition('.')
+    return base, lang, extension
 
-    source_channels, source_layout = detect_source_channels_and_layout(debug, file)
+
+def is_copy_preference(transformation, codec):
+    # If original no transformation or empty, just copy
+    return codec == 'ORIG' and transformation is None or codec == ''
+
+
+def get_chosen_layout(codec, ch_str, source_channels, source_layout):
     chosen_channels = channels_to_int(ch_str) if ch_str else None
     if chosen_channels is None and source_channels is not None:
         chosen_channels = source_channels
@@ -335,61 +370,43 @@ def encode_single_preference(file, index, debug, languages, track_names, transfo
         chosen_layout = 'Stereo'
     elif chosen_channels == 1:
         chosen_layout = 'Mono'
+    return chosen_layout
 
-    unique_id = str(uuid.uuid4())
-    track_name = track_names[index].replace(" (Original)", "")
 
-    # If original no transformation or empty, just copy
-    if codec == 'ORIG' and transformation is None or codec == '':
-        final_out_ext = extension
-        final_out = f"{base}.{unique_id}.{lang}.{final_out_ext}"
-        command = ["ffmpeg", "-i", file, "-c:a", "copy"] + custom_ffmpeg_options + [final_out]
-        if debug:
-            print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
-        subprocess.run(command, capture_output=True, text=True, check=True)
-
-        pref_audio_formats = check_config(config, 'audio', 'pref_audio_formats')
-        audio_preferences = parse_preferred_codecs(pref_audio_formats)
-
-        if track_name:
-            if track_name == 'Original':
-                track_name = f"{track_name} ({chosen_layout})"
-            elif not track_name.endswith(' (Original)'):
-                if len(audio_preferences) == 1:
-                    if len(audio_preferences) == 1 and "ORIG" in audio_preferences:
-                        pass
-                else:
-                    track_name = f"{track_name} (Original)"
-            else:
-                track_name = f"{track_name}"
-        else:
+def get_original_track_name(track_name, chosen_layout):
+    pref_audio_formats = check_config(config, 'audio', 'pref_audio_formats')
+    audio_preferences = parse_preferred_codecs(pref_audio_formats)
+
+    if track_name:
+        if track_name == 'Original':
+            track_name = f"{track_name} ({chosen_layout})"
+        elif not track_name.endswith(' (Original)'):
             if len(audio_preferences) == 1:
                 if len(audio_preferences) == 1 and "ORIG" in audio_preferences:
                     pass
             else:
-                track_name = f"Original ({chosen_layout})"
-        return final_out_ext, languages[index], track_name, unique_id
-
-    # Unique temp wav
-    temp_wav = f"{base}.{unique_id}.{lang}.temp.wav"
+                track_name = f"{track_name} (Original)"
+        else:
+            track_name = f"{track_name}"
+    else:
+        if len(audio_preferences) == 1:
+            if len(audio_preferences) == 1 and "ORIG" in audio_preferences:
+                pass
+        else:
+            track_name = f"Original ({chosen_layout})"
+    return track_name
 
-    # Decode to WAV
-    decode_cmd = ["ffmpeg", "-i", file, "-c:a", "pcm_s16le", "-f", "wav"]
-    # If the source is Stereo, and the transformation is EOS, decrease
-    # the overall volume to make the EOS compressor not be too aggressive
-    if source_channels <= 2 and transformation in ("EOS", "EOS+"):
-        decode_cmd += ['-af', 'volume=0.8']
-    if debug:
-        print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(decode_cmd)}{RESET}")
-    subprocess.run(decode_cmd + [temp_wav], capture_output=True, text=True, check=True)
 
+def get_preference_encoding(track_name, transformation, codec, chosen_layout, source_channels, extension):
+    # Returns the output extension, the encoder options, the filters
+    # applied to the decoded audio and the name of the new track
     final_codec = codec.lower()
     if final_codec in ('orig', 'eos', 'eos+'):
         final_codec = extension
 
     final_out_ext = final_codec if final_codec != 'orig' else extension
-    final_out = f"{base}.{unique_id}.{lang}.{final_out_ext}"
     ffmpeg_final_opts = []
+    filters = []
     track_name_final = ''
 
     # Codec settings
@@ -439,75 +456,176 @@ def encode_single_preference(file, index, debug, languages, track_names, transfo
         ffmpeg_final_opts += ['-c:a', 'copy']
         track_name_final = track_name
 
-    if transformation == 'EOS':
-        compand_filter = (
-            'compand=attacks=0:decays=0.3:soft-knee=6:points=-110.00/-110.00|-101.11/-101.15|-93.93/-93.97|-83.52/-84.05|-74.59/-74.81|-65.18/-65.23|-52.29/-51.54|-42.14/-39.32|-34.35/-27.25|-31.43/-22.64|-27.54/-18.38|-24.29/-15.90|-20.07/-13.77|-13.58/-10.18|-5.15/-8.04|2.64/-6.96|10.76/-5.36|20.17/-4.29:gain=0'
-        )
-
-        pan_filter = get_pan_filter_eos(source_channels, chosen_layout)
-
-        if pan_filter:
-            eos_filter = f'[0:a]{compand_filter},{pan_filter}'
+    if transformation in ('EOS', 'EOS+'):
+        if transformation == 'EOS':
+            pan_filter = get_pan_filter_eos(source_channels, chosen_layout)
         else:
-            # If no pan filter for this layout, just apply compand and limiter
-            eos_filter = f'[0:a]{compand_filter}'
-
-        ffmpeg_final_opts += ["-filter_complex", eos_filter]
-        chosen_layout_name = chosen_layout
-        if chosen_layout == "5.1(side)":
-            chosen_layout_name = "5.1"
-        if track_name and track_name != 'Original':
-            track_name_final = f"Even-Out-Sound (from {track_name})"
-        else:
-            track_name_final = f"Even-Out-Sound {chosen_layout_name}"
-    elif transformation == 'EOS+':
-        compand_filter = (
-            'compand=attacks=0:decays=0.3:soft-knee=6:points=-110.00/-110.00|-101.11/-101.15|-93.93/-93.97|-83.52/-84.05|-74.59/-74.81|-65.18/-65.23|-52.29/-51.54|-42.14/-39.32|-34.35/-27.25|-31.43/-22.64|-27.54/-18.38|-24.29/-15.90|-20.07/-13.77|-13.58/-10.18|-5.15/-8.04|2.64/-6.96|10.76/-5.36|20.17/-4.29:gain=0'
-        )
+            pan_filter = get_pan_filter_eos_plus(source_channels, chosen_layout)
 
-        pan_filter = get_pan_filter_eos_plus(source_channels, chosen_layout)
+        # If no pan filter for this layout, just apply compand and limiter
+        filters = [EOS_COMPAND_FILTER, pan_filter] if pan_filter else [EOS_COMPAND_FILTER]
 
-        if pan_filter:
-            eos_filter = f'[0:a]{compand_filter},{pan_filter}'
-        else:
-            # If no pan filter for this layout, just apply compand and limiter
-            eos_filter = f'[0:a]{compand_filter}'
-
-        ffmpeg_final_opts += ["-filter_complex", eos_filter]
         chosen_layout_name = chosen_layout
         if chosen_layout == "5.1(side)":
             chosen_layout_name = "5.1"
         if track_name and track_name != 'Original':
-            track_name_final = f"Even-Out-Sound+ (from {track_name})"
+            track_name_final = f"Even-Out-Sound{'+' if transformation == 'EOS+' else ''} (from {track_name})"
         else:
-            track_name_final = f"Even-Out-Sound+ {chosen_layout_name}"
+            track_name_final = f"Even-Out-Sound{'+' if transformation == 'EOS+' else ''} {chosen_layout_name}"
     else:
         if chosen_layout == '5.1':
-            ffmpeg_final_opts += ['-af', 'channelmap=0|1|2|3|4|5:5.1']
+            filters = ['channelmap=0|1|2|3|4|5:5.1']
         elif chosen_layout == '5.1(side)':
-            ffmpeg_final_opts += ['-af', 'channelmap=0|1|2|3|4|5:5.1(side)']
+            filters = ['channelmap=0|1|2|3|4|5:5.1(side)']
         elif chosen_layout == '7.1':
-            ffmpeg_final_opts += ['-af', 'channelmap=0|1|2|3|4|5|6|7:7.1']
+            filters = ['channelmap=0|1|2|3|4|5|6|7:7.1']
         elif chosen_layout == 'Stereo':
             ffmpeg_final_opts += ['-ac', '2']  # Use automatic downmixing
         elif chosen_layout == 'Mono':
             ffmpeg_final_opts += ['-ac', '1']  # Use automatic downmixing
 
-    final_cmd = ["ffmpeg", "-i", temp_wav] + ffmpeg_final_opts + custom_ffmpeg_options + [final_out]
+    return final_out_ext, ffmpeg_final_opts, filters, track_name_final
+
+
+def get_encode_cache_key(stream_hash, transformation, codec, chosen_layout, ffmpeg_final_opts, filters,
+                         custom_ffmpeg_options):
+    return get_audio_cache_key(stream_hash, {
+        'transformation': transformation, 'codec': codec, 'layout': chosen_layout,
+        'filters': filters, 'options': ffmpeg_final_opts + custom_ffmpeg_options})
+
+
+def encode_single_preference(file, index, debug, languages, track_names, transformation, codec, ch_str,
+                             custom_ffmpeg_options):
+    base, lang, extension = split_audio_filename(file)
+
+    source_channels, source_layout = detect_source_channels_and_layout(debug, file)
+    chosen_layout = get_chosen_layout(codec, ch_str, source_channels, source_layout)
+
+    unique_id = str(uuid.uuid4())
+    track_name = track_names[index].replace(" (Original)", "")
+
+    if is_copy_preference(transformation, codec):
+        final_out_ext = extension
+        final_out = f"{base}.{unique_id}.{lang}.{final_out_ext}"
+        command = ["ffmpeg", "-i", file, "-c:a", "copy"] + custom_ffmpeg_options + [final_out]
+        if debug:
+            print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
+        run_command(command, capture_output=True, text=True, check=True)
+        return final_out_ext, languages[index], get_original_track_name(track_name, chosen_layout), unique_id
+
+    final_out_ext, ffmpeg_final_opts, filters, track_name_final = get_preference_encoding(
+        track_name, transformation, codec, chosen_layout, source_channels, extension)
+    final_out = f"{base}.{unique_id}.{lang}.{final_out_ext}"
+    # If the source is Stereo, and the transformation is EOS, decrease
+    # the overall volume to make the EOS compressor not be too aggressive
+    if source_channels <= 2 and transformation in ("EOS", "EOS+"):
+        filters = ['volume=0.8'] + filters
+
+    cache_key = get_encode_cache_key(get_audio_stream_hash(file), transformation, codec, chosen_layout,
+                                     ffmpeg_final_opts, filters, custom_ffmpeg_options)
+    if audio_cache_get(cache_key, final_out):
+        if debug:
+            print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}Reused cached encode for '{final_out}'{RESET}")
+        return final_out_ext, languages[index], track_name_final, unique_id
+
+    # Decoded straight into the filters and encoder, the PCM never touches the disk
+    filter_opts = ['-af', ','.join(filters)] if filters else []
+
+    final_cmd = ["ffmpeg", "-i", file, "-map", "0:a:0"] + ffmpeg_final_opts + filter_opts + custom_ffmpeg_options + [final_out]
     if debug:
         print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(final_cmd)}{RESET}")
-    result = subprocess.run(final_cmd, capture_output=True, text=True)
+    result = run_command(final_cmd, capture_output=True, text=True)
     if result.returncode != 0:
         print('')
         print(f"{GREY}[UTC {get_timestamp()}] {RED}[ERROR]{RESET} {result.stderr}")
         print(f"{RESET}")
     result.check_returncode()
-
-    os.remove(temp_wav)
+    audio_cache_put(cache_key, final_out)
 
     return final_out_ext, languages[index], track_name_final, unique_id
 
 
+def encode_track_preferences(file, index, debug, languages, track_names, preferences, custom_ffmpeg_options):
+    # Decodes the track once and feeds every preference from it through asplit,
+    # all outputs written by one ffmpeg. Returns the results in the order of
+    # the preferences, or None if the combined command failed.
+    base, lang, extension = split_audio_filename(file)
+
+    source_channels, source_layout = detect_source_channels_and_layout(debug, file)
+    track_name = track_names[index].replace(" (Original)", "")
+    stream_hash = get_audio_stream_hash(file)
+
+    results = []
+    outputs = []
+    branches = []
+    output_args = []
+    cache_entries = []
+    for transformation, codec, ch_str in preferences:
+        chosen_layout = get_chosen_layout(codec, ch_str, source_channels, source_layout)
+        unique_id = str(uuid.uuid4())
+
+        if is_copy_preference(transformation, codec):
+            final_out_ext = extension
+            final_out = f"{base}.{unique_id}.{lang}.{final_out_ext}"
+            output_args += ['-map', '0:a:0', '-c:a', 'copy'] + custom_ffmpeg_options + [final_out]
+            track_name_final = get_original_track_name(track_name, chosen_layout)
+        else:
+            final_out_ext, ffmpeg_final_opts, filters, track_name_final = get_preference_encoding(
+                track_name, transformation, codec, chosen_layout, source_channels, extension)
+            final_out = f"{base}.{unique_id}.{lang}.{final_out_ext}"
+            # If the source is Stereo, and the transformation is EOS, decrease
+            # the overall volume to make the EOS compressor not be too aggressive
+            if source_channels <= 2 and transformation in ("EOS", "EOS+"):
+                filters = ['volume=0.8'] + filters
+
+            cache_key = get_encode_cache_key(stream_hash, transformation, codec, chosen_layout,
+                                             ffmpeg_final_opts, filters, custom_ffmpeg_options)
+            if audio_cache_get(cache_key, final_out):
+                if debug:
+                    print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}Reused cached encode for '{final_out}'{RESET}")
+            else:
+                label = f"out{len(branches)}"
+                branches.append((label, ','.join(filters) or 'anull'))
+                output_args += ['-map', f"[{label}]"] + ffmpeg_final_opts + custom_ffmpeg_options + [final_out]
+                cache_entries.append((cache_key, final_out))
+
+        outputs.append(final_out)
+        results.append((final_out_ext, languages[index], track_name_final, unique_id))
+
+    # Every preference came from the cache
+    if not output_args:
+        return results
+
+    command = ["ffmpeg", "-i", file]
+    if len(branches) == 1:
+        label, chain = branches[0]
+        command += ["-filter_complex", f"[0:a]{chain}[{label}]"]
+    elif branches:
+        split_labels = ''.join(f"[split{i}]" for i in range(len(branches)))
+        graph = [f"[0:a]asplit={len(branches)}{split_labels}"]
+        graph += [f"[split{i}]{chain}[{label}]" for i, (label, chain) in enumerate(branches)]
+        command += ["-filter_complex", ';'.join(graph)]
+    command += output_args
+
+    if debug:
+        print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
+    # One decoder plus one thread per encoder
+    result = run_command(command, cpu=1 + max(1, len(branches)), capture_output=True, text=True)
+    if result.returncode != 0:
+        if debug:
+            print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}Combined encode failed, encoding preferences "
+                  f"separately{RESET}\n{result.stderr}")
+        for output in outputs:
+            if os.path.exists(output):
+                os.remove(output)
+        return None
+
+    for cache_key, final_out in cache_entries:
+        audio_cache_put(cache_key, final_out)
+
+    return results
+
+
 def encode_audio_tracks(internal_threads, debug, audio_files, languages, track_names, preferred_codec_string):
     if not audio_files:
         return
@@ -518,19 +636,44 @@ def encode_audio_tracks(internal_threads, debug, audio_files, languages, track_n
     if debug:
         print(f"{GREY}[UTC {get_timestamp()}] [AUDIO DEBUG] {RESET}Audio format preferences:\n\n{GREEN}{preferences}{RESET}\n")
 
-    # Store futures by (track_index, preference_index) for ordering later
+    results_map = {}
+    failed_tracks = []
+    with worker_pool('tracks', internal_threads) as executor:
+        futures_map = {
+            executor.submit(encode_track_preferences, file, track_index, debug, languages, track_names,
+                            preferences, custom_ffmpeg_options): track_index
+            for track_index, file in enumerate(audio_files)
+        }
+
+        for future in concurrent.futures.as_completed(futures_map):
+            track_idx = futures_map[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                if debug:
+                    print(f"Error processing track {track_idx}: {e}")
+                    traceback_str = ''.join(traceback.format_tb(e.__traceback__))
+                    print(f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
+                    raise
+                continue
+            if results is None:
+                failed_tracks.append(track_idx)
+                continue
+            for pref_idx, res in enumerate(results):
+                results_map[(track_idx, pref_idx)] = res
+
+    # Tracks the combined filter graph failed on are encoded one preference at a time
     futures_map = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=internal_threads) as executor:
-        for track_index, file in enumerate(audio_files):
+    with worker_pool('tracks', internal_threads) as executor:
+        for track_index in sorted(failed_tracks):
             for pref_index, (transformation, codec, ch_str) in enumerate(preferences):
                 future = executor.submit(
-                    encode_single_preference, file, track_index, debug, languages, track_names,
+                    encode_single_preference, audio_files[track_index], track_index, debug, languages, track_names,
                     transformation, codec, ch_str, custom_ffmpeg_options
                 )
                 futures_map[future] = (track_index, pref_index)
 
         # Collect results
-        results_map = {}
         for future in concurrent.futures.as_completed(futures_map):
             track_idx, pref_idx = futures_map[future]
             try:
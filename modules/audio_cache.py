@@ -0,0 +1,166 @@
+import sqlite3
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from modules.misc import *
+from modules.governor import *
+
+# Cache of encoded audio tracks, keyed by a hash of the source audio stream and
+# everything that shapes the encode. Editions of a release that share their
+# audio (HDR and SDR, theatrical and extended) and re-queued files reuse the
+# encode instead of running it again.
+
+AUDIO_CACHE_INDEX = 'index.db'
+
+audio_cache_dir = None
+audio_cache_connection = None
+audio_cache_max_size = 0
+audio_cache_lock = threading.Lock()
+audio_stream_hashes = {}
+ffmpeg_version = None
+
+
+def open_audio_cache(cache_dir, max_size_gb):
+    global audio_cache_dir, audio_cache_connection, audio_cache_max_size
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with audio_cache_lock:
+        audio_cache_connection = sqlite3.connect(os.path.join(cache_dir, AUDIO_CACHE_INDEX),
+                                                 timeout=30, check_same_thread=False)
+        audio_cache_connection.execute("PRAGMA journal_mode=WAL")
+        audio_cache_connection.execute(
+            "CREATE TABLE IF NOT EXISTS encodes (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        audio_cache_connection.execute("CREATE INDEX IF NOT EXISTS encodes_last_used ON encodes (last_used)")
+        audio_cache_connection.commit()
+        audio_cache_dir = cache_dir
+        audio_cache_max_size = float(max_size_gb) * 1024 ** 3
+
+
+def close_audio_cache():
+    global audio_cache_connection
+
+    with audio_cache_lock:
+        if audio_cache_connection is not None:
+            audio_cache_connection.close()
+            audio_cache_connection = None
+
+
+def get_ffmpeg_version():
+    global ffmpeg_version
+
+    if ffmpeg_version is None:
+        result = run_command(["ffmpeg", "-version"], capture_output=True, text=True, check=True)
+        ffmpeg_version = result.stdout.splitlines()[0] if result.stdout else ''
+    return ffmpeg_version
+
+
+def get_audio_stream_hash(filename):
+    # Hash of the audio packets themselves, so the same track extracted
+    # from a different file or container gets the same hash
+    if audio_cache_connection is None:
+        return None
+    key = get_file_cache_key(filename)
+    if key is None:
+        return None
+    with audio_cache_lock:
+        stream_hash = audio_stream_hashes.get(key)
+    if stream_hash is not None:
+        return stream_hash
+
+    command = ["ffmpeg", "-v", "error", "-i", filename, "-map", "0:a:0", "-c", "copy",
+               "-f", "hash", "-hash", "sha256", "-"]
+    try:
+        result = run_command(command, capture_output=True, text=True, check=True)
+    except (subprocess.SubprocessError, OSError):
+        return None
+    stream_hash = result.stdout.strip().partition('=')[2]
+    if not stream_hash:
+        return None
+
+    with audio_cache_lock:
+        audio_stream_hashes[key] = stream_hash
+    return stream_hash
+
+
+def get_audio_cache_key(stream_hash, settings):
+    # settings holds everything that changes the output: transformation,
+    # codec, channel layout, filter chain and encoder options
+    if stream_hash is None:
+        return None
+    try:
+        version = get_ffmpeg_version()
+    except (subprocess.SubprocessError, OSError):
+        return None
+    key = json.dumps([stream_hash, settings, version], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def audio_cache_get(key, destination):
+    # Copies the cached encode to destination, returns False when there is none
+    if key is None or audio_cache_connection is None:
+        return False
+    cached_file = os.path.join(audio_cache_dir, key)
+
+    with audio_cache_lock:
+        try:
+            row = audio_cache_connection.execute("SELECT key FROM encodes WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            if not os.path.exists(cached_file):
+                audio_cache_connection.execute("DELETE FROM encodes WHERE key = ?", (key,))
+                audio_cache_connection.commit()
+                return False
+            audio_cache_connection.execute("UPDATE encodes SET last_used = ? WHERE key = ?", (time.time(), key))
+            audio_cache_connection.commit()
+        except sqlite3.Error:
+            return False
+
+    try:
+        shutil.copyfile(cached_file, destination)
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        return False
+    return True
+
+
+def audio_cache_put(key, source):
+    if key is None or audio_cache_connection is None:
+        return
+    cached_file = os.path.join(audio_cache_dir, key)
+    temp_file = f"{cached_file}.{threading.get_ident()}.tmp"
+
+    try:
+        shutil.copyfile(source, temp_file)
+        os.replace(temp_file, cached_file)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return
+
+    with audio_cache_lock:
+        try:
+            audio_cache_connection.execute(
+                "INSERT OR REPLACE INTO encodes (key, size, last_used) VALUES (?, ?, ?)",
+                (key, os.path.getsize(cached_file), time.time()))
+
+            # Evict the least recently used encodes once the cache is over its size
+            total_size = audio_cache_connection.execute("SELECT COALESCE(SUM(size), 0) FROM encodes").fetchone()[0]
+            if total_size > audio_cache_max_size:
+                for evicted_key, size in audio_cache_connection.execute(
+                        "SELECT key, size FROM encodes ORDER BY last_used ASC").fetchall():
+                    if total_size <= audio_cache_max_size:
+                        break
+                    audio_cache_connection.execute("DELETE FROM encodes WHERE key = ?", (evicted_key,))
+                    if os.path.exists(os.path.join(audio_cache_dir, evicted_key)):
+                        os.remove(os.path.join(audio_cache_dir, evicted_key))
+                    total_size -= size
+            audio_cache_connection.commit()
+        except (sqlite3.Error, OSError):
+            pass
@@ -0,0 +1,170 @@
+import sqlite3
+import hashlib
+import json
+import os
+import threading
+import time
+
+from modules.misc import *
+
+# Persistent index of what is known about a file across runs. Rows are keyed by
+# a content fingerprint, so a file keeps its entry when it is moved back to
+# the input folder and picked up again by a later run.
+
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+file_index_connection = None
+file_index_max_entries = 0
+file_index_lock = threading.Lock()
+file_fingerprints = {}
+
+
+def open_file_index(index_file, max_entries):
+    global file_index_connection, file_index_max_entries
+
+    index_dir = os.path.dirname(index_file)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+
+    with file_index_lock:
+        file_index_connection = sqlite3.connect(index_file, timeout=30, check_same_thread=False)
+        file_index_connection.execute("PRAGMA journal_mode=WAL")
+        file_index_connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "fingerprint TEXT PRIMARY KEY, probe TEXT, plan TEXT, stages TEXT, last_used REAL)")
+        file_index_connection.execute("CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)")
+        file_index_connection.commit()
+        file_index_max_entries = max(1, int(max_entries))
+
+
+def close_file_index():
+    global file_index_connection
+
+    with file_index_lock:
+        if file_index_connection is not None:
+            file_index_connection.close()
+            file_index_connection = None
+
+
+def get_file_fingerprint(filename):
+    # Size plus a hash of the first and last MiB of the file
+    key = get_file_cache_key(filename)
+    if key is None:
+        return None
+    with file_index_lock:
+        fingerprint = file_fingerprints.get(key)
+    if fingerprint is not None:
+        return fingerprint
+
+    size = key[2]
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        digest.update(file.read(FINGERPRINT_CHUNK_SIZE))
+        if size > FINGERPRINT_CHUNK_SIZE:
+            file.seek(max(FINGERPRINT_CHUNK_SIZE, size - FINGERPRINT_CHUNK_SIZE))
+            digest.update(file.read(FINGERPRINT_CHUNK_SIZE))
+    fingerprint = f"{size}-{digest.hexdigest()}"
+
+    with file_index_lock:
+        file_fingerprints[key] = fingerprint
+    return fingerprint
+
+
+def get_config_fingerprint(*sections):
+    # Plans are only reused when the settings they were computed from are unchanged
+    settings = {section: config.get(section) for section in sections}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def index_read(filename, field):
+    if file_index_connection is None:
+        return None
+    try:
+        fingerprint = get_file_fingerprint(filename)
+    except OSError:
+        return None
+    if fingerprint is None:
+        return None
+
+    with file_index_lock:
+        row = file_index_connection.execute(
+            f"SELECT {field} FROM files WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        file_index_connection.execute(
+            "UPDATE files SET last_used = ? WHERE fingerprint = ?", (time.time(), fingerprint))
+        file_index_connection.commit()
+    return json.loads(row[0]) if row[0] is not None else None
+
+
+def index_write(filename, field, value):
+    if file_index_connection is None:
+        return
+    try:
+        fingerprint = get_file_fingerprint(filename)
+    except OSError:
+        return
+    if fingerprint is None:
+        return
+
+    with file_index_lock:
+        file_index_connection.execute(
+            "INSERT OR IGNORE INTO files (fingerprint, last_used) VALUES (?, ?)", (fingerprint, time.time()))
+        file_index_connection.execute(
+            f"UPDATE files SET {field} = ?, last_used = ? WHERE fingerprint = ?",
+            (json.dumps(value), time.time(), fingerprint))
+
+        # Evict the least recently used entries once the index is full
+        total_entries = file_index_connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        if total_entries > file_index_max_entries:
+            file_index_connection.execute(
+                "DELETE FROM files WHERE fingerprint IN "
+                "(SELECT fingerprint FROM files ORDER BY last_used ASC LIMIT ?)",
+                (total_entries - file_index_max_entries,))
+        file_index_connection.commit()
+
+
+def index_get_probe(filename):
+    probe = index_read(filename, 'probe')
+    if probe is None:
+        return None
+    probe['file_name'] = filename
+    return probe
+
+
+def index_put_probe(filename, parsed_json):
+    index_write(filename, 'probe', parsed_json)
+
+
+def index_get_plan(filename, name, config_fingerprint):
+    plans = index_read(filename, 'plan') or {}
+    plan = plans.get(name)
+    if plan is None or plan.get('config') != config_fingerprint:
+        return None
+    return plan.get('value')
+
+
+def index_put_plan(filename, name, config_fingerprint, value):
+    if file_index_connection is None:
+        return
+    plans = index_read(filename, 'plan') or {}
+    plans[name] = {'config': config_fingerprint, 'value': value}
+    index_write(filename, 'plan', plans)
+
+
+def index_get_stages(filename, config_fingerprint):
+    # Stages only count as done when they ran with the current settings
+    stages = index_read(filename, 'stages')
+    if not isinstance(stages, dict) or stages.get('config') != config_fingerprint:
+        return []
+    return stages.get('value', [])
+
+
+def index_mark_stages(filename, stages, config_fingerprint):
+    if file_index_connection is None:
+        return
+    completed_stages = index_get_stages(filename, config_fingerprint)
+    for stage in stages:
+        if stage not in completed_stages:
+            completed_stages.append(stage)
+    index_write(filename, 'stages', {'config': config_fingerprint, 'value': completed_stages})
@@ -5,12 +5,13 @@ import rarfile
 import zipfile
 from datetime import datetime
 import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 from threading import Lock
 from pathvalidate import sanitize_filename
 
 from modules.misc import *
 from modules.logger import *
+from modules.pools import *
 
 
 def copy_file(src, dst):
@@ -36,7 +37,7 @@ def get_folder_size(folder_path):
     return total_size
 
 
-def extract_archives(logger, input_folder):
+def extract_archives(logger, input_folder, show_progress=True):
     header = "FILES"
     description = "Extracting archives"
 
@@ -52,7 +53,8 @@ def extract_archives(logger, input_folder):
     if total == 0:
         return
 
-    print_with_progress(logger, completed, total, header=header, description=description)
+    if show_progress:
+        print_with_progress(logger, completed, total, header=header, description=description)
 
     for root, archive_file in archives:
         archive_path = os.path.join(root, archive_file)
@@ -95,7 +97,8 @@ def extract_archives(logger, input_folder):
                             pass
 
             completed += 1
-            print_with_progress(logger, completed, total, header=header, description=description)
+            if show_progress:
+                print_with_progress(logger, completed, total, header=header, description=description)
 
         except Exception as e:
             try:
@@ -200,7 +203,7 @@ def move_directory_contents(logger, source_directory, destination_directory, fil
     max_worker_threads = get_worker_thread_count()
     num_workers = max(1, max_worker_threads)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    with worker_pool('files', num_workers) as executor:
         futures = [executor.submit(move_item, item) for item in items]
         concurrent.futures.wait(futures)
 
@@ -277,7 +280,7 @@ def copy_directory_contents(logger, source_directory, destination_directory, fil
     max_worker_threads = get_worker_thread_count()
     num_workers = max(1, max_worker_threads)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    with worker_pool('files', num_workers) as executor:
         futures = [executor.submit(copy_item, item) for item in items]
         concurrent.futures.wait(futures)
 
@@ -291,7 +294,7 @@ def copy_directory_contents(logger, source_directory, destination_directory, fil
     }
 
 
-def move_file_to_output(logger, debug, input_file_path, output_folder, folder_structure):
+def get_output_file_path(logger, debug, input_file_path, output_folder, folder_structure):
     original_folders, original_restored_filename = unflatten_file(input_file_path, '')
 
     base, ext = os.path.splitext(original_restored_filename)
@@ -407,18 +410,27 @@ def move_file_to_output(logger, debug, input_file_path, output_folder, folder_st
 
     output_path = os.path.join(output_folder, new_folders, restored_filename)
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    log_debug(logger, f"Moving file '{input_file_path}' to '{output_path}'")
-    if os.path.exists(input_file_path):
-        shutil.move(input_file_path, output_path)
-
     return {
         "output_folder": new_folders,
+        "output_path": output_path,
         "media_name": media_name,
         "filename": restored_filename
     }
 
 
+def move_file_to_output(logger, debug, input_file_path, output_folder, folder_structure, output_info=None):
+    if output_info is None:
+        output_info = get_output_file_path(logger, debug, input_file_path, output_folder, folder_structure)
+    output_path = output_info["output_path"]
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    log_debug(logger, f"Moving file '{input_file_path}' to '{output_path}'")
+    if os.path.exists(input_file_path):
+        shutil.move(input_file_path, output_path)
+
+    return output_info
+
+
 def safe_delete_dir(directory_path):
     """Safely delete a directory, only if it is empty."""
     try:
@@ -460,7 +472,7 @@ def wait_for_stable_files(path):
         max_worker_threads = get_worker_thread_count()
         num_workers = max(1, max_worker_threads)
 
-        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        with worker_pool('files', num_workers) as executor:
             future_to_file = {executor.submit(process_file, file): file for file in files if file not in stable_files}
 
             for future in as_completed(future_to_file):
@@ -476,7 +488,7 @@ def wait_for_stable_files(path):
             dirnames[:] = [d for d in dirnames if not d.startswith('.')]
             files.extend(os.path.join(dirpath, f) for f in filenames if not f.startswith('.'))
 
-        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        with worker_pool('files', num_workers) as executor:
             future_to_file = {executor.submit(process_file, file): file for file in files if file not in stable_files}
 
             for future in as_completed(future_to_file):
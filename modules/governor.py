@@ -0,0 +1,173 @@
+import os
+import subprocess
+import threading
+from contextlib import contextmanager
+
+from modules.misc import *
+from modules.pools import *
+
+# What one run of each tool takes from the shared budget:
+# CPU threads, RAM in GB and concurrent disk streams
+TOOL_COSTS = {
+    'ffmpeg': (2, 0.5, 1),
+    'ffprobe': (1, 0.1, 0),
+    'mkvmerge': (1, 0.2, 1),
+    'mkvextract': (1, 0.2, 1),
+    'mkvpropedit': (1, 0.1, 1),
+    'ffs': (1, 1.0, 1),
+    'subliminal': (1, 0.2, 0),
+    'HandBrakeCLI': (2, 0.5, 1),
+}
+DEFAULT_TOOL_COST = (1, 0.2, 0)
+
+# Large sequential reads and writes slow each other down past a few streams
+DISK_IO_TOKENS = 4
+
+
+class ResourceGovernor:
+    # Hands out CPU, memory and disk tokens to every subprocess, so nested thread
+    # pools can't start more work than the configured limits allow
+    def __init__(self, cpu_tokens, memory_gb, io_tokens):
+        self.capacity = {'cpu': max(1, cpu_tokens), 'memory': max(0.5, memory_gb), 'io': max(1, io_tokens)}
+        self.available = dict(self.capacity)
+        self.condition = threading.Condition()
+        self.held = threading.local()
+
+    def _clamp(self, request):
+        # A request larger than the whole budget runs on its own instead of never
+        return {name: min(amount, self.capacity[name]) for name, amount in request.items()}
+
+    def acquire(self, cpu=1, memory=0.0, io=0):
+        request = self._clamp({'cpu': cpu, 'memory': memory, 'io': io})
+        with self.condition:
+            while any(self.available[name] < amount for name, amount in request.items()):
+                self.condition.wait()
+            for name, amount in request.items():
+                self.available[name] -= amount
+        return request
+
+    def release(self, request):
+        with self.condition:
+            for name, amount in request.items():
+                self.available[name] += amount
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, cpu=1, memory=0.0, io=0):
+        # Tokens are held per thread, a nested reservation is already covered
+        if getattr(self.held, 'request', None) is not None:
+            yield
+            return
+        self.held.request = self.acquire(cpu, memory, io)
+        try:
+            yield
+        finally:
+            request, self.held.request = self.held.request, None
+            self.release(request)
+
+
+RESOURCE_GOVERNOR = None
+resource_governor_lock = threading.Lock()
+
+
+def get_resource_governor():
+    global RESOURCE_GOVERNOR
+    with resource_governor_lock:
+        if RESOURCE_GOVERNOR is None:
+            max_cpu_usage = int(check_config(config, 'general', 'max_cpu_usage'))
+            max_ram_usage = int(check_config(config, 'general', 'max_ram_usage'))
+            total_memory_gb = psutil.virtual_memory().total / (1024 ** 3)
+            RESOURCE_GOVERNOR = ResourceGovernor(
+                int(os.cpu_count() * max_cpu_usage / 100), total_memory_gb * max_ram_usage / 100, DISK_IO_TOKENS)
+        return RESOURCE_GOVERNOR
+
+
+def get_command_cost(command):
+    tool = os.path.basename(command[0] if isinstance(command, (list, tuple)) else command.split()[0])
+    return TOOL_COSTS.get(tool, DEFAULT_TOOL_COST)
+
+
+@contextmanager
+def command_reservation(command, cpu=None, memory=None, io=None):
+    default_cpu, default_memory, default_io = get_command_cost(command)
+    with get_resource_governor().reserve(default_cpu if cpu is None else cpu,
+                                         default_memory if memory is None else memory,
+                                         default_io if io is None else io):
+        yield
+
+
+def run_command(command, cpu=None, memory=None, io=None, **kwargs):
+    # subprocess.run, started once the command's tokens are available
+    check_cancelled()
+    with command_reservation(command, cpu, memory, io):
+        return subprocess.run(command, **kwargs)
+
+
+# Concurrent full-file reads/writes per block device. A spinning disk thrashes
+# as soon as two streams compete, flash storage keeps up with a few.
+IO_SLOTS_ROTATIONAL = 1
+IO_SLOTS_SOLID_STATE = 4
+IO_SLOTS_UNKNOWN = 2
+
+io_lanes = {}
+io_lanes_lock = threading.Lock()
+
+
+def get_device_id(path):
+    # Paths that don't exist yet live on the device of their closest existing parent
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def is_rotational_device(device_id):
+    sys_path = os.path.realpath(f"/sys/dev/block/{os.major(device_id)}:{os.minor(device_id)}")
+    # Partitions keep their queue settings on the parent disk
+    for candidate in (sys_path, os.path.dirname(sys_path)):
+        try:
+            with open(os.path.join(candidate, 'queue', 'rotational')) as file:
+                return file.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+
+def get_io_lane(device_id):
+    with io_lanes_lock:
+        if device_id not in io_lanes:
+            rotational = is_rotational_device(device_id) if device_id is not None else None
+            if rotational is None:
+                slots = IO_SLOTS_UNKNOWN
+            elif rotational:
+                slots = IO_SLOTS_ROTATIONAL
+            else:
+                slots = IO_SLOTS_SOLID_STATE
+            io_lanes[device_id] = (slots, threading.Semaphore(slots))
+        return io_lanes[device_id]
+
+
+def get_io_worker_count(*paths):
+    # Workers for a stage that streams whole files to or from these paths
+    device_ids = {get_device_id(path) for path in paths} or {None}
+    return min(get_io_lane(device_id)[0] for device_id in device_ids)
+
+
+@contextmanager
+def io_lane(*paths):
+    # Holds one slot on every device touched, taken in a fixed order so two
+    # stages crossing the same devices can't wait on each other
+    device_ids = sorted({get_device_id(path) for path in paths}, key=lambda device_id: (device_id is None, device_id))
+    semaphores = [get_io_lane(device_id)[1] for device_id in device_ids]
+    for semaphore in semaphores:
+        semaphore.acquire()
+    try:
+        yield
+    finally:
+        for semaphore in reversed(semaphores):
+            semaphore.release()
@@ -0,0 +1,266 @@
+import os
+import shutil
+import itertools
+from collections import defaultdict
+
+from modules.misc import *
+from modules.mkv import *
+from modules.file_operations import *
+from modules.journal import *
+
+# Streaming ingest: instead of waiting for the whole input folder to settle and
+# be moved before anything is processed, every file is handed to the pipeline
+# as soon as it (and the subtitles and posters that go with it) stopped growing.
+# Each batch is prepared on its own in a staging folder inside TEMP, so the
+# first episode of a season pack is processed while the rest is still landing.
+
+INGEST_DIR = '.ingest'
+STABLE_INTERVAL = 2.5
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi', '.m4v', '.webm', '.ts', '.mov', '.wmv', '.flv')
+
+
+def prepare_temp_folder(logger, debug, temp_dir, silent, show_progress=True):
+    # Unpacks, renames and flattens everything in temp_dir into MKV files ready to be processed
+    remove_samples = check_config(config, 'general', 'remove_samples')
+
+    extract_archives(logger, temp_dir, show_progress)
+    flatten_season_folders(temp_dir)
+    process_extras(temp_dir)
+
+    if remove_samples:
+        remove_sample_files_and_dirs(temp_dir)
+
+    flatten_directories(logger, temp_dir)
+
+    convert_all_videos_to_mkv(logger, debug, temp_dir, silent, show_progress)
+    rename_others_file_to_folder(temp_dir)
+
+    fix_episodes_naming(temp_dir)
+    remove_ds_store(temp_dir)
+    remove_wsl_identifiers(temp_dir)
+
+
+def is_extra_file(filename):
+    base = os.path.splitext(filename)[0].lower()
+    return any(base.endswith(tag) for tag in excluded_tags)
+
+
+def split_into_file_units(files):
+    # Splits files into one unit per video with its sidecar subtitles, the
+    # posters of a folder go along with its first video. Returns the units
+    # and the files that don't belong to any video.
+    by_folder = defaultdict(list)
+    for relative_path in files:
+        by_folder[os.path.dirname(relative_path)].append(os.path.basename(relative_path))
+
+    units = []
+    leftovers = []
+    for folder, names in sorted(by_folder.items()):
+        videos = sorted(name for name in names if name.lower().endswith(VIDEO_EXTENSIONS) and not is_extra_file(name))
+        # The longest base name wins, so 'Movie.Extended.srt' isn't given to 'Movie.mkv'
+        bases = sorted(((os.path.splitext(video)[0], video) for video in videos), key=lambda item: -len(item[0]))
+        members = {video: [video] for video in videos}
+        posters = []
+        for name in sorted(names):
+            if name in members:
+                continue
+            video = next((video for base, video in bases if name.startswith(f"{base}.")), None)
+            if video is not None and name.lower().endswith(SIDECAR_EXTENSIONS):
+                members[video].append(name)
+            elif videos and name.lower().endswith(('.png', '.jpg')) and any(
+                    poster in name.lower() for poster in poster_base_names):
+                posters.append(name)
+            else:
+                leftovers.append(os.path.join(folder, name))
+        if posters:
+            members[videos[0]].extend(posters)
+        units.extend([os.path.join(folder, name) for name in members[video]] for video in videos)
+    return units, leftovers
+
+
+def get_ingest_units(files):
+    # Files directly in the input folder, and folders that only hold videos with
+    # their subtitles and posters, are split per video. Any other folder (extras,
+    # archives, loose files) is handed over in one piece to keep its context, as
+    # is the input folder itself when extras are lying next to the videos in it.
+    groups = defaultdict(list)
+    for relative_path in files:
+        parts = relative_path.split(os.sep)
+        groups[parts[0] if len(parts) > 1 else ''].append(relative_path)
+
+    units = []
+    for top_level, group in sorted(groups.items()):
+        file_units, leftovers = split_into_file_units(group)
+        has_extras = any(is_extra_file(os.path.basename(path)) for path in leftovers)
+        if leftovers and (top_level or has_extras):
+            units.append(sorted(group))
+            continue
+        units.extend(file_units)
+        if leftovers:
+            units.append(leftovers)
+    return units
+
+
+def get_unique_filename(directory, filename):
+    base, extension = os.path.splitext(filename)
+    unique_filename = filename
+    i = 1
+    while os.path.exists(os.path.join(directory, unique_filename)):
+        unique_filename = f"{base} ({i}){extension}"
+        i += 1
+    return unique_filename
+
+
+class StreamingIngest:
+    def __init__(self, logger, debug, input_dir, temp_dir, move_files, service, silent):
+        self.logger = logger
+        self.debug = debug
+        self.input_dir = input_dir
+        self.temp_dir = temp_dir
+        self.move_files = move_files
+        self.service = service
+        self.silent = silent
+        self.signatures = {}
+        self.handled = set()
+        self.inventory = []
+        self.unit_ids = itertools.count()
+        self.total_files = 0
+        self.total_size = 0
+        self.skipped_files = 0
+        self.required_space = 0
+        self.available_space = 0
+
+    def scan(self):
+        # Files not handed over yet, and which of them didn't change since the last scan
+        signatures = {}
+        for dirpath, dirnames, filenames in os.walk(self.input_dir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                relative_path = os.path.relpath(os.path.join(dirpath, filename), self.input_dir)
+                if relative_path in self.handled:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                signatures[relative_path] = (stat.st_size, stat.st_mtime_ns)
+        stable_files = {path for path, signature in signatures.items() if self.signatures.get(path) == signature}
+        self.signatures = signatures
+        return signatures, stable_files
+
+    def run(self, hand_over, is_busy, stopped, report):
+        # Hands prepared files to hand_over(filenames) until nothing is left to
+        # take from the input folder, or stopped() returns True
+        while not stopped():
+            pending_files, stable_files = self.scan()
+            if not pending_files:
+                break
+
+            for unit in get_ingest_units(pending_files):
+                if stopped():
+                    break
+                if all(path in stable_files for path in unit):
+                    self.ingest_unit(unit, hand_over, is_busy)
+
+            time.sleep(STABLE_INTERVAL)
+
+        shutil.rmtree(os.path.join(self.temp_dir, INGEST_DIR), ignore_errors=True)
+        if self.move_files:
+            remove_empty_dirs(self.input_dir)
+        report(self.print_summary)
+
+    def ingest_unit(self, unit, hand_over, is_busy):
+        unit_size = sum(self.signatures[path][0] for path in unit)
+        available_space = get_free_space(self.temp_dir)
+        if available_space < unit_size * 3.5:
+            # Files that finish processing free up TEMP, so only give up once nothing is running
+            if is_busy():
+                return
+            self.handled.update(unit)
+            self.skipped_files += len(unit)
+            self.required_space += unit_size * 3.5
+            self.available_space = available_space
+            return
+
+        staging_dir = os.path.join(self.temp_dir, INGEST_DIR, str(next(self.unit_ids)))
+        # Named like TEMP, as some of the renames look at the name of the parent folder
+        staging_root = os.path.join(staging_dir, os.path.basename(os.path.normpath(self.temp_dir)))
+        for path in unit:
+            source = os.path.join(self.input_dir, path)
+            destination = os.path.join(staging_root, path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if self.move_files:
+                shutil.move(source, destination)
+            else:
+                shutil.copy(source, destination)
+            log_debug(self.logger, f"[DEBUG] Ingested '{path}'")
+        self.handled.update(unit)
+        self.total_files += len(unit)
+        self.total_size += unit_size
+
+        prepare_temp_folder(self.logger, self.debug, staging_root, self.silent, show_progress=False)
+
+        filenames = []
+        for filename in sorted(os.listdir(staging_root)):
+            if filename.startswith('.') or not os.path.isfile(os.path.join(staging_root, filename)):
+                continue
+            temp_filename = get_unique_filename(self.temp_dir, filename)
+            shutil.move(os.path.join(staging_root, filename), os.path.join(self.temp_dir, temp_filename))
+            filenames.append(temp_filename)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        filenames = [filename for filename in filenames if self.check_video_stream(filename)]
+        self.inventory.extend(filenames)
+        mark_run_prepared(self.temp_dir, {'.': sorted(self.inventory)})
+        hand_over(filenames)
+
+    def check_video_stream(self, filename):
+        if not filename.endswith('.mkv') or mkv_contains_video(filename, self.temp_dir):
+            return True
+        custom_print(self.logger, f"{RED}[ERROR]{RESET} File '{filename}' does not contain a video stream.")
+        file_path = os.path.join(self.temp_dir, filename)
+        if self.service:
+            custom_print(self.logger, f"{RED}[ERROR]{RESET} Service mode detected. Deleting file and continuing...")
+            os.remove(file_path)
+        elif self.move_files:
+            custom_print(self.logger, f"{RED}[ERROR]{RESET} Moved it back, remove this file from the input folder and try again.")
+            relative_dir_path, original_filename = unflatten_file(filename, '')
+            input_path = os.path.join(self.input_dir, relative_dir_path, original_filename)
+            os.makedirs(os.path.dirname(input_path), exist_ok=True)
+            shutil.move(file_path, input_path)
+        else:
+            custom_print(self.logger, f"{RED}[ERROR]{RESET} Remove this file from the input folder and try again.")
+            os.remove(file_path)
+        return False
+
+    def print_summary(self):
+        method = 'moved' if self.move_files else 'copied'
+        custom_print(self.logger, f"{GREY}[INFO]{RESET} "
+                                  f"Successfully {method} {format_size(self.total_size, True)} to TEMP.")
+        if self.skipped_files > 0:
+            custom_print(self.logger,
+                         f"{GREY}[INFO]{RESET} {self.skipped_files} media {print_multi_or_single(self.skipped_files, 'file')} "
+                         f"had to be skipped.")
+            custom_print(self.logger, f"{GREY}[INFO]{RESET} {format_size(self.required_space, True)} needed (350% of "
+                                      f"{format_size(self.required_space / 3.5, True)})")
+            custom_print(self.logger, f"{GREY}[INFO]{RESET} Only {format_size(self.available_space, True)} was available in TEMP.")
+
+
+def restore_interrupted_ingest(temp_dir, input_dir):
+    # Files an interrupted run was still preparing go back to where they came from
+    ingest_dir = os.path.join(temp_dir, INGEST_DIR)
+    if not os.path.isdir(ingest_dir):
+        return
+    staging_name = os.path.basename(os.path.normpath(temp_dir))
+    for unit_id in os.listdir(ingest_dir):
+        staging_root = os.path.join(ingest_dir, unit_id, staging_name)
+        for dirpath, dirnames, filenames in os.walk(staging_root):
+            for filename in filenames:
+                source = os.path.join(dirpath, filename)
+                destination = os.path.join(input_dir, os.path.relpath(source, staging_root))
+                if not os.path.exists(destination):
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    shutil.move(source, destination)
+    shutil.rmtree(ingest_dir, ignore_errors=True)
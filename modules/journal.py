@@ -0,0 +1,192 @@
+import json
+import os
+import hashlib
+import threading
+
+from modules.misc import *
+
+# Write-ahead journal of an interrupted run. Once TEMP is prepared, a run
+# marker records which files it holds. After every completed stage, each file
+# gets a journal with the stages it passed and the state they produced. When
+# mkv-auto is restarted after a crash, TEMP is kept and every file continues
+# from its last journaled stage instead of being copied and processed again.
+
+JOURNAL_VERSION = 1
+RUN_MARKER = '.mkv-auto-run.json'
+JOURNAL_SUFFIX = '.journal'
+
+
+def write_json_durable(path, data):
+    # Written to a temporary file and renamed, so a crash never leaves half a journal.
+    # The temporary name is unique per thread, as stages of a file may finish together.
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def get_file_signature(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_run_marker_path(temp_dir):
+    return os.path.join(temp_dir, RUN_MARKER)
+
+
+def get_journal_config_fingerprint():
+    # A run is only resumed with the settings it was started with
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def mark_run_prepared(temp_dir, inventory=None):
+    # inventory maps folders in TEMP to their input files, all of TEMP when not given
+    if inventory is None:
+        inventory = {}
+        for dirpath, dirnames, filenames in os.walk(temp_dir):
+            inventory[os.path.relpath(dirpath, temp_dir)] = sorted(filenames)
+    write_json_durable(get_run_marker_path(temp_dir), {
+        'version': JOURNAL_VERSION,
+        'config': get_journal_config_fingerprint(),
+        'inventory': inventory
+    })
+
+
+def get_resumable_run(temp_dir):
+    # The run marker of an interrupted run, None when there is nothing to resume
+    marker = read_json(get_run_marker_path(temp_dir))
+    if (not marker or marker.get('version') != JOURNAL_VERSION
+            or marker.get('config') != get_journal_config_fingerprint()):
+        return None
+    return marker
+
+
+def clear_run_marker(temp_dir):
+    try:
+        os.remove(get_run_marker_path(temp_dir))
+    except OSError:
+        pass
+
+
+def get_journal_path(dirpath, name):
+    return os.path.join(dirpath, f".{name}{JOURNAL_SUFFIX}")
+
+
+def write_file_journal(dirpath, name, input_file, completed_stages, state):
+    write_json_durable(get_journal_path(dirpath, name), {
+        'version': JOURNAL_VERSION,
+        'input_file': input_file,
+        'signature': get_file_signature(os.path.join(dirpath, input_file)),
+        'completed_stages': sorted(completed_stages),
+        'state': state
+    })
+
+
+def read_file_journal(dirpath, name):
+    # A journal is only valid while its file is exactly as the last stage left it
+    journal = read_json(get_journal_path(dirpath, name))
+    if not journal or journal.get('version') != JOURNAL_VERSION:
+        return None
+    signature = get_file_signature(os.path.join(dirpath, journal['input_file']))
+    if signature is None or signature != journal['signature']:
+        return None
+    return journal
+
+
+def remove_file_journal(dirpath, name):
+    try:
+        os.remove(get_journal_path(dirpath, name))
+    except OSError:
+        pass
+
+
+def get_journal_artifacts(value):
+    # Every file name referenced by a journaled state
+    if isinstance(value, str):
+        return {os.path.basename(value)}
+    if isinstance(value, dict):
+        return set().union(*(get_journal_artifacts(item) for item in value.values())) if value else set()
+    if isinstance(value, (list, tuple)):
+        return set().union(*(get_journal_artifacts(item) for item in value)) if value else set()
+    return set()
+
+
+def read_directory_journals(dirpath):
+    # Valid journals of a folder, keyed by the current name of their file
+    journals = {}
+    for filename in os.listdir(dirpath):
+        if not filename.endswith(JOURNAL_SUFFIX) or not filename.startswith('.'):
+            continue
+        name = filename[1:-len(JOURNAL_SUFFIX)]
+        journal = read_file_journal(dirpath, name)
+        if journal is not None:
+            journal['name'] = name
+            journals[journal['input_file']] = journal
+    return journals
+
+
+def get_journaled_artifacts(journals):
+    # Files produced by the journaled stages, not counting the media files themselves
+    artifacts = set()
+    for journal in journals.values():
+        artifacts |= get_journal_artifacts(journal['state'])
+    return artifacts - set(journals)
+
+
+def restore_interrupted_media(dirpath, filename):
+    # A media file written by a stage that was cut off. Partial outputs are
+    # removed, an output that already replaced its source takes its place.
+    base, extension = os.path.splitext(filename)
+    if filename.startswith('temp_video_'):
+        os.remove(os.path.join(dirpath, filename))
+        return
+    if filename.startswith('temp_'):
+        original = filename[len('temp_'):]
+    elif base.endswith('_tmp'):
+        original = base[:-len('_tmp')] + extension
+    else:
+        return
+    if os.path.exists(os.path.join(dirpath, original)):
+        os.remove(os.path.join(dirpath, filename))
+    else:
+        os.rename(os.path.join(dirpath, filename), os.path.join(dirpath, original))
+
+
+def clean_interrupted_run(temp_dir, marker):
+    # Removes what the interrupted stages left behind: files that were not
+    # in TEMP when the run was prepared and no valid journal refers to,
+    # and journals that are no longer valid
+    inventory = marker.get('inventory', {})
+    for dirpath, dirnames, filenames in os.walk(temp_dir):
+        relative_dirpath = os.path.relpath(dirpath, temp_dir)
+        if relative_dirpath not in inventory:
+            continue
+
+        journals = read_directory_journals(dirpath)
+        keep = set(inventory[relative_dirpath]) | set(journals) | get_journaled_artifacts(journals)
+        keep |= {f".{journal['name']}{JOURNAL_SUFFIX}" for journal in journals.values()}
+
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            if filename in keep or filename == RUN_MARKER or not os.path.isfile(file_path):
+                continue
+            if filename.endswith(JOURNAL_SUFFIX):
+                os.remove(file_path)
+            elif filename.lower().endswith('.mkv'):
+                # Media files renamed by a finished stage are kept as they are
+                restore_interrupted_media(dirpath, filename)
+            else:
+                os.remove(file_path)
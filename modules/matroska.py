@@ -0,0 +1,320 @@
+import mmap
+import os
+import struct
+
+# Minimal EBML/Matroska header reader. It only understands the Segment Info
+# and Tracks elements and returns the same structure as 'mkvmerge -J' for
+# them. Anything it does not recognise makes it return None, in which case
+# callers fall back to mkvmerge.
+
+HEADER_READ_LIMIT = 512 * 1024
+
+EBML_ID = 0x1A45DFA3
+DOCTYPE_ID = 0x4282
+SEGMENT_ID = 0x18538067
+SEEKHEAD_ID = 0x114D9B74
+SEEK_ID = 0x4DBB
+SEEK_ELEMENT_ID = 0x53AB
+SEEK_POSITION_ID = 0x53AC
+INFO_ID = 0x1549A966
+TIMESTAMP_SCALE_ID = 0x2AD7B1
+DURATION_ID = 0x4489
+TITLE_ID = 0x7BA9
+TRACKS_ID = 0x1654AE6B
+TRACK_ENTRY_ID = 0xAE
+TRACK_NUMBER_ID = 0xD7
+TRACK_UID_ID = 0x73C5
+TRACK_TYPE_ID = 0x83
+FLAG_ENABLED_ID = 0xB9
+FLAG_DEFAULT_ID = 0x88
+FLAG_FORCED_ID = 0x55AA
+NAME_ID = 0x536E
+LANGUAGE_ID = 0x22B59C
+LANGUAGE_IETF_ID = 0x22B59D
+CODEC_ID_ID = 0x86
+VIDEO_ID = 0xE0
+PIXEL_WIDTH_ID = 0xB0
+PIXEL_HEIGHT_ID = 0xBA
+AUDIO_ID = 0xE1
+SAMPLING_FREQUENCY_ID = 0xB5
+CHANNELS_ID = 0x9F
+CLUSTER_ID = 0x1F43B675
+
+TRACK_TYPES = {1: 'video', 2: 'audio', 17: 'subtitles'}
+
+# Codec names as reported by mkvmerge, by Matroska codec ID
+CODEC_NAMES = {
+    'V_MPEG1': 'MPEG-1/2',
+    'V_MPEG2': 'MPEG-1/2',
+    'V_MPEG4/ISO/AVC': 'AVC/H.264/MPEG-4p10',
+    'V_MPEGH/ISO/HEVC': 'HEVC/H.265/MPEG-H',
+    'V_MPEG4/ISO/ASP': 'MPEG-4p2',
+    'V_AV1': 'AV1',
+    'V_VP8': 'VP8',
+    'V_VP9': 'VP9',
+    'A_AC3': 'AC-3',
+    'A_EAC3': 'E-AC-3',
+    'A_DTS': 'DTS',
+    'A_TRUEHD': 'TrueHD',
+    'A_FLAC': 'FLAC',
+    'A_OPUS': 'Opus',
+    'A_VORBIS': 'Vorbis',
+    'A_MPEG/L2': 'MP2',
+    'A_MPEG/L3': 'MP3',
+    'A_PCM/INT/LIT': 'PCM',
+    'A_PCM/INT/BIG': 'PCM',
+    'A_PCM/FLOAT/IEEE': 'PCM',
+    'S_TEXT/UTF8': 'SubRip/SRT',
+    'S_TEXT/ASS': 'SubStationAlpha',
+    'S_TEXT/SSA': 'SubStationAlpha',
+    'S_HDMV/PGS': 'HDMV PGS',
+    'S_VOBSUB': 'VobSub',
+}
+
+
+class UnsupportedMatroska(Exception):
+    pass
+
+
+def read_element_id(data, pos, end):
+    if pos >= end:
+        raise UnsupportedMatroska("element ID out of range")
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 4 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 4 or pos + length > end:
+        raise UnsupportedMatroska("invalid element ID")
+    return int.from_bytes(data[pos:pos + length], 'big'), pos + length
+
+
+def read_element_size(data, pos, end):
+    if pos >= end:
+        raise UnsupportedMatroska("element size out of range")
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > end:
+        raise UnsupportedMatroska("invalid element size")
+    value = first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    # All value bits set means "unknown size"
+    if value == (1 << (7 * length)) - 1:
+        value = None
+    return value, pos + length
+
+
+def iter_elements(data, pos, end):
+    while pos < end:
+        element_id, pos = read_element_id(data, pos, end)
+        size, pos = read_element_size(data, pos, end)
+        if size is None or pos + size > end:
+            raise UnsupportedMatroska(f"unbounded element 0x{element_id:X}")
+        yield element_id, pos, size
+        pos += size
+
+
+def read_uint(data, pos, size):
+    return int.from_bytes(data[pos:pos + size], 'big') if size else 0
+
+
+def read_float(data, pos, size):
+    if size == 4:
+        return struct.unpack('>f', data[pos:pos + 4])[0]
+    if size == 8:
+        return struct.unpack('>d', data[pos:pos + 8])[0]
+    if size == 0:
+        return 0.0
+    raise UnsupportedMatroska("invalid float size")
+
+
+def read_string(data, pos, size):
+    return bytes(data[pos:pos + size]).split(b'\0', 1)[0].decode('utf-8')
+
+
+def parse_info(data, pos, size):
+    timestamp_scale = 1000000
+    duration = None
+    title = None
+    for element_id, child, child_size in iter_elements(data, pos, pos + size):
+        if element_id == TIMESTAMP_SCALE_ID:
+            timestamp_scale = read_uint(data, child, child_size)
+        elif element_id == DURATION_ID:
+            duration = read_float(data, child, child_size)
+        elif element_id == TITLE_ID:
+            title = read_string(data, child, child_size)
+
+    properties = {}
+    if title:
+        properties['title'] = title
+    if duration is not None:
+        properties['duration'] = int(duration * timestamp_scale)
+    return properties
+
+
+def parse_track_entry(data, pos, size):
+    entry = {}
+    for element_id, child, child_size in iter_elements(data, pos, pos + size):
+        if element_id in (TRACK_NUMBER_ID, TRACK_UID_ID, TRACK_TYPE_ID,
+                          FLAG_ENABLED_ID, FLAG_DEFAULT_ID, FLAG_FORCED_ID):
+            entry[element_id] = read_uint(data, child, child_size)
+        elif element_id in (NAME_ID, LANGUAGE_ID, LANGUAGE_IETF_ID, CODEC_ID_ID):
+            entry[element_id] = read_string(data, child, child_size)
+        elif element_id == VIDEO_ID:
+            for video_id, video_child, video_size in iter_elements(data, child, child + child_size):
+                if video_id in (PIXEL_WIDTH_ID, PIXEL_HEIGHT_ID):
+                    entry[video_id] = read_uint(data, video_child, video_size)
+        elif element_id == AUDIO_ID:
+            for audio_id, audio_child, audio_size in iter_elements(data, child, child + child_size):
+                if audio_id == SAMPLING_FREQUENCY_ID:
+                    entry[audio_id] = read_float(data, audio_child, audio_size)
+                elif audio_id == CHANNELS_ID:
+                    entry[audio_id] = read_uint(data, audio_child, audio_size)
+    return entry
+
+
+def parse_tracks(data, pos, size):
+    tracks = []
+    for element_id, child, child_size in iter_elements(data, pos, pos + size):
+        if element_id != TRACK_ENTRY_ID:
+            continue
+        entry = parse_track_entry(data, child, child_size)
+
+        track_type = TRACK_TYPES.get(entry.get(TRACK_TYPE_ID))
+        codec_id = entry.get(CODEC_ID_ID, '')
+        codec = CODEC_NAMES.get(codec_id)
+        if codec is None and codec_id.startswith('A_AAC'):
+            codec = 'AAC'
+        if track_type is None or codec is None:
+            raise UnsupportedMatroska(f"unsupported track type or codec '{codec_id}'")
+
+        # mkvmerge derives the legacy language from the IETF tag when only that
+        # is present; leave that conversion to mkvmerge
+        if LANGUAGE_ID not in entry and LANGUAGE_IETF_ID in entry:
+            raise UnsupportedMatroska("track only has an IETF language")
+
+        properties = {
+            'codec_id': codec_id,
+            'default_track': bool(entry.get(FLAG_DEFAULT_ID, 1)),
+            'enabled_track': bool(entry.get(FLAG_ENABLED_ID, 1)),
+            'forced_track': bool(entry.get(FLAG_FORCED_ID, 0)),
+            'language': entry.get(LANGUAGE_ID, 'eng') or 'eng',
+            'number': entry.get(TRACK_NUMBER_ID),
+        }
+        if TRACK_UID_ID in entry:
+            properties['uid'] = entry[TRACK_UID_ID]
+        if LANGUAGE_IETF_ID in entry:
+            properties['language_ietf'] = entry[LANGUAGE_IETF_ID]
+        if entry.get(NAME_ID):
+            properties['track_name'] = entry[NAME_ID]
+        if track_type == 'video' and PIXEL_WIDTH_ID in entry and PIXEL_HEIGHT_ID in entry:
+            properties['pixel_dimensions'] = f"{entry[PIXEL_WIDTH_ID]}x{entry[PIXEL_HEIGHT_ID]}"
+        if track_type == 'audio':
+            properties['audio_channels'] = entry.get(CHANNELS_ID, 1)
+            properties['audio_sampling_frequency'] = int(entry.get(SAMPLING_FREQUENCY_ID, 8000.0))
+
+        tracks.append({
+            'codec': codec,
+            'id': len(tracks),
+            'properties': properties,
+            'type': track_type
+        })
+    return tracks
+
+
+def read_matroska_header(data, filename):
+    end = len(data)
+    scan_end = min(end, HEADER_READ_LIMIT)
+
+    element_id, pos = read_element_id(data, 0, scan_end)
+    size, pos = read_element_size(data, pos, scan_end)
+    if element_id != EBML_ID or size is None:
+        raise UnsupportedMatroska("missing EBML header")
+    doc_type = None
+    for child_id, child, child_size in iter_elements(data, pos, pos + size):
+        if child_id == DOCTYPE_ID:
+            doc_type = read_string(data, child, child_size)
+    if doc_type not in ('matroska', 'webm'):
+        raise UnsupportedMatroska(f"unsupported doc type '{doc_type}'")
+    pos += size
+
+    element_id, pos = read_element_id(data, pos, scan_end)
+    segment_size, pos = read_element_size(data, pos, scan_end)
+    if element_id != SEGMENT_ID:
+        raise UnsupportedMatroska("missing Segment")
+    segment_start = pos
+    segment_end = end if segment_size is None else min(end, pos + segment_size)
+
+    top_level = {}
+    seek_positions = {}
+
+    # Walk the top-level elements at the start of the segment, stopping at
+    # the first Cluster or once the read limit is reached
+    while pos < min(segment_end, scan_end):
+        element_id, data_pos = read_element_id(data, pos, segment_end)
+        size, data_pos = read_element_size(data, data_pos, segment_end)
+        if element_id == CLUSTER_ID or size is None:
+            break
+        if data_pos + size > segment_end:
+            raise UnsupportedMatroska("truncated top-level element")
+        if element_id not in top_level:
+            top_level[element_id] = (data_pos, size)
+        if element_id == SEEKHEAD_ID:
+            for seek_id, seek, seek_size in iter_elements(data, data_pos, data_pos + size):
+                if seek_id != SEEK_ID:
+                    continue
+                target_id = target_position = None
+                for entry_id, entry, entry_size in iter_elements(data, seek, seek + seek_size):
+                    if entry_id == SEEK_ELEMENT_ID:
+                        target_id = read_uint(data, entry, entry_size)
+                    elif entry_id == SEEK_POSITION_ID:
+                        target_position = read_uint(data, entry, entry_size)
+                if target_id is not None and target_position is not None:
+                    seek_positions.setdefault(target_id, segment_start + target_position)
+        pos = data_pos + size
+
+    # Info and Tracks written after the clusters are found through the SeekHead
+    for element_id in (INFO_ID, TRACKS_ID):
+        if element_id in top_level or element_id not in seek_positions:
+            continue
+        seek_pos = seek_positions[element_id]
+        found_id, data_pos = read_element_id(data, seek_pos, segment_end)
+        size, data_pos = read_element_size(data, data_pos, segment_end)
+        if found_id != element_id or size is None or size > HEADER_READ_LIMIT or data_pos + size > segment_end:
+            raise UnsupportedMatroska(f"invalid SeekHead entry for 0x{element_id:X}")
+        top_level[element_id] = (data_pos, size)
+
+    if TRACKS_ID not in top_level:
+        raise UnsupportedMatroska("no Tracks element found")
+
+    container_properties = parse_info(data, *top_level[INFO_ID]) if INFO_ID in top_level else {}
+    tracks = parse_tracks(data, *top_level[TRACKS_ID])
+
+    return {
+        'container': {
+            'properties': container_properties,
+            'recognized': True,
+            'supported': True,
+            'type': 'Matroska'
+        },
+        'file_name': filename,
+        'tracks': tracks
+    }
+
+
+def read_mkv_info_native(filename):
+    # Returns a 'mkvmerge -J' style dict, or None if mkvmerge should be used instead
+    try:
+        if os.path.getsize(filename) == 0:
+            return None
+        with open(filename, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return read_matroska_header(data, filename)
+    except (OSError, ValueError, UnsupportedMatroska, UnicodeDecodeError, struct.error):
+        return None
@@ -6,35 +6,37 @@ import shutil  # Added to enable directory removal
 import platform
 import time
 import math
+import signal
+import threading
+import atexit
+import weakref
 import concurrent.futures
 
 from modules.misc import *
+from modules.probe import *
+from modules.governor import *
 
 
 def get_video_dimensions(filename):
-    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
-           '-show_entries', 'stream=width,height', '-of', 'csv=p=0:s=x', filename]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if result.returncode != 0:
-        print(f"Error getting video dimensions for {filename}: {result.stderr}")
+    video_streams = probe_media(filename).video_streams
+    if not video_streams:
+        print(f"Error getting video dimensions for {filename}: no video stream found")
         return None, None
-    try:
-        # Strip any trailing 'x' and whitespace
-        output = result.stdout.strip().rstrip('x')
-        width, height = map(int, output.split('x'))
-        return width, height
-    except ValueError:
-        print(f"Error parsing video dimensions for {filename}: {result.stdout}")
+    width, height = video_streams[0].width, video_streams[0].height
+    if not width or not height:
+        print(f"Error parsing video dimensions for {filename}: {width}x{height}")
         return None, None
+    return width, height
 
 
 def auto_crop(file):
     try:
-        hb_output = subprocess.check_output(
-            f'HandBrakeCLI -i "{file}" --scan -t 0',
-            stderr=subprocess.STDOUT,
-            shell=True
-        ).decode()
+        with command_reservation(['HandBrakeCLI']):
+            hb_output = subprocess.check_output(
+                f'HandBrakeCLI -i "{file}" --scan -t 0',
+                stderr=subprocess.STDOUT,
+                shell=True
+            ).decode()
 
         autocrop_str = re.search(r"\+ autocrop: (.+)", hb_output).group(1)
         top, bottom, left, right = map(int, autocrop_str.split('/'))
@@ -90,7 +92,145 @@ def calculate_output_dimensions(cropped_width, cropped_height, desired_ar):
     return output_width, output_height, pad_left, pad_right, pad_top, pad_bottom, scale
 
 
-def encode_single_video_file(logger, debug, input_file, dirpath, max_cpu_usage):
+class EncodeSlot:
+    def __init__(self, high_priority):
+        self.high_priority = high_priority
+        self.process = None
+        self.request = None
+        self.paused = False
+
+
+class EncodeSlots:
+    # Encoder slots shared by every encode of a run. When all slots are taken by
+    # large (low priority) encodes and a smaller file is waiting, one large encode
+    # is paused with SIGSTOP and its tokens are handed back to the governor. It
+    # continues with SIGCONT once a slot is free and no smaller file is waiting.
+    def __init__(self, slots):
+        self.slots = max(1, slots)
+        self.condition = threading.Condition()
+        self.active = []
+        self.paused = []
+        self.waiting_high = 0
+        running_encode_slots.add(self)
+
+    def _pausable(self):
+        return [slot for slot in self.active if not slot.high_priority and not slot.paused
+                and slot.process is not None and slot.process.poll() is None]
+
+    def acquire(self, high_priority):
+        slot = EncodeSlot(high_priority)
+        with self.condition:
+            if high_priority:
+                self.waiting_high += 1
+                try:
+                    while len(self.active) >= self.slots and not self._pausable():
+                        self.condition.wait()
+                    if len(self.active) >= self.slots:
+                        self._pause(self._pausable()[0])
+                finally:
+                    self.waiting_high -= 1
+            else:
+                # Paused encodes get their slot back before a new large one starts
+                while len(self.active) >= self.slots or self.waiting_high or self.paused:
+                    self.condition.wait()
+            self.active.append(slot)
+        return slot
+
+    def attach(self, slot, process, request):
+        with self.condition:
+            slot.process, slot.request = process, request
+            self.condition.notify_all()
+
+    def finish(self, slot):
+        resumed = []
+        with self.condition:
+            if slot in self.paused:
+                # Exited right as it was paused, its tokens were already returned
+                self.paused.remove(slot)
+            else:
+                self.active.remove(slot)
+                if slot.request is not None:
+                    get_resource_governor().release(slot.request)
+            while self.paused and len(self.active) < self.slots and not self.waiting_high:
+                paused_slot = self.paused.pop(0)
+                self.active.append(paused_slot)
+                resumed.append(paused_slot)
+            self.condition.notify_all()
+
+        # Tokens are taken back outside the lock, other encodes may be releasing theirs
+        for paused_slot in resumed:
+            paused_slot.request = get_resource_governor().acquire(**paused_slot.request)
+            with self.condition:
+                paused_slot.process.send_signal(signal.SIGCONT)
+                paused_slot.paused = False
+                self.condition.notify_all()
+
+    def _pause(self, slot):
+        # Called with the lock held
+        slot.process.send_signal(signal.SIGSTOP)
+        slot.paused = True
+        get_resource_governor().release(slot.request)
+        self.active.remove(slot)
+        self.paused.append(slot)
+
+    def terminate(self):
+        # Stops every encode still running, a paused one is continued so it can
+        # act on the signal instead of being left behind stopped
+        with self.condition:
+            slots = self.active + self.paused
+        for slot in slots:
+            if slot.process is not None and slot.process.poll() is None:
+                slot.process.terminate()
+                if slot.paused:
+                    slot.process.send_signal(signal.SIGCONT)
+
+
+running_encode_slots = weakref.WeakSet()
+
+
+def terminate_running_encodes():
+    for encode_slots in list(running_encode_slots):
+        encode_slots.terminate()
+
+
+atexit.register(terminate_running_encodes)
+
+
+def get_large_encode_size():
+    # Files at or above this size are encoded with low priority, None when disabled
+    pause_large_encodes = check_config(config, 'media-encoder', 'pause_large_encodes')
+    if not pause_large_encodes:
+        return None
+    return float(pause_large_encodes) * 1024 ** 3
+
+
+def is_large_encode(filename):
+    large_encode_size = get_large_encode_size()
+    return large_encode_size is not None and os.path.getsize(filename) >= large_encode_size
+
+
+def run_encode(command, encode_slots, high_priority, cpu, memory):
+    # Runs the encode in one of the shared encoder slots, where a large
+    # encode can be paused while a smaller one goes through
+    a, b, io = get_command_cost(command)
+    slot = encode_slots.acquire(high_priority)
+    try:
+        request = get_resource_governor().acquire(cpu, memory, io)
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except Exception:
+            get_resource_governor().release(request)
+            raise
+        encode_slots.attach(slot, process, request)
+        stdout, stderr = process.communicate()
+    finally:
+        encode_slots.finish(slot)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+
+
+def encode_single_video_file(logger, debug, input_file, dirpath, max_cpu_usage, encode_slots=None):
     crop_values = check_config(config, 'media-encoder', 'crop_values')
     limit_resolution = check_config(config, 'media-encoder', 'limit_resolution')
     output_codec = check_config(config, 'media-encoder', 'output_codec')
@@ -290,7 +430,10 @@ def encode_single_video_file(logger, debug, input_file, dirpath, max_cpu_usage):
     try:
         cmd_ffmpeg.append(temp_video_file)
         log_debug(logger, f"[MEDIA-ENCODER] FFmpeg command: '{' '.join(cmd_ffmpeg)}'")
-        subprocess.run(cmd_ffmpeg, check=True, text=True, capture_output=True)
+        if encode_slots is not None:
+            run_encode(cmd_ffmpeg, encode_slots, not is_large_encode(media_file), number_of_threads, 2.0)
+        else:
+            run_command(cmd_ffmpeg, cpu=number_of_threads, memory=2.0, check=True, text=True, capture_output=True)
     except subprocess.CalledProcessError as e:
         custom_print(logger, f"{RED}[ERROR]{RESET} FFmpeg failed with return code {e.returncode}")
         custom_print(logger, f"{RED}[STDERR]{RESET}\n{YELLOW}{e.stderr.strip()}{RESET}")
@@ -305,7 +448,7 @@ def encode_single_video_file(logger, debug, input_file, dirpath, max_cpu_usage):
             '--no-video', media_file
         ]
         log_debug(logger, f"[MEDIA-ENCODER] MKVMERGE command: '{' '.join(cmd_mkvmerge)}'")
-        subprocess.run(cmd_mkvmerge, check=True, text=True, capture_output=True)
+        run_command(cmd_mkvmerge, check=True, text=True, capture_output=True)
     except subprocess.CalledProcessError as e:
         custom_print(logger, f"{RED}[ERROR]{RESET} MKVMERGE failed with return code {e.returncode}")
         custom_print(logger, f"{RED}[STDERR]{RESET}\n{YELLOW}{e.stderr.strip()}{RESET}")
@@ -369,15 +512,75 @@ def encode_media_files(logger, debug, input_files, dirpath):
     log_debug(logger, f"[MEDIA-ENCODER] Tune: '{tune}'")
     log_debug(logger, f"[MEDIA-ENCODER] Custom parameters: '{custom_params}'")
 
+    num_workers = get_encoder_worker_count(total_files)
+    per_file_cpu = float(max_cpu_usage) / num_workers
+
+    start_time = time.time()
+
+    header = "FFMPEG"
+    description = get_encoder_description()
+
+    print_with_progress(logger, 0, total_files, header=header, description=description)
+
+    # Large files get their own workers, so smaller files can pause them
+    # instead of queueing behind them
+    encode_slots = EncodeSlots(num_workers) if get_large_encode_size() is not None else None
+    large_files = [is_large_encode(os.path.join(dirpath, input_file)) if encode_slots else False
+                   for input_file in input_files]
+
+    # Both sessions need their full share of threads at once, so the pool
+    # holds twice the encodes that may ever run
+    with worker_pool('encodes', num_workers, 2 * os.cpu_count()) as executor, \
+            worker_pool('encodes', num_workers, 2 * os.cpu_count()) as large_executor:
+        try:
+            futures = {(large_executor if large_files[index] else executor).submit(
+                encode_single_video_file, logger, debug, input_file, dirpath, per_file_cpu, encode_slots): index for
+                       index, input_file in order_by_estimated_cost(input_files, dirpath)}
+            for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                print_with_progress(logger, completed_count, total_files, header=header, description=description)
+                try:
+                    index = futures[future]
+                    updated_filename, filesize_info = future.result()
+                    if updated_filename is not None:
+                        updated_filenames[index] = updated_filename
+                    if filesize_info is not None:
+                        filesizes_info[index] = filesize_info
+                except Exception as e:
+                    # Print the error and traceback
+                    custom_print(logger, f"\n{RED}[ERROR]{RESET} {e}")
+                    traceback_str = ''.join(traceback.format_tb(e.__traceback__))
+                    print_no_timestamp(logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
+                    raise
+        except BaseException:
+            # Encodes still running (or paused) would otherwise outlive the run
+            if encode_slots is not None:
+                encode_slots.terminate()
+            raise
+
+    end_time = time.time()
+    processing_time = end_time - start_time
+
+    print_encoding_summary(logger, filesizes_info, processing_time)
+
+    return updated_filenames
+
+
+def get_encoder_worker_count(total_files):
+    output_codec = check_config(config, 'media-encoder', 'output_codec')
+
     max_worker_threads = get_worker_thread_count()
-    num_workers = min(max_worker_threads, total_files)
+    num_workers = max(1, min(max_worker_threads, total_files))
 
     if output_codec == 'h265':
         num_workers = min(2, num_workers)
     elif output_codec == 'h264':
         num_workers = min(4, num_workers)
+    return num_workers
 
-    per_file_cpu = float(max_cpu_usage) / num_workers
+
+def get_encoder_description():
+    output_codec = check_config(config, 'media-encoder', 'output_codec')
+    quality_crf = check_config(config, 'media-encoder', 'quality_crf')
 
     codec_map = {
         'h265': 'H.265',
@@ -386,37 +589,10 @@ def encode_media_files(logger, debug, input_files, dirpath):
         'av1': 'AV1'
     }
     display_codec = codec_map.get(output_codec.lower(), output_codec)
+    return f"Encode media to {display_codec} CRF-{quality_crf}"
 
-    start_time = time.time()
-
-    header = "FFMPEG"
-    description = f"Encode media to {display_codec} CRF-{quality_crf}"
-
-    print_with_progress(logger, 0, total_files, header=header, description=description)
-
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-        futures = {executor.submit(encode_single_video_file, logger, debug, input_file, dirpath, per_file_cpu): index for
-                   index, input_file in enumerate(input_files)}
-        for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
-            print_with_progress(logger, completed_count, total_files, header=header, description=description)
-            try:
-                index = futures[future]
-                updated_filename, filesize_info = future.result()
-                if updated_filename is not None:
-                    updated_filenames[index] = updated_filename
-                if filesize_info is not None:
-                    filesizes_info[index] = filesize_info
-            except Exception as e:
-                # Print the error and traceback
-                custom_print(logger, f"\n{RED}[ERROR]{RESET} {e}")
-                traceback_str = ''.join(traceback.format_tb(e.__traceback__))
-                print_no_timestamp(logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
-                raise
-
-    end_time = time.time()
-    processing_time = end_time - start_time
 
+def print_encoding_summary(logger, filesizes_info, processing_time):
     # Calculate total initial and resulting sizes
     total_initial_size = sum(info["initial_file_size"] for info in filesizes_info if info)
     total_resulting_size = sum(info["resulting_file_size"] for info in filesizes_info if info)
@@ -438,5 +614,3 @@ def encode_media_files(logger, debug, input_files, dirpath):
         print()
         custom_print_no_newline(logger, f"{GREY}[FFMPEG]{RESET} Encoding time: "
                                         f"{format_time_short(int(processing_time))}")
-
-    return updated_filenames
@@ -94,7 +94,76 @@ class ContinuousSpinner:
             self._idx = (self._idx + 1) % len(self.frames)
 
 
+class LoadSampler:
+    # Samples CPU, RAM and disk load in the background and keeps a smoothed value
+    # of each, so callers get the current load without blocking for a measurement
+    def __init__(self, interval=0.5, smoothing=0.3):
+        self.interval = interval
+        self.smoothing = smoothing
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_io = None
+
+        # Seed with the load average until the first sample is taken
+        try:
+            seed_cpu = min(100.0, os.getloadavg()[0] / os.cpu_count() * 100)
+        except (OSError, AttributeError):
+            seed_cpu = 0.0
+        self.cpu_percent = seed_cpu
+        self.ram_percent = psutil.virtual_memory().percent
+        self.io_percent = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        psutil.cpu_percent(interval=None)
+        self._last_io = self._read_io_busy_time()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _read_io_busy_time(self):
+        try:
+            counters = psutil.disk_io_counters()
+        except (OSError, RuntimeError):
+            return None
+        if counters is None or not hasattr(counters, 'busy_time'):
+            return None
+        return counters.busy_time, time.monotonic()
+
+    def _smooth(self, previous, current):
+        return previous + self.smoothing * (current - previous)
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            cpu = psutil.cpu_percent(interval=None)
+            ram = psutil.virtual_memory().percent
+
+            io = None
+            current_io = self._read_io_busy_time()
+            if current_io is not None and self._last_io is not None:
+                busy_ms = current_io[0] - self._last_io[0]
+                elapsed_ms = (current_io[1] - self._last_io[1]) * 1000
+                if elapsed_ms > 0:
+                    io = min(100.0, max(0.0, busy_ms / elapsed_ms * 100))
+            self._last_io = current_io
+
+            with self._lock:
+                self.cpu_percent = self._smooth(self.cpu_percent, cpu)
+                self.ram_percent = self._smooth(self.ram_percent, ram)
+                if io is not None:
+                    self.io_percent = self._smooth(self.io_percent, io)
+
+
 SPINNER = None
+LOAD_SAMPLER = None
+load_sampler_lock = threading.Lock()
 
 # List of tags to exclude from replacement
 # https://support.plex.tv/articles/local-files-for-trailers-and-extras/
@@ -1446,6 +1515,9 @@ config = {
         'output_folder': get_config('general', 'OUTPUT_FOLDER', variables_defaults),
         'keep_original': get_config('general', 'KEEP_ORIGINAL', variables_defaults).lower() == "true",
         'ini_temp_dir': get_config('general', 'TEMP_DIR', variables_defaults),
+        'persistent_index': get_config('general', 'PERSISTENT_INDEX', variables_defaults).lower(),
+        'index_file': get_config('general', 'INDEX_FILE', variables_defaults),
+        'index_max_entries': get_config('general', 'INDEX_MAX_ENTRIES', variables_defaults),
         'file_tag': get_config('general', 'FILE_TAG', variables_defaults),
         'normalize_filenames': get_config('general', 'NORMALIZE_FILENAMES', variables_defaults),
         'remove_samples': get_config('general', 'REMOVE_SAMPLES', variables_defaults).lower() == "true",
@@ -1454,8 +1526,12 @@ config = {
         'tv_shows_folder': get_config('general', 'TV_SHOWS_FOLDER', variables_defaults),
         'tv_shows_hdr_folder': get_config('general', 'TV_SHOWS_HDR_FOLDER', variables_defaults),
         'others_folder': get_config('general', 'OTHERS_FOLDER', variables_defaults),
+        'pipeline_mode': get_config('general', 'PIPELINE_MODE', variables_defaults).lower(),
+        'quarantine_retries': get_config('general', 'QUARANTINE_RETRIES', variables_defaults),
+        'quarantine_backoff': get_config('general', 'QUARANTINE_BACKOFF', variables_defaults),
         'max_cpu_usage': get_config('general', 'MAX_CPU_USAGE', variables_defaults),
         'max_ram_usage': get_config('general', 'MAX_RAM_USAGE', variables_defaults),
+        'worker_pool_threads': get_config('general', 'WORKER_POOL_THREADS', variables_defaults),
         'debug': get_config('general', 'DEBUG', variables_defaults).lower() == "true",
         'hide_cursor': get_config('general', 'HIDE_CURSOR', variables_defaults).lower() == "true",
         'keep_original_file_structure': get_config('general', 'KEEP_ORIGINAL_FILE_STRUCTURE', variables_defaults),
@@ -1467,6 +1543,9 @@ config = {
         'pref_audio_formats': get_config('audio', 'PREFERRED_AUDIO_FORMATS', variables_defaults),
         'remove_commentary': get_config('audio', 'REMOVE_COMMENTARY_TRACK', variables_defaults).lower() == "true",
         'only_keep_one_matching_audio_track': get_config('audio', 'ONLY_KEEP_ONE_MATCHING_AUDIO_TRACK', variables_defaults).lower() == "true",
+        'audio_cache': get_config('audio', 'AUDIO_CACHE', variables_defaults).lower(),
+        'audio_cache_dir': get_config('audio', 'AUDIO_CACHE_DIR', variables_defaults),
+        'audio_cache_max_size': get_config('audio', 'AUDIO_CACHE_MAX_SIZE', variables_defaults),
     },
     'subtitles': {
         'pref_subs_langs': [item.strip() for item in get_config('subtitles', 'PREFERRED_SUBS_LANG', variables_defaults).split(',')],
@@ -1501,29 +1580,70 @@ config = {
         'limit_resolution': get_config('media-encoder', 'LIMIT_RESOLUTION', variables_defaults),
         'tune': get_config('media-encoder', 'TUNE', variables_defaults),
         'custom_params': get_config('media-encoder', 'CUSTOM_PARAMS', variables_defaults),
+        'pause_large_encodes': get_config('media-encoder', 'PAUSE_LARGE_ENCODES', variables_defaults),
     }
 }
 
 
+def get_load_sampler():
+    global LOAD_SAMPLER
+    with load_sampler_lock:
+        if LOAD_SAMPLER is None:
+            LOAD_SAMPLER = LoadSampler()
+            LOAD_SAMPLER.start()
+        return LOAD_SAMPLER
+
+
+def get_cpu_usage():
+    return get_load_sampler().cpu_percent
+
+
+# Last pool sizes handed out, only changed once the load has
+# moved past the hysteresis band, so pool sizes don't flap
+pool_sizes = {}
+pool_sizes_lock = threading.Lock()
+POOL_SIZE_HYSTERESIS = 5
+
+
+def get_stable_pool_size(name, available, thread_count):
+    # thread_count(available) turns free CPU percent into a pool size
+    with pool_sizes_lock:
+        last_size = pool_sizes.get(name)
+        if last_size is None:
+            size = thread_count(available)
+        elif thread_count(available - POOL_SIZE_HYSTERESIS) > last_size:
+            size = thread_count(available - POOL_SIZE_HYSTERESIS)
+        elif thread_count(available + POOL_SIZE_HYSTERESIS) < last_size:
+            size = thread_count(available + POOL_SIZE_HYSTERESIS)
+        else:
+            size = last_size
+        pool_sizes[name] = size
+        return size
+
+
 def get_worker_thread_count():
     max_cpu_usage = int(check_config(config, 'general', 'max_cpu_usage'))
-    available = max_cpu_usage - psutil.cpu_percent(interval=0.5)
-    max_workers = int(os.cpu_count() * max(available, 0) / 100)
-    if max_workers < 1:
-        max_workers = 1
-    return max_workers
+    available = max_cpu_usage - get_cpu_usage()
+
+    def thread_count(available):
+        return max(1, int(os.cpu_count() * max(available, 0) / 100))
+
+    return get_stable_pool_size('workers', available, thread_count)
 
 
 def get_max_ocr_threads():
     # --- CPU constraint ---
     max_cpu_conf = int(check_config(config, 'general', 'max_cpu_usage'))  # e.g. 85 for 85%
-    current_cpu = psutil.cpu_percent(interval=0.5)
+    current_cpu = get_cpu_usage()
     avail_cpu = max_cpu_conf - current_cpu
-    if avail_cpu > 0:
-        cpu_limit = int((os.cpu_count() * avail_cpu / 100) // 1.4)
-        cpu_limit = max(1, cpu_limit)  # if any CPU headroom exists, allow at least 1 thread
-    else:
-        cpu_limit = 0  # No available CPU capacity
+
+    def thread_count(avail_cpu):
+        if avail_cpu > 0:
+            # if any CPU headroom exists, allow at least 1 thread
+            return max(1, int((os.cpu_count() * avail_cpu / 100) // 1.4))
+        return 0  # No available CPU capacity
+
+    cpu_limit = get_stable_pool_size('ocr', avail_cpu, thread_count)
 
     # --- Memory constraint ---
     memory_per_thread = 3.0  # Approximate max GB used per thread
@@ -1564,3 +1684,12 @@ def get_block_gradient(num):
         return "▓"  # high
     else:
         return "█"  # max
+
+
+def get_file_cache_key(filename):
+    # Identifies a file on disk; changes whenever the file is rewritten or replaced
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return os.path.abspath(filename), stat.st_ino, stat.st_size, stat.st_mtime_ns
@@ -9,15 +9,24 @@ import time
 import pycountry
 import concurrent.futures
 import base64
+import copy
+import threading
 from collections import defaultdict, Counter
 from itertools import chain
 from pathlib import Path
 
 from modules.misc import *
+from modules.probe import *
+from modules.governor import *
+from modules.pools import *
+from modules.matroska import *
+from modules.file_index import *
+from modules.remux import *
 from modules.audio import *
 from modules.subs import *
 from modules.file_operations import *
 from modules.integrations import *
+from modules.quarantine import *
 
 
 def convert_video_to_mkv(debug, video_file, output_file):
@@ -27,8 +36,9 @@ def convert_video_to_mkv(debug, video_file, output_file):
         '-y', output_file
     ]
 
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
+    with command_reservation(command):
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
 
     # Verifying completion
     return_code = process.returncode
@@ -39,7 +49,7 @@ def convert_video_to_mkv(debug, video_file, output_file):
     os.remove(video_file)
 
 
-def convert_all_videos_to_mkv(logger, debug, input_folder, silent):
+def convert_all_videos_to_mkv(logger, debug, input_folder, silent, show_progress=True):
     header = "FFMPEG"
     description = "Convert media to MKV"
 
@@ -54,7 +64,8 @@ def convert_all_videos_to_mkv(logger, debug, input_folder, silent):
         return
 
     completed_count = 0
-    print_with_progress(logger, completed_count, total_files, header=header, description=description)
+    if show_progress:
+        print_with_progress(logger, completed_count, total_files, header=header, description=description)
 
     for i, video_file in enumerate(video_files, start=1):
         if video_file.endswith('.mp4'):
@@ -69,8 +80,10 @@ def convert_all_videos_to_mkv(logger, debug, input_folder, silent):
             output_file = os.path.splitext(video_file)[0] + '.mkv'
             convert_video_to_mkv(debug, video_file, output_file)
         completed_count += 1
-        print_with_progress(logger, completed_count, total_files, header=header, description=description)
-    print()
+        if show_progress:
+            print_with_progress(logger, completed_count, total_files, header=header, description=description)
+    if show_progress:
+        print()
 
 
 def format_tracks_as_blocks(json_data, line_width=80):
@@ -110,25 +123,83 @@ def simplify_json(data, fields_to_keep):
     return simplified
 
 
-def get_mkv_info(debug, filename, silent):
-    command = ["mkvmerge", "-J", filename]
-    done = False
-    result = None
-    printed = False
-    while not done:
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            if not printed and not silent:
-                print(
-                    f"{GREY}[UTC {get_timestamp()}] [INFO]{RESET} Incoming file(s) detected in input folder. Waiting...")
-                printed = True
-            time.sleep(5)
-        if result.returncode == 0:
-            done = True
+# Cache of track listings shared by every stage, keyed by get_file_cache_key().
+# Each entry records whether it came from mkvmerge or the native header reader.
+mkv_info_cache = {}
+mkv_info_cache_lock = threading.Lock()
 
-    # Parse the JSON output and pretty-print it
-    parsed_json = json.loads(result.stdout)
-    pretty_json = json.dumps(parsed_json, indent=2)
+
+def get_cached_mkv_info(filename, verified_only=False):
+    key = get_file_cache_key(filename)
+    if key is None:
+        return None, None
+    with mkv_info_cache_lock:
+        parsed_json, pretty_json, verified = mkv_info_cache.get(key, (None, None, False))
+    if verified_only and not verified:
+        return None, None
+    return parsed_json, pretty_json
+
+
+def store_mkv_info(filename, parsed_json, pretty_json, verified=True):
+    key = get_file_cache_key(filename)
+    if key is None:
+        return
+    with mkv_info_cache_lock:
+        # Drop entries left behind by earlier versions of the same file
+        for cached_key in [k for k in mkv_info_cache if k[0] == key[0]]:
+            del mkv_info_cache[cached_key]
+        mkv_info_cache[key] = (parsed_json, pretty_json, verified)
+
+
+def invalidate_mkv_info(filename):
+    path = os.path.abspath(filename)
+    with mkv_info_cache_lock:
+        for cached_key in [k for k in mkv_info_cache if k[0] == path]:
+            del mkv_info_cache[cached_key]
+    invalidate_media_probe(filename)
+
+
+def get_mkv_info(debug, filename, silent):
+    parsed_json, pretty_json = get_cached_mkv_info(filename)
+
+    if parsed_json is None:
+        # Read the track listing straight from the Matroska header when possible
+        parsed_json = read_mkv_info_native(filename)
+        if parsed_json is not None:
+            pretty_json = json.dumps(parsed_json, indent=2)
+            store_mkv_info(filename, parsed_json, pretty_json, verified=False)
+
+    if parsed_json is None:
+        # Probes from earlier runs are kept in the persistent index
+        parsed_json = index_get_probe(filename)
+        if parsed_json is not None:
+            pretty_json = json.dumps(parsed_json, indent=2)
+            store_mkv_info(filename, parsed_json, pretty_json)
+
+    if parsed_json is None:
+        command = ["mkvmerge", "-J", filename]
+        done = False
+        result = None
+        printed = False
+        while not done:
+            result = run_command(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                if not printed and not silent:
+                    print(
+                        f"{GREY}[UTC {get_timestamp()}] [INFO]{RESET} Incoming file(s) detected in input folder. Waiting...")
+                    printed = True
+                time.sleep(5)
+            if result.returncode == 0:
+                done = True
+
+        # Parse the JSON output and pretty-print it
+        parsed_json = json.loads(result.stdout)
+        pretty_json = json.dumps(parsed_json, indent=2)
+        store_mkv_info(filename, parsed_json, pretty_json)
+        index_put_probe(filename, parsed_json)
+
+    # Callers get their own copy so the cached entry is never modified
+    parsed_json = copy.deepcopy(parsed_json)
 
     # Simplifying the JSON
     fields_to_keep = ['file_name', 'tracks']
@@ -154,6 +225,12 @@ def get_mkv_info(debug, filename, silent):
     return parsed_json, pretty_json
 
 
+def get_planned_mkv_info(debug, filename, silent):
+    # Track listing as it will be after the pending remux plan is applied
+    file_info, pretty_json = get_mkv_info(debug, filename, silent)
+    return get_remux_plan(filename).apply_to_file_info(file_info), pretty_json
+
+
 def get_mkv_video_codec(filename):
     codec = None
     parsed_json, _ = get_mkv_info(False, filename, True)
@@ -175,18 +252,8 @@ def check_if_subs_in_mkv(filename):
 
 
 def has_closed_captions(file_path):
-    # Command to get ffprobe output
-    command = ['ffprobe', file_path]
-
-    # Execute the command and capture the output
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    output = result.stdout.decode()
-
-    # Search for "Closed Captions" in the video stream description
-    if "Stream #0:0" in output and "Video:" in output and "Closed Captions" in output:
-        return True
-    else:
-        return False
+    # Closed captions are flagged on the video stream by ffprobe
+    return probe_media(file_path).has_closed_captions
 
 
 def get_all_audio_languages(filename):
@@ -211,62 +278,6 @@ def get_all_subtitle_languages(filename):
     return all_langs
 
 
-def strip_mkv_title_and_track_names(debug, file_path):
-    file_path = Path(file_path)
-
-    # Check if the file exists
-    if not file_path.is_file() or file_path.suffix.lower() != '.mkv':
-        raise ValueError(f"The specified file is not a valid MKV file: {file_path}")
-
-    # Ensure required tools are available
-    for tool in ['mkvpropedit', 'mkvmerge']:
-        if not shutil.which(tool):
-            raise EnvironmentError(f"{tool} is not installed or not in PATH.")
-
-    try:
-        if debug:
-            print(f"{GREY}[UTC {get_timestamp()}] [DEBUG]{RESET} Removing all track names in MKV...")
-
-        # Get track IDs using mkvmerge
-        command = ['mkvmerge', '-i', str(file_path)]
-        if debug:
-            print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        lines = result.stdout.splitlines()
-        track_ids = [int(line.split('Track ID ')[1].split(':')[0]) for line in lines if 'Track ID' in line]
-
-        # Remove track names (mkvpropedit uses 1-based index)
-        for track_id in track_ids:
-            track_index = track_id + 1
-            command = ['mkvpropedit', str(file_path), '--edit', f'track:{track_index}', '--set', 'name=']
-            if debug:
-                print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
-            subprocess.run(
-                command,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-
-        # Remove the title from the MKV file
-        command = ['mkvpropedit', str(file_path), '--edit', 'info', '--set', 'title=']
-        if debug:
-            print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
-
-        subprocess.run(
-            command,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Failed to process file: {file_path}\n{e.stderr}")
-
-
 def get_main_audio_track_language(file_info):
     # Get the main audio language
     for track in file_info['tracks']:
@@ -281,18 +292,20 @@ def get_main_audio_track_language(file_info):
                         return main_audio_track_lang
 
 
-def remove_all_mkv_track_tags(debug, filename):
-    command = ['mkvpropedit', filename,
-               '--edit', 'track:v1', '--set', 'name=',
-               '--set', 'flag-default=1', '-e', 'info', '-s', 'title=']
+def apply_mkv_property_edits(debug, edits):
+    if not edits.has_edits():
+        return
+
+    command = edits.build_command()
 
     if debug:
-        print(f"\n{GREY}[UTC {get_timestamp()}] [DEBUG]{RESET} Removing track tags in MKV...")
+        print(f"\n{GREY}[UTC {get_timestamp()}] [DEBUG]{RESET} Editing track properties in MKV...")
         print('')
         print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}")
         print(f"{RESET}")
 
-    result = subprocess.run(command, capture_output=True, text=True)
+    result = run_command(command, capture_output=True, text=True)
+    invalidate_mkv_info(edits.filename)
     if result.returncode != 0:
         print('')
         print(f"{GREY}[UTC {get_timestamp()}] {RED}[ERROR]{RESET} {result.stdout}")
@@ -311,16 +324,8 @@ def convert_mp4_to_mkv_with_subtitles(debug, mp4_file):
             file.write(cleaned_content)
 
     def get_subtitle_streams(file):
-        cmd = ['ffprobe', '-loglevel', 'error', '-show_streams', file]
-        try:
-            result = subprocess.run(cmd, capture_output=True, check=True)
-            output = result.stdout.decode()
-        except subprocess.CalledProcessError:
-            print(f"Error occurred while running ffprobe on {file}")
-            return None
-
-        pattern = r'\[STREAM\]\nindex=(\d+)\n(?:[^\[]*?)codec_name=mov_text(?:[^\[]*?)\nTAG:language=(\w+)'
-        return re.findall(pattern, output)
+        return [(str(stream.index), stream.language) for stream in probe_media(file).subtitle_streams
+                if stream.codec_name == 'mov_text' and stream.language]
 
     subtitle_streams = get_subtitle_streams(mp4_file)
     if not subtitle_streams:
@@ -332,7 +337,7 @@ def convert_mp4_to_mkv_with_subtitles(debug, mp4_file):
         srt_file = f"{os.path.splitext(mp4_file)[0]}_{index}.{language}.srt"
         cmd = ['ffmpeg', '-y', '-i', mp4_file, '-map', f'0:{index}', '-c:s', 'srt', srt_file]
         try:
-            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            run_command(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
         except subprocess.CalledProcessError:
             print(f"Error occurred while extracting subtitles from {mp4_file}")
             return None
@@ -351,7 +356,7 @@ def convert_mp4_to_mkv_with_subtitles(debug, mp4_file):
         print(f"{RESET}")
 
     try:
-        subprocess.run(mkvmerge_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        run_command(mkvmerge_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
     except subprocess.CalledProcessError:
         print(f"Error occurred while merging files into {mkv_file}")
         return None
@@ -366,21 +371,7 @@ def convert_mp4_to_mkv_with_subtitles(debug, mp4_file):
 def mkv_contains_video(file_path, dirpath):
     input_file = os.path.join(dirpath, file_path)
     try:
-        # Run ffprobe command to get stream information
-        command = [
-            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-            '-show_entries', 'stream=index', '-of', 'json', input_file
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-        # Parse the output
-        probe_data = json.loads(result.stdout)
-
-        # Check if the 'streams' key exists and contains at least one video stream
-        if 'streams' in probe_data and len(probe_data['streams']) > 0:
-            return True
-        else:
-            return False
+        return len(probe_media(input_file).video_streams) > 0
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -403,7 +394,7 @@ def remove_cc_hidden_in_file(debug, filename):
         print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}")
         print(f"{RESET}")
 
-    result = subprocess.run(command, capture_output=True, text=True)
+    result = run_command(command, capture_output=True, text=True)
     if result.returncode != 0:
         print("Error executing ffmpeg command: " + result.stderr)
         print(f"{GREY}[UTC {get_timestamp()}] [INFO]{RESET} Skipping ffmpeg process...")
@@ -414,9 +405,10 @@ def remove_cc_hidden_in_file(debug, filename):
     else:
         os.remove(filename)
         shutil.move(temp_filename, filename)
+        invalidate_mkv_info(filename)
 
 
-def trim_audio_in_mkv_files(logger, debug, input_files, dirpath):
+def trim_audio_in_mkv_files(logger, debug, input_files, dirpath, quarantine=None):
     total_files = len(input_files)
     mkv_files_need_processing_audio = [None] * total_files
     mkv_files_need_processing_subs = [None] * total_files
@@ -429,11 +421,12 @@ def trim_audio_in_mkv_files(logger, debug, input_files, dirpath):
     # Initialize progress
     print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_worker_threads) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', max_worker_threads) as executor:
         futures = {executor.submit(trim_audio_in_mkv_files_worker, debug, input_file, dirpath): index for
-                   index, input_file in enumerate(input_files)}
+                   index, input_file in order_by_estimated_cost(input_files, dirpath)}
 
+        failed_files = {}
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             print_with_progress(logger, completed_count, total_files, header=header, description=description)
             try:
@@ -446,6 +439,9 @@ def trim_audio_in_mkv_files(logger, debug, input_files, dirpath):
                 if missing_subs_langs is not None:
                     all_missing_subs_langs[index] = missing_subs_langs
             except Exception as e:
+                if quarantine is not None:
+                    failed_files[index] = e
+                    continue
                 for file in input_files:
                     base, extension = os.path.splitext(file)
                     new_base = base + "_tmp"
@@ -454,6 +450,14 @@ def trim_audio_in_mkv_files(logger, debug, input_files, dirpath):
                         os.remove(temp_filename)
                 raise CorruptedFile(original_exception=e)
 
+    # Failed files leave the batch, the caller carries on with the rest of input_files
+    for index in sorted(failed_files, reverse=True):
+        input_file = input_files.pop(index)
+        quarantine.add(dirpath, input_file, failed_files[index], get_sidecar_files(dirpath, input_file))
+        del mkv_files_need_processing_audio[index]
+        del mkv_files_need_processing_subs[index]
+        del all_missing_subs_langs[index]
+
     return mkv_files_need_processing_audio, mkv_files_need_processing_subs, all_missing_subs_langs
 
 
@@ -461,6 +465,11 @@ def trim_audio_in_mkv_files_worker(debug, input_file, dirpath):
     input_file = os.path.join(dirpath, input_file)
     check_integrity_of_mkv(input_file)
 
+    # Files repacked by an earlier run only need the final clean-up
+    completed_stages = index_get_stages(input_file, get_config_fingerprint('audio', 'subtitles'))
+    if 'repack' in completed_stages:
+        return False, False, []
+
     # Get file info using mkvinfo
     file_info, pretty_file_info = get_mkv_info(debug, input_file, False)
 
@@ -470,15 +479,26 @@ def trim_audio_in_mkv_files_worker(debug, input_file, dirpath):
     pref_subs_langs = check_config(config, 'subtitles', 'pref_subs_langs')
     download_missing_subs = check_config(config, 'subtitles', 'download_missing_subs')
 
+    audio_config_fingerprint = get_config_fingerprint('audio')
+    audio_plan = index_get_plan(input_file, 'audio', audio_config_fingerprint)
+    if audio_plan is None:
+        audio_plan = get_wanted_audio_tracks(
+            debug, file_info, pref_audio_langs, remove_commentary, pref_audio_formats)
+        index_put_plan(input_file, 'audio', audio_config_fingerprint, audio_plan)
+
     (wanted_audio_tracks, default_audio_track, needs_processing_audio,
      pref_audio_formats_found, track_ids_to_be_converted,
-     track_langs_to_be_converted, track_names_to_be_converted) = get_wanted_audio_tracks(
-        debug, file_info, pref_audio_langs, remove_commentary, pref_audio_formats)
+     track_langs_to_be_converted, track_names_to_be_converted) = audio_plan
 
-    if needs_processing_audio:
-        strip_audio_tracks_in_mkv(debug, input_file, wanted_audio_tracks, default_audio_track)
+    # The audio selection is only recorded here and applied by the final remux
+    if needs_processing_audio and 'filter_audio' not in completed_stages:
+        if debug:
+            print(f"{GREY}\n[UTC {get_timestamp()}] [DEBUG]{RESET} filter audio tracks:\n")
+            print(f"{BLUE}audio tracks to keep{RESET}: {wanted_audio_tracks}")
+            print(f"{BLUE}default audio track{RESET}: {default_audio_track}")
+        get_remux_plan(input_file).select_audio(wanted_audio_tracks, default_audio_track)
 
-    file_info, pretty_file_info = get_mkv_info(debug, input_file, False)
+    file_info, pretty_file_info = get_planned_mkv_info(debug, input_file, False)
 
     (wanted_subs_tracks, default_subs_track,
      needs_sdh_removal, needs_convert, sub_filetypes,
@@ -536,10 +556,10 @@ def generate_audio_tracks_in_mkv_files(logger, debug, input_files, dirpath, need
         # Initialize progress
         print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(generate_audio_tracks_in_mkv_files_worker, debug, input_file, dirpath,
-                                   internal_threads): index for index, input_file in enumerate(input_files)}
+                                   internal_threads): index for index, input_file in order_by_estimated_cost(input_files, dirpath)}
 
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             if not disable_print:
@@ -581,7 +601,7 @@ def generate_audio_tracks_in_mkv_files_worker(debug, input_file, dirpath, intern
     remove_commentary = check_config(config, 'audio', 'remove_commentary')
 
     # Get updated file info after mkv tracks reduction
-    file_info, pretty_file_info = get_mkv_info(False, input_file, True)
+    file_info, pretty_file_info = get_planned_mkv_info(False, input_file, True)
 
     (wanted_audio_tracks, default_audio_track, needs_processing_audio,
      pref_audio_formats_found, track_ids_to_be_converted,
@@ -633,8 +653,8 @@ def extract_subs_in_mkv_process(logger, debug, input_files, dirpath):
     disable_print = True if all(
         check_if_subs_in_mkv(os.path.join(dirpath, file)) == False for file in input_files) else False
 
-    # Calculate number of workers and internal threads
-    max_worker_threads = get_worker_thread_count()
+    # Calculate number of workers and internal threads, extraction is limited by the disk
+    max_worker_threads = get_io_worker_count(dirpath)
     num_workers = max(1, max_worker_threads)
     internal_threads = max(1, max_worker_threads // num_workers)
 
@@ -642,11 +662,11 @@ def extract_subs_in_mkv_process(logger, debug, input_files, dirpath):
         # Initialize progress
         print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {
             executor.submit(extract_subs_in_mkv_process_worker, debug, input_file, dirpath, internal_threads): index for
-            index, input_file in enumerate(input_files)}
+            index, input_file in order_by_estimated_cost(input_files, dirpath)}
 
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             if not disable_print:
@@ -678,7 +698,7 @@ def extract_subs_in_mkv_process_worker(debug, input_file, dirpath, internal_thre
     pref_subs_langs = check_config(config, 'subtitles', 'pref_subs_langs')
 
     # Get updated file info after mkv tracks reduction
-    file_info, pretty_file_info = get_mkv_info(debug, input_file_with_path, True)
+    file_info, pretty_file_info = get_planned_mkv_info(debug, input_file_with_path, True)
 
     (wanted_subs_tracks, a, b, needs_convert,
      sub_filetypes, subs_track_languages,
@@ -734,10 +754,10 @@ def convert_to_srt_process(logger, debug, input_files, dirpath, subtitle_files_l
         # Initialize progress
         print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(convert_to_srt_process_worker, logger, debug, input_file, dirpath, internal_threads,
-                                   sub_files[index], memory_per_thread): index for index, input_file in enumerate(input_files)}
+                                   sub_files[index], memory_per_thread): index for index, input_file in order_by_estimated_cost(input_files, dirpath)}
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             try:
                 if not disable_print and completed_count < total_files:
@@ -781,6 +801,13 @@ def convert_to_srt_process(logger, debug, input_files, dirpath, subtitle_files_l
             else:
                 print_with_progress(logger, completed_count, total_files, header=header, description=description)
 
+    print_subtitle_conversion_summary(logger, all_replacements_list, all_errored_subs, errored_subs_bool)
+
+    return (all_ready_subtitle_tracks, subtitle_tracks_to_be_processed, subtitle_tracks_all,
+            all_missing_subs_langs, all_errored_subs, main_audio_track_langs_list)
+
+
+def print_subtitle_conversion_summary(logger, all_replacements_list, all_errored_subs, errored_subs_bool):
     all_replacements_list_count = len([item for list in all_replacements_list for item in list])
 
     if all_replacements_list_count:
@@ -817,9 +844,6 @@ def convert_to_srt_process(logger, debug, input_files, dirpath, subtitle_files_l
         for index, sub in enumerate(errored_subs_print):
             log_debug(logger, f"[OCR ERROR] '{sub}'")
 
-    return (all_ready_subtitle_tracks, subtitle_tracks_to_be_processed, subtitle_tracks_all,
-            all_missing_subs_langs, all_errored_subs, main_audio_track_langs_list)
-
 
 def convert_to_srt_process_worker(logger, debug, input_file, dirpath, internal_threads, subtitle_files, memory_per_thread):
     input_file_with_path = os.path.join(dirpath, input_file)
@@ -829,7 +853,7 @@ def convert_to_srt_process_worker(logger, debug, input_file, dirpath, internal_t
     pref_subs_langs = check_config(config, 'subtitles', 'pref_subs_langs')
 
     # Get updated file info after mkv tracks reduction
-    file_info, pretty_file_info = get_mkv_info(False, input_file_with_path, True)
+    file_info, pretty_file_info = get_planned_mkv_info(False, input_file_with_path, True)
     # Get main audio track language
     main_audio_track_lang = get_main_audio_track_language(file_info)
 
@@ -864,8 +888,8 @@ def get_subtitle_tracks_metadata_for_repack(logger, subtitle_files_list):
     num_workers = max(1, max_worker_threads)
     internal_threads = max(1, max_worker_threads // num_workers)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(return_subtitle_metadata_worker, subtitle_files_list[index], internal_threads): index
                    for index, input_file in enumerate(subtitle_files_list)}
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
@@ -927,8 +951,8 @@ def remove_sdh_process(logger, debug, subtitle_files_to_process_list):
         # Initialize progress
         print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(remove_sdh_process_worker, logger, debug, list, internal_threads,
                                    memory_per_thread): index for index, list in enumerate(subtitle_files_to_process_list)}
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
@@ -986,28 +1010,10 @@ def fetch_missing_subtitles_process(logger, debug, input_files, dirpath, total_e
     description = f"Process missing subtitles"
 
     for index, input_file in enumerate(input_files):
-        input_file_with_path = os.path.join(dirpath, input_file)
-        mkv_base, _, mkv_extension = input_file_with_path.rpartition('.')
-
-        truly_missing_subs_langs = []
-        for lang in all_missing_subs_langs[index]:
-            if lang != 'none' and lang and lang.lower() != 'und':
-                if any(sub for sub in total_external_subs):
-                    input_file_base = re.sub(r'^[^/]+/', '', input_files[index]).replace(".mkv", "")
-                    if any(input_file_base in re.sub(r'^[^/]+/', '', sub).replace(".mkv", "") for sublist in
-                           total_external_subs for sub in sublist):
-                        if not any(lang[:-1] in re.sub(r'^[^/]+/', '', sub).replace(".mkv", "") for sublist in
-                                   total_external_subs for sub in sublist):
-                            truly_missing_subs_langs.append(lang[:-1])
-                else:
-                    truly_missing_subs_langs.append(lang[:-1])
-        all_truly_missing_subs_langs.append(truly_missing_subs_langs)
+        all_truly_missing_subs_langs.append(
+            get_truly_missing_subs_langs(input_file, all_missing_subs_langs[index], total_external_subs))
 
-    # Copy default or user subliminal config file to dirpath
-    if os.path.exists('subliminal.toml'):
-        shutil.copy('subliminal.toml', os.path.join(dirpath, 'subliminal.toml'))
-    else:
-        shutil.copy('subliminal_defaults.toml', os.path.join(dirpath, 'subliminal.toml'))
+    copy_subliminal_config(dirpath)
 
     # Calculate number of workers and internal threads
     max_worker_threads = get_worker_thread_count()
@@ -1017,9 +1023,9 @@ def fetch_missing_subtitles_process(logger, debug, input_files, dirpath, total_e
     # Initialize progress
     print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
+    # Run the tasks on the shared worker pool
     # Max workers is set to 1 to throttle downloads with Subliminal
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+    with worker_pool('files', 1) as executor:
         futures = {executor.submit(fetch_missing_subtitles_process_worker, debug, input_file, dirpath,
                                    all_truly_missing_subs_langs[index], internal_threads): index for index, input_file
                    in enumerate(input_files)}
@@ -1054,6 +1060,38 @@ def fetch_missing_subtitles_process(logger, debug, input_files, dirpath, total_e
                 print_no_timestamp(logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
                 raise
 
+    print_missing_subtitles_summary(logger, all_truly_missing_subs_langs, all_downloaded_subs, all_failed_downloads,
+                                    all_downloaded_subs_simple, all_failed_downloads_simple)
+
+    return all_downloaded_subs
+
+
+def get_truly_missing_subs_langs(input_file, missing_subs_langs, total_external_subs):
+    truly_missing_subs_langs = []
+    for lang in missing_subs_langs:
+        if lang != 'none' and lang and lang.lower() != 'und':
+            if any(sub for sub in total_external_subs):
+                input_file_base = re.sub(r'^[^/]+/', '', input_file).replace(".mkv", "")
+                if any(input_file_base in re.sub(r'^[^/]+/', '', sub).replace(".mkv", "") for sublist in
+                       total_external_subs for sub in sublist):
+                    if not any(lang[:-1] in re.sub(r'^[^/]+/', '', sub).replace(".mkv", "") for sublist in
+                               total_external_subs for sub in sublist):
+                        truly_missing_subs_langs.append(lang[:-1])
+            else:
+                truly_missing_subs_langs.append(lang[:-1])
+    return truly_missing_subs_langs
+
+
+def copy_subliminal_config(dirpath):
+    # Copy default or user subliminal config file to dirpath
+    if os.path.exists('subliminal.toml'):
+        shutil.copy('subliminal.toml', os.path.join(dirpath, 'subliminal.toml'))
+    else:
+        shutil.copy('subliminal_defaults.toml', os.path.join(dirpath, 'subliminal.toml'))
+
+
+def print_missing_subtitles_summary(logger, all_truly_missing_subs_langs, all_downloaded_subs, all_failed_downloads,
+                                    all_downloaded_subs_simple, all_failed_downloads_simple):
     success_len = len((set(f"'{item}'" for sublist in all_downloaded_subs for item in sublist)))
     failed_len = len((set(f"'{item}'" for sublist in all_failed_downloads for item in sublist)))
     truly_missing_subs_count = len((set(f"'{item}'" for sublist in all_truly_missing_subs_langs for item in sublist)))
@@ -1098,8 +1136,6 @@ def fetch_missing_subtitles_process(logger, debug, input_files, dirpath, total_e
                 else:
                     custom_print(logger, f"{GREY}[SUBLIMINAL]{RESET} {info}")
 
-    return all_downloaded_subs
-
 
 def fetch_missing_subtitles_process_worker(debug, input_file, dirpath, missing_subs_langs, internal_threads):
     a, filename = unflatten_file(input_file, '')
@@ -1134,8 +1170,9 @@ def fetch_missing_subtitles_process_worker(debug, input_file, dirpath, missing_s
             # Sleep for random 1-3 seconds to not overwhelm the subliminal service providers
             time.sleep(random.uniform(1.0, 3.0))
 
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=dirpath)
-            stdout, stderr = process.communicate()
+            with command_reservation(command):
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=dirpath)
+                stdout, stderr = process.communicate()
             return_code = process.returncode
 
             if debug:
@@ -1174,10 +1211,10 @@ def resync_sub_process(logger, debug, input_files, dirpath, subtitle_files_to_pr
         # Initialize progress
         print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(resync_subs_process_worker, debug, input_file, dirpath,
-                                   subtitle_files_to_process_list[index], internal_threads): index for index, input_file in enumerate(input_files)}
+                                   subtitle_files_to_process_list[index], internal_threads): index for index, input_file in order_by_estimated_cost(input_files, dirpath)}
 
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             if not disable_print:
@@ -1208,15 +1245,25 @@ def resync_subs_process_worker(debug, input_file, dirpath, subtitle_files_to_pro
     resync_subtitles = check_config(config, 'subtitles', 'resync_subtitles')
 
     if resync_subtitles:
-        resync_srt_subs(internal_threads, debug, input_file_with_path, subtitle_files_to_process)
-
-
-def remove_clutter_process(logger, debug, input_files, dirpath):
+        # Sync against the audio track that will be the default one after remuxing
+        plan = get_remux_plan(input_file_with_path)
+        reference_stream = None
+        if plan.default_audio_track is not None:
+            file_info, _ = get_mkv_info(False, input_file_with_path, True)
+            audio_track_ids = [track['id'] for track in file_info['tracks'] if track['type'] == 'audio']
+            if plan.default_audio_track in audio_track_ids:
+                reference_stream = f"0:a:{audio_track_ids.index(plan.default_audio_track)}"
+        resync_srt_subs(internal_threads, debug, input_file_with_path, subtitle_files_to_process, reference_stream)
+
+
+def remove_clutter_process(logger, debug, input_files, dirpath, quarantine=None):
     total_files = len(input_files)
     all_updated_input_files = [None] * total_files
+    failed_indexes = []
     hidden_cc_found = False
 
-    max_worker_threads = get_worker_thread_count()
+    # Every worker rewrites a whole file, so size the pool from the disk
+    max_worker_threads = get_io_worker_count(dirpath)
     num_workers = max(1, max_worker_threads)
 
     header = "FFMPEG"
@@ -1227,10 +1274,10 @@ def remove_clutter_process(logger, debug, input_files, dirpath):
         # Initialize progress
         print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(remove_clutter_process_worker, debug, input_file, dirpath): index for
-                   index, input_file in enumerate(input_files)}
+                   index, input_file in order_by_estimated_cost(input_files, dirpath)}
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             if hidden_cc_found:
                 print_with_progress(logger, completed_count, total_files, header=header, description=description)
@@ -1240,20 +1287,30 @@ def remove_clutter_process(logger, debug, input_files, dirpath):
                 if updated_filename is not None:
                     all_updated_input_files[index] = updated_filename
             except Exception as e:
-                raise CorruptedFile
-    return all_updated_input_files
+                if quarantine is None:
+                    raise CorruptedFile
+                quarantine.add(dirpath, input_files[index], e)
+                failed_indexes.append(index)
+
+    # Failed files leave the batch
+    return [file for index, file in enumerate(all_updated_input_files) if index not in failed_indexes]
 
 
 def remove_clutter_process_worker(debug, input_file, dirpath):
     input_file_with_path = os.path.join(dirpath, input_file)
     updated_filename = input_file
 
-    file_tag = check_config(config, 'general', 'file_tag')
-    remove_all_title_names = check_config(config, 'general', 'remove_all_title_names')
+    # Track names, flags and the title have already been cleaned up if the file was remuxed,
+    # otherwise all of them are edited in place with one mkvpropedit run
+    plan = get_remux_plan(input_file_with_path)
+    if not plan.applied:
+        file_info, _ = get_mkv_info(False, input_file_with_path, True)
+        apply_mkv_property_edits(debug, plan.get_property_edits(file_info))
+    pop_remux_plan(input_file_with_path)
 
-    remove_all_mkv_track_tags(debug, input_file_with_path)
-    if remove_all_title_names:
-        strip_mkv_title_and_track_names(debug, input_file_with_path)
+    # The remux was written to the output library under its final name already
+    if plan.written_to_output:
+        return get_tagged_filename(input_file)
 
     mkv_video_codec = get_mkv_video_codec(input_file_with_path)
     if has_closed_captions(input_file_with_path):
@@ -1262,18 +1319,105 @@ def remove_clutter_process_worker(debug, input_file, dirpath):
         if mkv_video_codec != 'MPEG-1/2':
             remove_cc_hidden_in_file(debug, input_file_with_path)
 
-    if file_tag.lower() != "default" and not input_file.lower().startswith('snapchat'):
-        updated_filename = replace_tags_in_file(input_file, file_tag)
+    updated_filename = get_tagged_filename(input_file)
+    if updated_filename != input_file:
         updated_filename_with_path = os.path.join(dirpath, updated_filename)
         shutil.move(input_file_with_path, updated_filename_with_path)
+        invalidate_mkv_info(input_file_with_path)
 
     return updated_filename
 
 
+def get_tagged_filename(input_file):
+    file_tag = check_config(config, 'general', 'file_tag')
+
+    if file_tag.lower() != "default" and not input_file.lower().startswith('snapchat'):
+        return replace_tags_in_file(input_file, file_tag)
+    return input_file
+
+
+# Output paths worked out ahead of the move, keyed by the file's final path in TEMP
+planned_output_paths = {}
+planned_output_paths_lock = threading.Lock()
+
+
+def plan_output_paths_process(logger, debug, input_files, dirpath, all_dirnames, output_dir):
+    # Works out where each file will end up, so the final remux of files that are
+    # not touched again afterwards can be written straight to the output folder
+    max_worker_threads = get_worker_thread_count()
+    num_workers = max(1, max_worker_threads)
+
+    # Limit workers to not hit TVMAZE rate limiting
+    normalize_filenames = check_config(config, 'general', 'normalize_filenames')
+    if normalize_filenames.lower() in ('full', 'full-jf'):
+        num_workers = min(2, max_worker_threads)
+
+    with worker_pool('files', num_workers) as executor:
+        futures = {executor.submit(plan_output_paths_process_worker, logger, debug, input_file, dirpath,
+                                   all_dirnames, output_dir): input_file for input_file in input_files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                # Print the error and traceback
+                custom_print(logger, f"{RED}[ERROR]{RESET} {e}")
+                print_no_timestamp(logger, f"  {BLUE}input_file{RESET}: {futures[future]}")
+                print_no_timestamp(logger, f"  {BLUE}dirpath{RESET}: {dirpath}")
+                traceback_str = ''.join(traceback.format_tb(e.__traceback__))
+                print_no_timestamp(logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
+                raise
+
+
+def plan_output_paths_process_worker(logger, debug, input_file, dirpath, all_dirnames, output_dir):
+    input_file_with_path = os.path.join(dirpath, input_file)
+    final_file_with_path = os.path.join(dirpath, get_tagged_filename(input_file))
+
+    output_info = get_output_file_path(logger, debug, final_file_with_path, output_dir, all_dirnames)
+    with planned_output_paths_lock:
+        planned_output_paths[os.path.abspath(final_file_with_path)] = output_info
+
+    # Removing hidden CC rewrites the file after the remux
+    if has_closed_captions(input_file_with_path) and get_mkv_video_codec(input_file_with_path) != 'MPEG-1/2':
+        return
+    get_remux_plan(input_file_with_path).output_info = output_info
+
+
+def get_planned_output_path(filename):
+    with planned_output_paths_lock:
+        return planned_output_paths.get(os.path.abspath(filename))
+
+
+def set_planned_output_path(filename, output_info):
+    with planned_output_paths_lock:
+        planned_output_paths[os.path.abspath(filename)] = output_info
+
+
+def pop_planned_output_path(filename):
+    with planned_output_paths_lock:
+        return planned_output_paths.pop(os.path.abspath(filename), None)
+
+
+# Files whose remux went straight into the output library, under both their
+# original and their tagged name, as they are no longer in TEMP
+written_to_output_files = set()
+
+
+def mark_written_to_output(filename):
+    tagged_filename = os.path.join(os.path.dirname(filename), get_tagged_filename(os.path.basename(filename)))
+    with planned_output_paths_lock:
+        written_to_output_files.update({os.path.abspath(filename), os.path.abspath(tagged_filename)})
+
+
+def is_written_to_output(filename):
+    with planned_output_paths_lock:
+        return os.path.abspath(filename) in written_to_output_files
+
+
 def repack_mkv_tracks_process(logger, debug, input_files, dirpath, audio_tracks_list,
                               subtitle_tracks_list):
     total_files = len(input_files)
-    max_worker_threads = get_worker_thread_count()
+    # Every worker rewrites a whole file, so size the pool from the disk
+    max_worker_threads = get_io_worker_count(dirpath)
     num_workers = max(1, max_worker_threads)
 
     header = "MKVMERGE"
@@ -1282,11 +1426,11 @@ def repack_mkv_tracks_process(logger, debug, input_files, dirpath, audio_tracks_
     # Initialize progress
     print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {
             executor.submit(repack_mkv_tracks_process_worker, debug, input_file, dirpath, audio_tracks_list[index],
-                            subtitle_tracks_list[index]): index for index, input_file in enumerate(input_files)}
+                            subtitle_tracks_list[index]): index for index, input_file in order_by_estimated_cost(input_files, dirpath)}
 
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             print_with_progress(logger, completed_count, total_files, header=header, description=description)
@@ -1317,6 +1461,44 @@ def repack_mkv_tracks_process_worker(debug, input_file, dirpath, audio_tracks, s
     repack_tracks_in_mkv(debug, input_file_with_path, audio_tracks, subtitle_tracks)
 
 
+def apply_remux_plans_process(logger, debug, input_files, dirpath):
+    # Remuxes files whose plan changes tracks, when nothing needs to be repacked into them
+    input_files = [file for file in input_files if remux_plan_pending(os.path.join(dirpath, file))]
+    total_files = len(input_files)
+    # Every worker rewrites a whole file, so size the pool from the disk
+    max_worker_threads = get_io_worker_count(dirpath)
+    num_workers = max(1, max_worker_threads)
+
+    header = "MKVMERGE"
+    description = "Apply track changes"
+
+    # Initialize progress
+    print_with_progress(logger, 0, total_files, header=header, description=description)
+
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
+        futures = {executor.submit(execute_remux_plan, debug, os.path.join(dirpath, input_file)): index
+                   for index, input_file in order_by_estimated_cost(input_files, dirpath)}
+
+        for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            print_with_progress(logger, completed_count, total_files, header=header, description=description)
+            try:
+                future.result()
+            except Exception as e:
+                # Fetch the variables that were passed to the thread
+                index = futures[future]
+                input_file = input_files[index]
+
+                # Print the error and traceback
+                custom_print(logger, f"{RED}[ERROR]{RESET} {e}")
+                print_no_timestamp(logger, f"  {BLUE}debug{RESET}: {debug}")
+                print_no_timestamp(logger, f"  {BLUE}input_file{RESET}: {input_file}")
+                print_no_timestamp(logger, f"  {BLUE}dirpath{RESET}: {dirpath}")
+                traceback_str = ''.join(traceback.format_tb(e.__traceback__))
+                print_no_timestamp(logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
+                raise
+
+
 def process_external_subs(logger, debug, dirpath, input_files, all_missing_subs_langs):
     total_files = len(input_files)
     subtitle_tracks_to_be_processed = [None] * total_files
@@ -1331,11 +1513,11 @@ def process_external_subs(logger, debug, dirpath, input_files, all_missing_subs_
     # Initialize progress
     print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(process_external_subs_worker, debug, input_file, dirpath,
                                    all_missing_subs_langs[index]): index for index, input_file in
-                   enumerate(input_files)}
+                   order_by_estimated_cost(input_files, dirpath)}
         for completed_count, future in enumerate(concurrent.futures.as_completed(futures), 1):
             print_with_progress(logger, completed_count, total_files, header=header, description=description)
             try:
@@ -1393,7 +1575,7 @@ def process_external_subs_worker(debug, input_file, dirpath, missing_subs_langs)
     base_name_normalized = normalize_title(raw_name_no_ext)
 
     input_file_with_path = os.path.join(dirpath, input_file)
-    file_info, _ = get_mkv_info(False, input_file_with_path, False)
+    file_info, _ = get_planned_mkv_info(False, input_file_with_path, False)
     main_audio_track_lang = get_main_audio_track_language_3_letter(file_info)
     all_langs = []
     all_sub_files = []
@@ -1519,7 +1701,7 @@ def process_external_subs_worker(debug, input_file, dirpath, missing_subs_langs)
         if pref_subs_langs:
             updated_missing_subs_langs = pref_subs_langs
         else:
-            file_info = get_mkv_info(False, input_file_with_path, True)
+            file_info, _ = get_planned_mkv_info(False, input_file_with_path, True)
             main_lang = get_main_audio_track_language_3_letter(file_info)
             updated_missing_subs_langs = [main_lang]
 
@@ -1535,7 +1717,8 @@ def move_files_to_output_process(logger, debug, input_files, dirpath, all_dirnam
     new_radarr_paths = [None] * total_files
     new_sonarr_paths = [None] * total_files
 
-    max_worker_threads = get_worker_thread_count()
+    # Moves are limited by the disks on both ends
+    max_worker_threads = get_io_worker_count(dirpath, output_dir)
     num_workers = max(1, max_worker_threads)
 
     # If filenames are to be fully normalized,
@@ -1552,8 +1735,8 @@ def move_files_to_output_process(logger, debug, input_files, dirpath, all_dirnam
     # Initialize progress
     print_with_progress(logger, 0, total_files, header=header, description=description)
 
-    # Use ThreadPoolExecutor to handle multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+    # Run the tasks on the shared worker pool
+    with worker_pool('files', num_workers) as executor:
         futures = {executor.submit(move_files_to_output_process_worker, logger, debug, input_file, dirpath, all_dirnames,
                                    output_dir): index for index, input_file in enumerate(files)}
 
@@ -1573,6 +1756,10 @@ def move_files_to_output_process(logger, debug, input_files, dirpath, all_dirnam
                 print_no_timestamp(logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
                 raise
 
+    print_arr_update_summary(logger, new_radarr_paths, new_sonarr_paths)
+
+
+def print_arr_update_summary(logger, new_radarr_paths, new_sonarr_paths):
     new_radarr_paths_len = sum(1 for item in new_radarr_paths if item.strip() != '')
     new_sonarr_paths_len = sum(1 for item in new_sonarr_paths if item.strip() != '')
 
@@ -1602,7 +1789,9 @@ def move_files_to_output_process_worker(logger, debug, input_file, dirpath, all_
     radarr_api_key = check_config(config, 'integrations', 'radarr_api_key')
     sonarr_api_key = check_config(config, 'integrations', 'sonarr_api_key')
 
-    output_info = move_file_to_output(logger, debug, input_file_with_path, output_dir, all_dirnames)
+    output_info = move_file_to_output(logger, debug, input_file_with_path, output_dir, all_dirnames,
+                                      pop_planned_output_path(input_file_with_path))
+    invalidate_mkv_info(input_file_with_path)
 
     file_info = reformat_filename(output_info["filename"], True, False, False)
     media_type = file_info["media_type"]
@@ -1619,56 +1808,90 @@ def move_files_to_output_process_worker(logger, debug, input_file, dirpath, all_
     return new_radarr_path, new_sonarr_path
 
 
-def strip_audio_tracks_in_mkv(debug, filename, audio_tracks, default_audio_track):
-    if debug:
-        print(f"{GREY}\n[UTC {get_timestamp()}] [DEBUG]{RESET} strip_audio_tracks_in_mkv:\n")
-        print(f"{BLUE}audio tracks to keep{RESET}: {audio_tracks}")
-        print(f"{BLUE}default audio track{RESET}: {default_audio_track}")
-
-    # If no audio tracks has been selected, copy all as fallback,
-    # else, generate copy string
-    if len(audio_tracks) == 0:
-        audio = ''
-        audio_tracks_str = ''
-        audio_default_track = ''
-        default_audio_track_str = ''
-    else:
-        audio = '--atracks'
-        audio_tracks_str = ','.join(map(str, audio_tracks))
-        audio_default_track = "--default-track"
-        default_audio_track_str = f'{default_audio_track}:yes'
+def execute_remux_plan(debug, filename):
+    plan = get_remux_plan(filename)
+    file_info, _ = get_mkv_info(False, filename, True)
 
-    base, extension = os.path.splitext(filename)
-    new_base = base + "_tmp"
-    temp_filename = new_base + extension
+    # Only flags, names or the title change, edit the headers in place
+    if plan.is_metadata_only(file_info):
+        apply_mkv_property_edits(debug, plan.get_property_edits(file_info))
+        plan.applied = True
+        index_mark_stages(filename, ['filter_audio', 'repack'], get_config_fingerprint('audio', 'subtitles'))
+        return
 
-    command = ["mkvmerge",
-               "--output", temp_filename,
-               audio, audio_tracks_str,
-               audio_default_track, default_audio_track_str] + [filename]
-    # Remove empty entries
-    command = [arg for arg in command if arg]
+    if plan.output_info is not None:
+        # Nothing rewrites the file after this, so mux straight into the output
+        # folder and skip the copy out of TEMP
+        output_path = plan.output_info["output_path"]
+        output_base, extension = os.path.splitext(os.path.basename(output_path))
+        temp_filename = os.path.join(os.path.dirname(output_path), f".{output_base}.partial{extension}")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    else:
+        base, extension = os.path.splitext(filename)
+        new_base = base + "_tmp"
+        temp_filename = new_base + extension
+
+    command = plan.build_mkvmerge_command(file_info, temp_filename)
 
     if debug:
         print('')
         print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}")
         print(f"{RESET}")
 
-    result = subprocess.run(command, capture_output=True, text=True)
-    if result.returncode not in (0, 1):
-        os.remove(temp_filename)
-        result.check_returncode()
+    try:
+        result = run_command(command, capture_output=True, text=True)
+
+        # mkvmerge returns 1 for warnings, which still produce a usable file
+        if result.returncode not in (0, 1):
+            print('')
+            print(f"{GREY}[UTC {get_timestamp()}] {RED}[ERROR]{RESET} {result.stdout}")
+            print(f"{RESET}")
+            result.check_returncode()
+
+        if plan.output_info is not None:
+            os.replace(temp_filename, output_path)
+    except BaseException:
+        # A half written '.partial' file must not stay behind in the output library
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+    if plan.output_info is not None:
+        os.remove(filename)
+        invalidate_mkv_info(filename)
+        plan.written_to_output = True
+        mark_written_to_output(filename)
+        plan.applied = True
+        index_mark_stages(output_path, ['filter_audio', 'repack'], get_config_fingerprint('audio', 'subtitles'))
+        return
 
     os.remove(filename)
     shutil.move(temp_filename, filename)
+    invalidate_mkv_info(filename)
+    plan.applied = True
+    index_mark_stages(filename, ['filter_audio', 'repack'], get_config_fingerprint('audio', 'subtitles'))
 
 
 def check_integrity_of_mkv(filename):
-    command = ["mkvmerge", "--identify", filename]
+    # A file with a cached mkvmerge probe has already been read successfully
+    parsed_json, _ = get_cached_mkv_info(filename, verified_only=True)
+    if parsed_json is not None:
+        return
 
-    result = subprocess.run(command, capture_output=True, text=True)
+    parsed_json = index_get_probe(filename)
+    if parsed_json is not None:
+        store_mkv_info(filename, parsed_json, json.dumps(parsed_json, indent=2))
+        return
+
+    command = ["mkvmerge", "-J", filename]
+
+    result = run_command(command, capture_output=True, text=True)
     result.check_returncode()
 
+    parsed_json = json.loads(result.stdout)
+    store_mkv_info(filename, parsed_json, json.dumps(parsed_json, indent=2))
+    index_put_probe(filename, parsed_json)
+
 
 def repack_tracks_in_mkv(debug, filename, audio_tracks, subtitle_tracks):
     pref_audio_langs = check_config(config, 'audio', 'pref_audio_langs')
@@ -1680,17 +1903,10 @@ def repack_tracks_in_mkv(debug, filename, audio_tracks, subtitle_tracks):
     base, extension = os.path.splitext(filename)
 
     def get_codec_and_channels(filepath):
-        cmd = [
-            "ffprobe", "-v", "quiet", "-select_streams", "a:0",
-            "-show_entries", "stream=codec_name,channels",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            filepath
-        ]
-        res = subprocess.run(cmd, capture_output=True, text=True)
-        lines = res.stdout.strip().splitlines()
-        codec = unify_codec(lines[0].lower() if lines else "unknown")
-        channels = int(lines[1]) if len(lines) > 1 else 0
-        return codec, channels
+        audio_streams = probe_media(filepath).audio_streams
+        if not audio_streams:
+            return unify_codec("unknown"), 0
+        return unify_codec(audio_streams[0].codec_name.lower()), audio_streams[0].channels
 
     def unify_codec(acodec):
         if acodec.startswith("dts"):
@@ -1780,9 +1996,6 @@ def repack_tracks_in_mkv(debug, filename, audio_tracks, subtitle_tracks):
     sub_track_names = subtitle_tracks['sub_names']
     sub_track_forced = subtitle_tracks['sub_forced']
 
-    sub_files_list = []
-    audio_files_list = []
-
     final_sub_filetypes = []
     final_sub_languages = []
     final_sub_track_ids = []
@@ -1876,77 +2089,50 @@ def repack_tracks_in_mkv(debug, filename, audio_tracks, subtitle_tracks):
               f"\n  {BLUE}names{RESET}: {final_sub_track_names}"
               f"\n  {BLUE}forced{RESET}: {final_sub_track_forced}")
 
-    base, extension = os.path.splitext(filename)
-    new_base = base + "_tmp"
-    temp_filename = new_base + extension
+    # Record the new tracks in the remux plan; they replace the original
+    # audio (if any was generated) and subtitle tracks
+    plan = get_remux_plan(filename)
+    plan.replace_audio = bool(audio_filetypes)
+    plan.replace_subtitles = True
 
     default_locked = False
 
     for index, filetype in enumerate(final_audio_filetypes):
         if not default_locked:
-            default_track_str = "0:yes"
+            default_track = True
             default_locked = True
         else:
-            default_track_str = "0:no"
-        lang_str = f"0:{final_audio_languages[index]}"
-        name_str = f"0:{final_audio_track_names[index]}"
+            default_track = False
         try:
             final_audio_language = pycountry.languages.get(alpha_3=final_audio_languages[index]).alpha_2
         except:
             final_audio_language = final_audio_languages[index][:-1]
         filelist_str = f"{base}.{final_audio_track_ids[index]}.{final_audio_language}.{filetype}"
-        audio_files_list += ('--default-track', default_track_str,
-                             '--language', lang_str,
-                             '--track-name', name_str,
-                             filelist_str)
+        plan.add_external_track(filelist_str, final_audio_languages[index],
+                                final_audio_track_names[index], default_track)
 
     default_locked = False
     for index, filetype in enumerate(final_sub_filetypes):
-        default_track_str = "0:no"
+        default_track = False
         # mkvmerge does not support the .sub file as input,
         # and requires the .idx specified instead
         if filetype == "sub":
             filetype = "idx"
         if not default_locked:
             if always_enable_subs:
-                default_track_str = "0:yes"
+                default_track = True
             default_locked = True
-        lang_str = f"0:{final_sub_languages[index]}"
-        name_str = f"0:{final_sub_track_names[index]}"
         if forced_subtitles_priority.lower() == 'last':
-            forced_str = f"0:0"
+            forced_track = 0
         else:
-            forced_str = f"0:{final_sub_track_forced[index]}"
+            forced_track = final_sub_track_forced[index]
         sub_track_name = base64.b64encode(final_sub_track_names[index].encode("utf-8")).decode("utf-8")
         filelist_str = (f"{base}_{final_sub_track_forced[index]}_'{sub_track_name}'_"
                         f"{final_sub_track_ids[index]}_{final_sub_languages[index]}.{filetype}")
-        sub_files_list += ('--default-track', default_track_str,
-                           '--language', lang_str,
-                           '--track-name', name_str,
-                           '--forced-display-flag', forced_str,
-                           filelist_str)
-
-    if audio_filetypes:
-        command = ["mkvmerge", "--no-subtitles", "--no-audio", "--output",
-                   temp_filename, filename] + audio_files_list + sub_files_list
-    else:
-        command = ["mkvmerge", "--no-subtitles", "--output", temp_filename, filename] + sub_files_list
+        plan.add_external_track(filelist_str, final_sub_languages[index],
+                                final_sub_track_names[index], default_track, forced_track)
 
-    if debug:
-        print('')
-        print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}")
-        print(f"{RESET}")
-
-    result = subprocess.run(command, capture_output=True, text=True)
-
-    if result.returncode != 0 and not os.path.exists(temp_filename):
-        print('')
-        print(f"{GREY}[UTC {get_timestamp()}] {RED}[ERROR]{RESET} {result.stdout}")
-        print(f"{RESET}")
-        result.check_returncode()
-
-    os.remove(filename)
-    shutil.move(temp_filename, filename)
+    execute_remux_plan(debug, filename)
 
     # Audio files cleanup
     if audio_filetypes:
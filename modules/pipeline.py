@@ -0,0 +1,794 @@
+import sys
+import heapq
+import itertools
+import threading
+import concurrent.futures
+
+from modules.misc import *
+from modules.mkv import *
+from modules.media_encoder import *
+from modules.journal import *
+
+
+class PipelineStage:
+    # lane is 'cpu' for stages limited by processing power, or 'io' for stages that
+    # stream whole files; io stages hold a slot on the devices of lane_paths(job)
+    def __init__(self, name, header, description, function, max_workers=1, requires=(), condition=None,
+                 show_progress=True, lane='cpu', lane_paths=None):
+        self.name = name
+        self.header = header
+        self.description = description
+        self.function = function
+        self.max_workers = max(1, int(max_workers))
+        self.requires = tuple(requires)
+        self.condition = condition
+        self.show_progress = show_progress
+        self.lane = lane
+        self.lane_paths = lane_paths
+
+
+class PipelineJob:
+    # Per-file state handed from one stage to the next. Jobs with a higher
+    # priority are started first by every stage.
+    def __init__(self, name, priority=0, **state):
+        self.name = name
+        self.priority = priority
+        self.completed_stages = set()
+        self.started_stages = set()
+        self.failed = False
+        # Stages of one file running side by side journal one at a time
+        self.journal_lock = threading.Lock()
+        self.journaled_stages = set()
+        self.__dict__.update(state)
+
+
+class Pipeline:
+    # Runs every submitted file through its own stage graph. A stage starts for a
+    # file as soon as the stages it requires are done for that file, so slow
+    # stages of one file never hold back the other files. With on_job_failed,
+    # a file that raises CorruptedFile is handed to it and dropped on its own
+    # while the other files carry on.
+    def __init__(self, logger, stages, on_job_done=None, on_stage_done=None, on_job_failed=None):
+        self.logger = logger
+        self.stages = list(stages)
+        self.on_job_done = on_job_done
+        self.on_stage_done = on_stage_done
+        self.on_job_failed = on_job_failed
+        # A stage hands its file to the next stage from its own thread without
+        # waiting for it, so those tasks are queued instead of run inline
+        pool_threads = sum(stage.max_workers for stage in self.stages)
+        self.sessions = {stage.name: worker_pool('stages', stage.max_workers, pool_threads, inline_nested=False)
+                         for stage in self.stages}
+        # Jobs waiting for a free worker of each stage, most expensive first
+        self.queues = {stage.name: [] for stage in self.stages}
+        self.active = {stage.name: 0 for stage in self.stages}
+        self.sequence = itertools.count()
+        self.lock = threading.Condition()
+        self.jobs = []
+        self.running = 0
+        self.closed = False
+        self.errors = []
+        self.progress = PipelineProgress(logger, self.stages)
+
+    def submit(self, job):
+        with self.lock:
+            self.jobs.append(job)
+            self.progress.add_job()
+            # Stages a resumed job finished in an earlier run
+            for stage in self.stages:
+                if stage.name in job.completed_stages:
+                    self.progress.skip(stage)
+            job_done = self._schedule(job)
+        if job_done and self.on_job_done is not None:
+            self.on_job_done(job)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.progress.close()
+            self.lock.notify_all()
+
+    def wait(self):
+        with self.lock:
+            # Jobs can be submitted until the pipeline is closed, even after an error
+            while self.running or not self.closed or (
+                    not self.errors and any(not self._is_done(job) for job in self.jobs)):
+                self.lock.wait()
+
+        for session in self.sessions.values():
+            concurrent.futures.wait(session.futures)
+        self.progress.stop(failed=bool(self.errors))
+
+        if self.errors:
+            raise self.errors[0]
+
+    def abort(self, error):
+        # Stops handing out new work after a failure outside of the stages
+        with self.lock:
+            self.errors.append(error)
+            self._cancel()
+            self.lock.notify_all()
+
+    def report(self, print_function):
+        # Prints between spinner updates, so output for finished work stays readable
+        with self.lock:
+            self.progress.pause()
+            print_function()
+            self.progress.resume()
+
+    def _cancel(self):
+        # Called with the lock held, drops the queued work and stops the running
+        # stages at their next command
+        for queued_stage in self.stages:
+            self._dispatch(queued_stage)
+        for session in self.sessions.values():
+            session.cancel()
+
+    def _is_done(self, job):
+        return len(job.completed_stages) == len(self.stages)
+
+    def _schedule(self, job):
+        # Called with the lock held, returns True once the file has passed every stage
+        if self.errors:
+            return False
+        scheduled = True
+        while scheduled:
+            scheduled = False
+            for stage in self.stages:
+                if stage.name in job.started_stages:
+                    continue
+                if not all(name in job.completed_stages for name in stage.requires):
+                    continue
+                job.started_stages.add(stage.name)
+                if stage.condition is not None and not stage.condition(job):
+                    job.completed_stages.add(stage.name)
+                    self.progress.skip(stage)
+                    scheduled = True
+                    continue
+                self.running += 1
+                self.progress.start(stage)
+                heapq.heappush(self.queues[stage.name], (-job.priority, next(self.sequence), job))
+                self._dispatch(stage)
+
+        return self._is_done(job)
+
+    def _dispatch(self, stage):
+        # Called with the lock held, hands queued jobs to the stage's free workers
+        queue = self.queues[stage.name]
+        if self.errors:
+            self.running -= len(queue)
+            queue.clear()
+            return
+        while queue and self.active[stage.name] < stage.max_workers:
+            a, b, job = heapq.heappop(queue)
+            self.active[stage.name] += 1
+            future = self.sessions[stage.name].submit(self._run, stage, job)
+            future.add_done_callback(lambda future, stage=stage: self._release_cancelled(stage, future))
+
+    def _release_cancelled(self, stage, future):
+        # A stage cancelled before it started never reaches _run
+        if future.cancelled():
+            with self.lock:
+                self.running -= 1
+                self.active[stage.name] -= 1
+                self.lock.notify_all()
+
+    def _run(self, stage, job):
+        try:
+            self._run_stage(stage, job)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.active[stage.name] -= 1
+                self._dispatch(stage)
+                self.lock.notify_all()
+
+    def _run_stage(self, stage, job):
+        error = None
+        try:
+            if stage.lane == 'io' and stage.lane_paths is not None:
+                with io_lane(*stage.lane_paths(job)):
+                    stage.function(job)
+            else:
+                stage.function(job)
+            if self.on_stage_done is not None:
+                self.on_stage_done(job, stage)
+        except CorruptedFile as e:
+            # Handled by the caller, which retries the partially copied files
+            error = e
+        except concurrent.futures.CancelledError:
+            # Stopped after another failure, the file is left unfinished
+            return
+        except Exception as e:
+            error = e
+            # Print the error and traceback
+            custom_print(self.logger, f"{RED}[ERROR]{RESET} {e}")
+            print_no_timestamp(self.logger, f"  {BLUE}stage{RESET}: {stage.name}")
+            print_no_timestamp(self.logger, f"  {BLUE}input_file{RESET}: {job.name}")
+            traceback_str = ''.join(traceback.format_tb(e.__traceback__))
+            print_no_timestamp(self.logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
+
+        if isinstance(error, CorruptedFile) and self.on_job_failed is not None:
+            try:
+                self.on_job_failed(job, stage, error)
+                job.failed, error = True, None
+            except Exception as e:
+                error = e
+
+        job_done = False
+        with self.lock:
+            if error is not None:
+                self.errors.append(error)
+                self._cancel()
+            elif job.failed:
+                # The file skips the rest of its stages
+                self.progress.finish(stage)
+                job.completed_stages.add(stage.name)
+                for skipped_stage in self.stages:
+                    if skipped_stage.name not in job.started_stages:
+                        job.started_stages.add(skipped_stage.name)
+                        self.progress.skip(skipped_stage)
+                    job.completed_stages.add(skipped_stage.name)
+                job_done = True
+            else:
+                job.completed_stages.add(stage.name)
+                self.progress.finish(stage)
+                job_done = self._schedule(job)
+
+        if job_done and self.on_job_done is not None:
+            self.on_job_done(job)
+
+
+class PipelineProgress:
+    # One spinner line listing the progress of every active stage, and the usual
+    # finished line for each stage once all files have passed it
+    def __init__(self, logger, stages):
+        self.logger = logger
+        self.stages = [stage for stage in stages]
+        self.total_jobs = 0
+        self.closed = False
+        self.counts = {stage.name: {'started': 0, 'done': 0, 'passed': 0} for stage in stages}
+        self.reported = set()
+        self.spinner = None
+
+    def add_job(self):
+        self.total_jobs += 1
+
+    def close(self):
+        self.closed = True
+        self._report_finished()
+
+    def skip(self, stage):
+        self.counts[stage.name]['passed'] += 1
+        self._report_finished()
+
+    def start(self, stage):
+        self.counts[stage.name]['started'] += 1
+        self._update()
+
+    def finish(self, stage):
+        self.counts[stage.name]['done'] += 1
+        self.counts[stage.name]['passed'] += 1
+        self._report_finished()
+
+    def stop(self, failed=False):
+        if self.spinner is None:
+            return
+        active = self._active_stages()
+        if failed and active:
+            stage = active[0]
+            self._stop_spinner(f"{GREY}[UTC {get_timestamp()}] [{stage.header}]{RESET} {stage.description} {CROSS}")
+            self._log(f"[{stage.header}] {stage.description} {CROSS}",
+                      f"{GREY}[UTC {get_timestamp()}] [{stage.header}]{RESET} {stage.description} {CROSS}")
+        else:
+            self._stop_spinner()
+
+    def pause(self):
+        self._stop_spinner()
+
+    def resume(self):
+        self._update()
+
+    def _active_stages(self):
+        return [stage for stage in self.stages if stage.show_progress and stage.name not in self.reported
+                and self.counts[stage.name]['started']]
+
+    def _line(self):
+        parts = []
+        for stage in self._active_stages():
+            counts = self.counts[stage.name]
+            parts.append(f"{GREY}[{stage.header}]{RESET} {stage.description} ({counts['done']}/{counts['started']})")
+        return f"{GREY}[UTC {get_timestamp()}]{RESET} " + f" {GREY}|{RESET} ".join(parts) + " "
+
+    def _update(self):
+        if not self._active_stages():
+            return
+        if self.spinner is None:
+            print()
+            self.spinner = ContinuousSpinner(interval=0.15)
+            self.spinner.set_line_func(self._line)
+            self.spinner.start()
+
+    def _stop_spinner(self, final_line=""):
+        if self.spinner is not None:
+            # Clear whatever is left of the longer multi-stage line
+            self.spinner.stop()
+            sys.stdout.write("\033[2K")
+            self.spinner = None
+        if final_line:
+            sys.stdout.write(f"{final_line}\r")
+
+    def _log(self, plain, color):
+        self.logger.info(f"[UTC {get_timestamp()}] {plain}")
+        self.logger.debug(f"[UTC {get_timestamp()}] {plain}")
+        self.logger.color(color)
+
+    def _report_finished(self):
+        # A stage is finished once every file has passed it, which is only
+        # known after the last file has been submitted
+        if not self.closed:
+            self._update()
+            return
+        for stage in self.stages:
+            counts = self.counts[stage.name]
+            if (stage.name in self.reported or not stage.show_progress
+                    or counts['passed'] < self.total_jobs):
+                continue
+            self.reported.add(stage.name)
+            if not counts['done']:
+                continue
+            if self.spinner is None:
+                print()
+            self._stop_spinner(f"{GREY}[UTC {get_timestamp()}] [{stage.header}]{RESET} "
+                               f"{stage.description} {DONE}{CHECK}{RESET}")
+            self._log(f"[{stage.header}] {stage.description} {CHECK}",
+                      f"{GREY}[UTC {get_timestamp()}] [{stage.header}]{RESET} {stage.description} {DONE}{CHECK}{RESET}")
+        self._update()
+
+
+def has_missing_subs_langs(missing_subs_langs):
+    return not (missing_subs_langs in (['none'], [''], []) or missing_subs_langs is None)
+
+
+class PipelineDirectory:
+    # One input folder fed into the shared pipeline, holding what its stages need
+    def __init__(self, dirpath, all_dirnames, input_files, cover_files, external_subs_found):
+        self.dirpath = dirpath
+        self.all_dirnames = all_dirnames
+        self.input_files = input_files
+        self.cover_files = cover_files
+        self.external_subs_found = external_subs_found
+        self.subliminal_config_copied = False
+        self.jobs = []
+        self.remaining = 0
+        # False while files are still being added to the folder
+        self.complete = True
+        self.start_time = None
+        self.lock = threading.Lock()
+
+    def unfinished_files(self):
+        return [job.input_file for job in self.jobs
+                if job.is_media and not job.failed and 'move' not in job.completed_stages]
+
+
+# Job fields that are not part of a file's journaled state
+JOURNAL_EXCLUDED_FIELDS = ('name', 'directory', 'priority', 'completed_stages', 'started_stages', 'failed',
+                           'journal_lock', 'journaled_stages')
+
+
+def journal_job(job, stage):
+    # Records the stages the file passed and everything they produced, so an
+    # interrupted run can continue from here
+    if not job.is_media or stage.name == 'move':
+        return
+    dirpath = job.directory.dirpath
+    with job.journal_lock:
+        # completed_stages is only updated once this returns, a stage that finished
+        # alongside this one may not be in there yet
+        job.journaled_stages.add(stage.name)
+        input_file_with_path = os.path.join(dirpath, job.input_file)
+        plan = peek_remux_plan(input_file_with_path)
+        state = {field: value for field, value in vars(job).items() if field not in JOURNAL_EXCLUDED_FIELDS}
+        state['remux_plan'] = dict(vars(plan)) if plan is not None else None
+        state['planned_output_path'] = get_planned_output_path(os.path.join(dirpath, get_tagged_filename(job.input_file)))
+        try:
+            write_file_journal(dirpath, job.name, job.input_file, job.completed_stages | job.journaled_stages, state)
+        except OSError:
+            # Only costs the ability to resume this file
+            pass
+
+
+def restore_job(job, journal):
+    dirpath = job.directory.dirpath
+    state = dict(journal['state'])
+    plan_state = state.pop('remux_plan', None)
+    planned_output_path = state.pop('planned_output_path', None)
+
+    job.name = journal['name']
+    job.__dict__.update(state)
+    job.completed_stages = set(journal['completed_stages'])
+    job.started_stages = set(journal['completed_stages'])
+    if plan_state is not None:
+        get_remux_plan(os.path.join(dirpath, job.input_file)).__dict__.update(plan_state)
+    if planned_output_path is not None:
+        set_planned_output_path(os.path.join(dirpath, get_tagged_filename(job.input_file)), planned_output_path)
+
+
+def process_directories_in_pipeline(logger, debug, directories, output_dir, quarantine, resume=False, ingest=None):
+    # Streaming counterpart of the staged main loop in mkv_auto(), every file
+    # moves on to its next stage as soon as its own previous stage is done.
+    # All folders share one pipeline, so the stage pools and resource limits
+    # hold for the whole run and one folder never waits for another.
+    # With an ingest, files are added to one more folder, the root of TEMP,
+    # while the pipeline is already running.
+    download_missing_subs = check_config(config, 'subtitles', 'download_missing_subs').lower()
+    remove_all_subtitles = check_config(config, 'subtitles', 'remove_all_subtitles')
+    always_remove_sdh = check_config(config, 'subtitles', 'always_remove_sdh')
+    resync_subtitles = check_config(config, 'subtitles', 'resync_subtitles')
+    enable_media_encoder = check_config(config, 'media-encoder', 'enable_media_encoder')
+    normalize_filenames = check_config(config, 'general', 'normalize_filenames')
+    max_cpu_usage = check_config(config, 'general', 'max_cpu_usage')
+
+    max_worker_threads = get_worker_thread_count()
+    num_workers = max(1, max_worker_threads)
+    max_ocr_threads, memory_per_thread, max_mem_allowed = get_max_ocr_threads()
+    total_files = sum(len(directory.input_files) for directory in directories)
+    if ingest is not None:
+        ingest_directory = PipelineDirectory(ingest.temp_dir, ['.'], [], [], False)
+        ingest_directory.complete = False
+        directories.append(ingest_directory)
+        total_files += count_files(ingest.input_dir)
+    encoder_workers = get_encoder_worker_count(total_files)
+    per_file_cpu = float(max_cpu_usage) / encoder_workers
+    encode_slots = EncodeSlots(encoder_workers) if get_large_encode_size() is not None else None
+
+    # Disk bound stages are sized from the devices they read and write
+    dirpaths = [directory.dirpath for directory in directories]
+    temp_io_workers = get_io_worker_count(*dirpaths)
+    move_io_workers = get_io_worker_count(*dirpaths, output_dir)
+
+    # Limit workers to not hit TVMAZE rate limiting
+    lookup_workers = min(2, max_worker_threads) if normalize_filenames.lower() in ('full', 'full-jf') else num_workers
+    move_workers = min(lookup_workers, move_io_workers)
+
+    def fetch_subs(job):
+        dirpath = job.directory.dirpath
+        truly_missing_subs_langs = get_truly_missing_subs_langs(
+            job.input_file, job.missing_subs_langs, [job.external_subs])
+        with job.directory.lock:
+            if not job.directory.subliminal_config_copied:
+                copy_subliminal_config(dirpath)
+                job.directory.subliminal_config_copied = True
+
+        downloaded_subs, failed_downloads, downloaded_subs_simple, failed_downloads_simple = \
+            fetch_missing_subtitles_process_worker(debug, job.input_file, dirpath, truly_missing_subs_langs, 1)
+        job.truly_missing_subs_langs.append(truly_missing_subs_langs)
+        job.downloaded_subs.append(downloaded_subs)
+        job.failed_downloads.append(failed_downloads)
+        job.downloaded_subs_simple.append(downloaded_subs_simple)
+        job.failed_downloads_simple.append(failed_downloads_simple)
+        return downloaded_subs
+
+    def filter_audio_stage(job):
+        dirpath = job.directory.dirpath
+        try:
+            job.needs_processing_audio, job.needs_processing_subs, job.missing_subs_langs = \
+                trim_audio_in_mkv_files_worker(debug, job.input_file, dirpath)
+        except Exception as e:
+            raise CorruptedFile(original_exception=e)
+
+    def generate_audio_stage(job):
+        dirpath = job.directory.dirpath
+        job.audio_tracks, job.subtitle_tracks = generate_audio_tracks_in_mkv_files_worker(
+            debug, job.input_file, dirpath, 1)
+
+    def external_subs_stage(job):
+        dirpath = job.directory.dirpath
+        job.external_subs, job.missing_subs_langs = process_external_subs_worker(
+            debug, job.input_file, dirpath, job.missing_subs_langs)
+
+    def extract_subs_stage(job):
+        dirpath = job.directory.dirpath
+        if download_missing_subs != 'override':
+            job.subtitle_files = extract_subs_in_mkv_process_worker(debug, job.input_file, dirpath, 1) or []
+        if job.external_subs:
+            job.subtitle_files = merge_subtitles_with_priority([job.subtitle_files], [job.external_subs])[0]
+
+    def download_subs_stage(job):
+        job.new_downloaded_subs = fetch_subs(job)
+        job.subtitle_files = job.subtitle_files + job.new_downloaded_subs
+
+        if download_missing_subs == 'override':
+            job.subtitle_files_to_process = job.subtitle_files
+            job.subtitle_tracks = return_subtitle_metadata_worker(job.subtitle_files, 1)
+
+    def resync_subs_stage(job):
+        dirpath = job.directory.dirpath
+        subtitle_files = [f for f in job.new_downloaded_subs + job.external_subs if f.endswith('.srt')]
+        resync_subs_process_worker(debug, job.input_file, dirpath, subtitle_files, 1)
+
+    def convert_subs_stage(job):
+        dirpath = job.directory.dirpath
+        sub_files = [f for f in job.subtitle_files
+                     if isinstance(f, str) and f.endswith(('.mkv', '.srt', '.sup', '.ass', '.sub'))]
+        (job.subtitle_tracks, job.subtitle_files_to_process, job.subtitle_files_all, replacements,
+         job.errored_ocr, job.missing_subs_langs, a) = convert_to_srt_process_worker(
+            logger, debug, job.input_file, dirpath, 1, sub_files, memory_per_thread)
+        job.replacements.append(replacements)
+
+    def retry_ocr_stage(job):
+        dirpath = job.directory.dirpath
+        sub_files = [f for f in job.errored_ocr
+                     if isinstance(f, str) and f.endswith(('.mkv', '.srt', '.sup', '.ass', '.sub'))]
+        (a, new_subtitle_files_to_process, b, replacements,
+         job.errored_ocr_retry, job.missing_subs_langs, c) = convert_to_srt_process_worker(
+            logger, debug, job.input_file, dirpath, 1, sub_files, max_mem_allowed)
+        job.replacements.append(replacements)
+
+        downloaded_subs = []
+        if download_missing_subs != 'false' and has_missing_subs_langs(job.missing_subs_langs):
+            downloaded_subs = fetch_subs(job)
+
+        job.subtitle_files = job.subtitle_files_all + new_subtitle_files_to_process + downloaded_subs
+        job.subtitle_files_to_process = downloaded_subs + job.subtitle_files_to_process + new_subtitle_files_to_process
+
+        subtitle_files = [f for f in downloaded_subs if f.endswith('.srt')]
+        if subtitle_files:
+            resync_subs_process_worker(debug, job.input_file, dirpath, subtitle_files, 1)
+
+        job.subtitle_tracks = return_subtitle_metadata_worker(job.subtitle_files, 1)
+
+    def remove_sdh_stage(job):
+        remove_sdh_process_worker(logger, debug, job.subtitle_files_to_process, 1, memory_per_thread)
+
+    def plan_output_stage(job):
+        dirpath, all_dirnames = job.directory.dirpath, job.directory.all_dirnames
+        plan_output_paths_process_worker(logger, debug, job.input_file, dirpath, all_dirnames, output_dir)
+
+    def repack_stage(job):
+        dirpath = job.directory.dirpath
+        if has_tracks_to_repack(job):
+            repack_mkv_tracks_process_worker(debug, job.input_file, dirpath, job.audio_tracks, job.subtitle_tracks)
+        else:
+            execute_remux_plan(debug, os.path.join(dirpath, job.input_file))
+
+    def clutter_stage(job):
+        dirpath = job.directory.dirpath
+        try:
+            job.input_file = remove_clutter_process_worker(debug, job.input_file, dirpath)
+        except Exception as e:
+            raise CorruptedFile(original_exception=e)
+
+    def encode_stage(job):
+        dirpath = job.directory.dirpath
+        job.input_file, job.filesize_info = encode_single_video_file(
+            logger, debug, job.input_file, dirpath, per_file_cpu, encode_slots)
+
+    def is_large_job(job):
+        return encode_slots is not None and is_large_encode(os.path.join(job.directory.dirpath, job.input_file))
+
+    def move_stage(job):
+        dirpath, all_dirnames = job.directory.dirpath, job.directory.all_dirnames
+        job.new_radarr_path, job.new_sonarr_path = move_files_to_output_process_worker(
+            logger, debug, job.input_file, dirpath, all_dirnames, output_dir)
+
+    def has_tracks_to_repack(job):
+        return (any(value for value in job.audio_tracks.values()) or
+                any(value for value in job.subtitle_tracks.values()) or remove_all_subtitles)
+
+    def needs_subtitles(job):
+        return job.is_media and (job.needs_processing_subs or bool(job.external_subs))
+
+    stages = [
+        PipelineStage('filter_audio', "MKVMERGE", "Filter audio tracks", filter_audio_stage, max_worker_threads,
+                      condition=lambda job: job.is_media),
+        PipelineStage('generate_audio', "AUDIO", "Process audio", generate_audio_stage, num_workers,
+                      requires=['filter_audio'],
+                      condition=lambda job: job.is_media and job.needs_processing_audio),
+        PipelineStage('external_subs', "SUBTITLES", "Process external subtitles", external_subs_stage, num_workers,
+                      requires=['filter_audio'],
+                      condition=lambda job: job.is_media and job.directory.external_subs_found
+                      and download_missing_subs != 'override'),
+        PipelineStage('extract_subs', "MKVEXTRACT", "Extract internal subtitles", extract_subs_stage, temp_io_workers,
+                      requires=['external_subs'], condition=needs_subtitles,
+                      lane='io', lane_paths=lambda job: [job.directory.dirpath]),
+        # Max workers is set to 1 to throttle downloads with Subliminal
+        PipelineStage('download_subs', "SUBLIMINAL", "Process missing subtitles", download_subs_stage, 1,
+                      requires=['extract_subs'],
+                      condition=lambda job: needs_subtitles(job) and download_missing_subs != 'false'
+                      and has_missing_subs_langs(job.missing_subs_langs)),
+        PipelineStage('resync_subs', "FFSUBSYNC", "Synchronize subtitles", resync_subs_stage, num_workers,
+                      requires=['download_subs'],
+                      condition=lambda job: needs_subtitles(job) and resync_subtitles and any(
+                          f.endswith('.srt') for f in job.new_downloaded_subs + job.external_subs)),
+        PipelineStage('convert_subs', "SUBTITLES", "Convert subtitles to SRT", convert_subs_stage, max_ocr_threads,
+                      requires=['resync_subs'],
+                      condition=lambda job: needs_subtitles(job) and bool(job.subtitle_files)
+                      and download_missing_subs != 'override'),
+        # Subtitles that failed OCR are retried one at a time with all the memory available
+        PipelineStage('retry_ocr', "SUBTITLES", "Retry failed subtitle conversions", retry_ocr_stage, 1,
+                      requires=['convert_subs'],
+                      condition=lambda job: needs_subtitles(job) and bool(job.errored_ocr)
+                      and has_missing_subs_langs(job.missing_subs_langs)),
+        PipelineStage('remove_sdh', "SUBTITLES", "Remove SDH from subtitles", remove_sdh_stage, num_workers,
+                      requires=['retry_ocr'],
+                      condition=lambda job: needs_subtitles(job) and always_remove_sdh
+                      and bool(job.subtitle_files_to_process)),
+        PipelineStage('plan_output', "INFO", "Plan output paths", plan_output_stage, lookup_workers,
+                      requires=['generate_audio', 'remove_sdh'], show_progress=False,
+                      condition=lambda job: job.is_media and not enable_media_encoder),
+        PipelineStage('repack', "MKVMERGE", "Repack tracks into MKV", repack_stage, move_io_workers,
+                      requires=['plan_output'], lane='io', lane_paths=lambda job: [job.directory.dirpath, output_dir],
+                      condition=lambda job: job.is_media and (
+                          has_tracks_to_repack(job) or remux_plan_pending(os.path.join(job.directory.dirpath, job.input_file)))),
+        PipelineStage('remove_clutter', "FFMPEG", "Remove clutter", clutter_stage, temp_io_workers,
+                      requires=['repack'], show_progress=False, condition=lambda job: job.is_media,
+                      lane='io', lane_paths=lambda job: [job.directory.dirpath]),
+        PipelineStage('encode', "FFMPEG", get_encoder_description(), encode_stage, encoder_workers,
+                      requires=['remove_clutter'],
+                      condition=lambda job: job.is_media and enable_media_encoder and not is_large_job(job)),
+        # Large files have their own lane, their encodes are paused while smaller files are encoded
+        PipelineStage('encode_large', "FFMPEG", f"{get_encoder_description()} (large files)", encode_stage,
+                      encoder_workers, requires=['remove_clutter'],
+                      condition=lambda job: job.is_media and enable_media_encoder and is_large_job(job)),
+        PipelineStage('move', "INFO", "Move files to destination folder", move_stage, move_workers,
+                      requires=['encode', 'encode_large'], lane='io', lane_paths=lambda job: [job.directory.dirpath, output_dir])
+    ]
+
+    def directory_done(job):
+        directory = job.directory
+        with directory.lock:
+            directory.remaining -= 1
+            if directory.remaining or not directory.complete:
+                return
+        finish_directory(directory)
+
+    def finish_directory(directory):
+        processing_time = time.time() - directory.start_time
+        for done_job in directory.jobs:
+            remove_file_journal(directory.dirpath, done_job.name)
+        quarantine.forget(directory.dirpath, [done_job.name for done_job in directory.jobs
+                                              if done_job.is_media and not done_job.failed])
+        pipeline.report(lambda: print_directory_summary(logger, directory, processing_time))
+
+    def job_failed(job, stage, error):
+        sidecars = get_sidecar_files(job.directory.dirpath, job.input_file) if stage.name == 'filter_audio' else ()
+        quarantine.add(job.directory.dirpath, job.input_file, error, sidecars, pipeline.report)
+
+    pipeline = Pipeline(logger, stages, on_job_done=directory_done, on_stage_done=journal_job,
+                        on_job_failed=job_failed)
+
+    def create_job(directory, input_file):
+        return PipelineJob(input_file, input_file=input_file, directory=directory,
+                           is_media=input_file in directory.input_files,
+                           needs_processing_audio=False, needs_processing_subs=False, missing_subs_langs=[],
+                           audio_tracks={'audio_extensions': [], 'audio_langs': [], 'audio_ids': [], 'audio_names': []},
+                           subtitle_tracks={'sub_extensions': None, 'sub_langs': None, 'sub_ids': None,
+                                            'sub_names': None, 'sub_forced': None},
+                           external_subs=[], subtitle_files=[], new_downloaded_subs=[], subtitle_files_all=[],
+                           subtitle_files_to_process=[], errored_ocr=[], errored_ocr_retry=[], replacements=[],
+                           truly_missing_subs_langs=[], downloaded_subs=[], failed_downloads=[],
+                           downloaded_subs_simple=[], failed_downloads_simple=[], filesize_info=None,
+                           new_radarr_path='', new_sonarr_path='')
+
+    def submit_jobs(jobs):
+        # The most expensive files are started first, so the longest job of the
+        # run doesn't end up as the last one to start
+        media_jobs = [job for job in jobs if job.is_media]
+        costs = get_estimated_costs([os.path.join(job.directory.dirpath, job.input_file) for job in media_jobs])
+        for job, cost in zip(media_jobs, costs):
+            job.priority = cost
+        for job in sorted(jobs, key=lambda job: -job.priority):
+            pipeline.submit(job)
+
+    resumed_jobs = 0
+    for directory in directories:
+        directory.start_time = time.time()
+        directory.remaining = len(directory.input_files) + len(directory.cover_files)
+        journals = read_directory_journals(directory.dirpath) if resume else {}
+        for input_file in directory.input_files + directory.cover_files:
+            job = create_job(directory, input_file)
+            if input_file in journals:
+                restore_job(job, journals[input_file])
+                resumed_jobs += 1
+            directory.jobs.append(job)
+        if not directory.jobs and directory.complete:
+            pipeline.report(lambda: print_directory_summary(logger, directory, 0))
+
+    if resumed_jobs:
+        custom_print(logger, f"{GREY}[INFO]{RESET} Resuming {resumed_jobs} "
+                             f"{print_multi_or_single(resumed_jobs, 'file')} from the interrupted run.")
+
+    # Every job of a folder is known before its first one can finish
+    submit_jobs([job for directory in directories for job in directory.jobs])
+
+    def wait_for_pipeline():
+        try:
+            pipeline.wait()
+        except BaseException:
+            # Encodes still running (or paused) would otherwise outlive the run
+            if encode_slots is not None:
+                encode_slots.terminate()
+            raise
+
+    if ingest is None:
+        pipeline.close()
+        wait_for_pipeline()
+        return
+
+    def hand_over(filenames):
+        directory = ingest_directory
+        input_files = [f for f in filenames if f.endswith('.mkv')]
+        cover_files = [f for f in filenames if f.lower().endswith(('.png', '.jpg'))
+                       and any(name in f.lower() for name in poster_base_names)]
+        if (any(f.endswith(('.srt', '.ass', '.sub', '.idx', '.sup')) for f in filenames)
+                and download_missing_subs != 'override'):
+            directory.external_subs_found = True
+        directory.input_files.extend(input_files)
+        directory.cover_files.extend(cover_files)
+        jobs = [create_job(directory, input_file) for input_file in input_files + cover_files]
+        with directory.lock:
+            directory.jobs.extend(jobs)
+            directory.remaining += len(jobs)
+        submit_jobs(jobs)
+
+    def run_ingest():
+        try:
+            ingest.run(hand_over, lambda: ingest_directory.remaining > 0, lambda: bool(pipeline.errors),
+                       pipeline.report)
+            with ingest_directory.lock:
+                ingest_directory.complete = True
+                finished = ingest_directory.remaining == 0
+            if finished and not pipeline.errors:
+                finish_directory(ingest_directory)
+        except Exception as e:
+            # Print the error and traceback
+            custom_print(logger, f"{RED}[ERROR]{RESET} {e}")
+            print_no_timestamp(logger, f"  {BLUE}input_dir{RESET}: {ingest.input_dir}")
+            traceback_str = ''.join(traceback.format_tb(e.__traceback__))
+            print_no_timestamp(logger, f"\n{RED}[TRACEBACK]{RESET}\n{traceback_str}")
+            pipeline.abort(e)
+        finally:
+            pipeline.close()
+
+    ingest_thread = threading.Thread(target=run_ingest, daemon=True)
+    ingest_thread.start()
+    try:
+        wait_for_pipeline()
+    finally:
+        ingest_thread.join()
+
+
+def print_directory_summary(logger, directory, processing_time):
+    print_file_pipeline_summary(logger, directory.jobs, processing_time)
+
+    media_jobs = [job for job in directory.jobs if job.is_media and not job.failed]
+    print()
+    print_no_timestamp(logger, '')
+    print_no_timestamp(logger, f"{GREY}[INFO]{RESET} {len(media_jobs)} {print_multi_or_single(len(media_jobs), 'file')} "
+                               f"{'successfully ' if not any(job.errored_ocr for job in media_jobs) else ''}processed.")
+    print_no_timestamp(logger, f"{GREY}[INFO]{RESET} Processing took {format_time(int(processing_time))} to complete.\n")
+
+
+def print_file_pipeline_summary(logger, jobs, processing_time):
+    # The summaries the staged stages print at their end, printed once for all files
+    media_jobs = [job for job in jobs if job.is_media and not job.failed]
+
+    if any(job.downloaded_subs for job in media_jobs):
+        print_missing_subtitles_summary(
+            logger,
+            [langs for job in media_jobs for langs in job.truly_missing_subs_langs],
+            [subs for job in media_jobs for subs in job.downloaded_subs],
+            [subs for job in media_jobs for subs in job.failed_downloads],
+            [subs for job in media_jobs for subs in job.downloaded_subs_simple],
+            [subs for job in media_jobs for subs in job.failed_downloads_simple])
+
+    print_subtitle_conversion_summary(logger, [item for job in media_jobs for item in job.replacements],
+                                      [job.errored_ocr for job in media_jobs], False)
+    if any(job.errored_ocr_retry for job in media_jobs):
+        print_subtitle_conversion_summary(logger, [], [job.errored_ocr_retry for job in media_jobs], True)
+
+    if any(job.filesize_info for job in media_jobs):
+        print_encoding_summary(logger, [job.filesize_info for job in media_jobs], processing_time)
+
+    print_arr_update_summary(logger, [job.new_radarr_path for job in jobs], [job.new_sonarr_path for job in jobs])
@@ -0,0 +1,197 @@
+import os
+import time
+import threading
+import concurrent.futures
+from collections import deque
+
+from modules.misc import *
+
+# Long-lived thread pools shared by every step. Instead of starting and tearing
+# down an executor per call, each call site opens a session on a named pool
+# with its own worker limit, so helpers running for many files at once reuse
+# the same threads. 'stages' runs the stages of the pipeline, 'files' the
+# per-file work of the steps, 'tracks' the per-track and per-subtitle work
+# started from within those files and 'encodes' the video encodes.
+WORKER_POOL_NAMES = ('stages', 'files', 'tracks', 'encodes')
+
+# Tasks that may wait for a free thread per pool before submit() blocks
+WORKER_POOL_QUEUE_SIZE = 256
+
+
+class WorkerPool:
+    def __init__(self, name, max_workers, max_queued):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix=f"mkv-auto-{name}")
+        self.queue_slots = threading.BoundedSemaphore(max_queued)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.created = time.monotonic()
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'inline': 0,
+                      'running': 0, 'peak_running': 0, 'busy_time': 0.0, 'wait_time': 0.0}
+
+    def current_session(self):
+        return getattr(self.local, 'session', None)
+
+    def run(self, session, future, function, args, kwargs, queued_at):
+        self.queue_slots.release()
+        try:
+            if session.cancelled.is_set():
+                future.cancel()
+            if not future.set_running_or_notify_cancel():
+                with self.lock:
+                    self.stats['cancelled'] += 1
+                return
+            started = time.monotonic()
+            with self.lock:
+                self.stats['running'] += 1
+                self.stats['peak_running'] = max(self.stats['peak_running'], self.stats['running'])
+                self.stats['wait_time'] += started - queued_at
+            self.local.session = session
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                outcome = 'failed'
+            else:
+                future.set_result(result)
+                outcome = 'completed'
+            finally:
+                self.local.session = None
+            with self.lock:
+                self.stats['running'] -= 1
+                self.stats['busy_time'] += time.monotonic() - started
+                self.stats[outcome] += 1
+        finally:
+            session.task_done()
+
+    def run_inline(self, session, future, function, args, kwargs):
+        # Work submitted from one of the pool's own threads runs in that thread,
+        # so a task never waits for threads its own pool may not have left
+        future.set_running_or_notify_cancel()
+        outer_session, self.local.session = self.local.session, session
+        try:
+            future.set_result(function(*args, **kwargs))
+            outcome = 'completed'
+        except BaseException as e:
+            future.set_exception(e)
+            outcome = 'failed'
+        finally:
+            self.local.session = outer_session
+        with self.lock:
+            self.stats['inline'] += 1
+            self.stats[outcome] += 1
+
+    def get_summary(self):
+        with self.lock:
+            stats = dict(self.stats)
+        uptime = max(time.monotonic() - self.created, 1e-6)
+        started = stats['completed'] + stats['failed'] - stats['inline']
+        return (f"{self.name}: {stats['submitted']} tasks ({stats['inline']} inline, {stats['failed']} failed, "
+                f"{stats['cancelled']} cancelled), peak {stats['peak_running']} of {self.max_workers} threads, "
+                f"{stats['busy_time'] / (uptime * self.max_workers) * 100:.0f}% busy, "
+                f"{stats['wait_time'] / max(started, 1):.1f}s average wait")
+
+
+class PoolSession:
+    # What a call site uses in place of its own ThreadPoolExecutor: at most
+    # max_workers of its tasks run at once on the shared pool. Leaving the with
+    # block waits for its tasks, an exception in the block cancels the tasks
+    # that haven't started yet and asks the running ones to stop.
+    def __init__(self, pool, max_workers, inline_nested=True):
+        self.pool = pool
+        self.max_workers = max(1, int(max_workers))
+        self.inline_nested = inline_nested
+        self.pending = deque()
+        self.running = 0
+        self.futures = []
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self.futures.append(future)
+        with self.pool.lock:
+            self.pool.stats['submitted'] += 1
+        if self.inline_nested and self.pool.current_session() is not None:
+            self.pool.run_inline(self, future, function, args, kwargs)
+            return future
+
+        self.pool.queue_slots.acquire()
+        with self.lock:
+            self.pending.append((future, function, args, kwargs, time.monotonic()))
+            self._dispatch()
+        return future
+
+    def map(self, function, *iterables):
+        futures = [self.submit(function, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def _dispatch(self):
+        # Called with the lock held
+        while self.pending and self.running < self.max_workers:
+            self.running += 1
+            self.pool.executor.submit(self.pool.run, self, *self.pending.popleft())
+
+    def task_done(self):
+        with self.lock:
+            self.running -= 1
+            self._dispatch()
+
+    def cancel(self):
+        self.cancelled.set()
+        for future in self.futures:
+            future.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is not None:
+            self.cancel()
+        concurrent.futures.wait(self.futures)
+        return False
+
+
+worker_pools = {}
+worker_pools_lock = threading.Lock()
+
+
+def get_worker_pool(name, pool_threads=None):
+    # pool_threads sizes a pool whose sessions must be able to run side by side,
+    # it only applies to the call that creates the pool
+    with worker_pools_lock:
+        if name not in worker_pools:
+            worker_pool_threads = check_config(config, 'general', 'worker_pool_threads')
+            if pool_threads:
+                max_workers = int(pool_threads)
+            else:
+                max_workers = int(worker_pool_threads) if worker_pool_threads else os.cpu_count()
+            worker_pools[name] = WorkerPool(name, max(1, max_workers), WORKER_POOL_QUEUE_SIZE)
+        return worker_pools[name]
+
+
+def worker_pool(name, max_workers, pool_threads=None, inline_nested=True):
+    # A session of at most max_workers threads on the named pool. A session
+    # opened from a task of the same pool runs its tasks one by one in that
+    # task's thread (counted as 'inline' in the stats), so don't nest sessions
+    # on one pool for work meant to run in parallel: per-file work goes on
+    # 'files', the per-track work it starts on 'tracks'. Without inline_nested,
+    # tasks submitted from the pool's own threads are queued like any other,
+    # for callers whose tasks never wait for each other.
+    return PoolSession(get_worker_pool(name, pool_threads), max_workers, inline_nested)
+
+
+def check_cancelled():
+    # Raises in a task whose session was cancelled, so it stops before its next step
+    for pool in list(worker_pools.values()):
+        session = pool.current_session()
+        if session is not None and session.cancelled.is_set():
+            raise concurrent.futures.CancelledError()
+
+
+def log_worker_pool_stats(logger):
+    for name in WORKER_POOL_NAMES:
+        if name in worker_pools:
+            log_debug(logger, f"[POOL] {worker_pools[name].get_summary()}")
@@ -0,0 +1,142 @@
+import subprocess
+import json
+import os
+import threading
+import concurrent.futures
+
+from modules.misc import *
+from modules.governor import *
+from modules.pools import *
+
+
+class ProbeStream:
+    def __init__(self, stream):
+        tags = stream.get('tags', {})
+        self.index = stream.get('index')
+        self.codec_type = stream.get('codec_type')
+        self.codec_name = stream.get('codec_name', '')
+        self.width = stream.get('width')
+        self.height = stream.get('height')
+        self.closed_captions = bool(stream.get('closed_captions', 0))
+        self.channels = stream.get('channels', 0)
+        self.channel_layout = stream.get('channel_layout', '')
+        self.sample_rate = int(stream.get('sample_rate', 0) or 0)
+        self.language = tags.get('language', tags.get('LANGUAGE'))
+        self.title = tags.get('title', tags.get('TITLE'))
+
+
+class MediaProbe:
+    def __init__(self, filename, probe_data):
+        probe_format = probe_data.get('format', {})
+        self.filename = filename
+        self.streams = [ProbeStream(stream) for stream in probe_data.get('streams', [])]
+        self.format_name = probe_format.get('format_name', '')
+        self.duration = float(probe_format.get('duration', 0) or 0)
+        self.size = int(probe_format.get('size', 0) or 0)
+
+    @property
+    def video_streams(self):
+        return [stream for stream in self.streams if stream.codec_type == 'video']
+
+    @property
+    def audio_streams(self):
+        return [stream for stream in self.streams if stream.codec_type == 'audio']
+
+    @property
+    def subtitle_streams(self):
+        return [stream for stream in self.streams if stream.codec_type == 'subtitle']
+
+    @property
+    def has_closed_captions(self):
+        return any(stream.closed_captions for stream in self.video_streams)
+
+
+# One ffprobe per file version, shared by every helper that inspects streams
+media_probe_cache = {}
+media_probe_cache_lock = threading.Lock()
+
+
+def probe_media(filename):
+    key = get_file_cache_key(filename)
+    if key is not None:
+        with media_probe_cache_lock:
+            probe = media_probe_cache.get(key)
+        if probe is not None:
+            return probe
+
+    command = ['ffprobe', '-v', 'error', '-show_streams', '-show_format', '-of', 'json', filename]
+    result = run_command(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        probe_data = json.loads(result.stdout) if result.returncode == 0 else {}
+    except json.JSONDecodeError:
+        probe_data = {}
+    probe = MediaProbe(filename, probe_data)
+
+    # Failed probes are not cached, the file may still be arriving
+    if key is not None and probe_data:
+        with media_probe_cache_lock:
+            for cached_key in [k for k in media_probe_cache if k[0] == key[0]]:
+                del media_probe_cache[cached_key]
+            media_probe_cache[key] = probe
+    return probe
+
+
+def invalidate_media_probe(filename):
+    path = os.path.abspath(filename)
+    with media_probe_cache_lock:
+        for cached_key in [k for k in media_probe_cache if k[0] == path]:
+            del media_probe_cache[cached_key]
+
+
+# Relative weights of the work a file causes, only used to rank files so
+# the longest ones are started first
+COST_PER_GB = 1.0
+COST_PER_IMAGE_SUBTITLE = 30.0
+COST_PER_AUDIO_TRANSCODE_HOUR = 20.0
+COST_PER_ENCODE_HOUR = 600.0
+IMAGE_SUBTITLE_CODECS = ('hdmv_pgs_subtitle', 'dvd_subtitle')
+
+
+def estimate_processing_cost(filename):
+    probe = probe_media(filename)
+    size = probe.size or (os.path.getsize(filename) if os.path.isfile(filename) else 0)
+    hours = probe.duration / 3600
+    cost = size / (1024 ** 3) * COST_PER_GB
+
+    # Every image based subtitle track has to go through OCR
+    cost += COST_PER_IMAGE_SUBTITLE * sum(1 for stream in probe.subtitle_streams
+                                          if stream.codec_name in IMAGE_SUBTITLE_CODECS)
+
+    # Audio preferences other than the original track mean a decode and encode
+    pref_audio_formats = check_config(config, 'audio', 'pref_audio_formats')
+    transcodes = [item for item in (p.strip().upper() for p in pref_audio_formats.split(','))
+                  if item and item not in ('ORIG', 'COPY')]
+    if probe.audio_streams:
+        cost += COST_PER_AUDIO_TRANSCODE_HOUR * hours * len(transcodes)
+
+    if check_config(config, 'media-encoder', 'enable_media_encoder') and probe.video_streams:
+        video = probe.video_streams[0]
+        pixels = (video.width or 1920) * (video.height or 1080)
+        cost += COST_PER_ENCODE_HOUR * hours * pixels / (1920 * 1080)
+    return cost
+
+
+def get_estimated_costs(paths):
+    # Probes the files in parallel, a file that can't be probed sorts last
+    def estimate(path):
+        try:
+            return estimate_processing_cost(path)
+        except Exception:
+            return 0.0
+
+    if not paths:
+        return []
+    with worker_pool('files', get_worker_thread_count()) as executor:
+        return list(executor.map(estimate, paths))
+
+
+def order_by_estimated_cost(input_files, dirpath):
+    # (index, input_file) pairs with the most expensive file first, for
+    # submitting a batch so its longest job doesn't start last
+    costs = get_estimated_costs([os.path.join(dirpath, input_file) for input_file in input_files])
+    return sorted(enumerate(input_files), key=lambda item: -costs[item[0]])
@@ -0,0 +1,166 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+from modules.misc import *
+
+# Files that can't be read (like a download that was picked up before it
+# finished) are taken out of the batch on their own instead of failing it.
+# They wait in a hidden folder in the input folder and are put back for
+# another try once their backoff has passed, until the retry budget is used up.
+
+QUARANTINE_DIR = '.quarantine'
+QUARANTINE_REGISTRY = 'quarantine.json'
+SIDECAR_EXTENSIONS = ('.srt', '.ass', '.sub', '.idx', '.sup')
+
+
+def get_sidecar_files(dirpath, input_file):
+    # External subtitles that belong to the file and have to go along with it
+    # 'ep.en.srt' goes with 'ep.mkv', 'ep0.en.srt' (another episode) doesn't
+    base = os.path.splitext(input_file)[0]
+    return [filename for filename in os.listdir(dirpath)
+            if filename.startswith(f"{base}.") and filename.lower().endswith(SIDECAR_EXTENSIONS)]
+
+
+def is_quarantine_entry_due(entry):
+    # Mirrored by quarantine_due() in service-entrypoint-inner.sh, which starts
+    # a run for due files even while the input folder is otherwise empty
+    return (not entry.get('released') and entry.get('next_retry') is not None
+            and entry['next_retry'] <= time.time())
+
+
+class Quarantine:
+    def __init__(self, logger, input_dir, temp_dir, move_files):
+        self.logger = logger
+        self.input_dir = input_dir
+        self.temp_dir = temp_dir
+        self.move_files = move_files
+        self.quarantine_dir = os.path.join(input_dir, QUARANTINE_DIR)
+        self.registry_path = os.path.join(self.quarantine_dir, QUARANTINE_REGISTRY)
+        self.retries = int(check_config(config, 'general', 'quarantine_retries'))
+        self.backoff = float(check_config(config, 'general', 'quarantine_backoff')) * 60
+        self.lock = threading.Lock()
+        self.failed_files = []
+
+    def get_input_path(self, dirpath, filename):
+        # Where the file came from in the input folder. Files in TEMP carry their
+        # original folders in their flattened name, and are released back there so
+        # the next run flattens them to the same name and registry entry.
+        try:
+            relative_dir_path, original_filename = unflatten_file(filename, '')
+        except (ValueError, RuntimeError):
+            return os.path.relpath(os.path.join(dirpath, filename), self.temp_dir)
+        return os.path.normpath(os.path.join(relative_dir_path, original_filename))
+
+    def _read_registry(self):
+        try:
+            with open(self.registry_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_registry(self, registry):
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        temp_path = f"{self.registry_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(registry, file, indent=2)
+        os.replace(temp_path, self.registry_path)
+
+    def add(self, dirpath, input_file, error, sidecars=(), report=None):
+        # Takes one failed file out of the batch, the caller continues with the rest.
+        # report(print_function) prints around a running progress spinner.
+        report = report or (lambda print_function: print_function())
+        file_path = os.path.join(dirpath, input_file)
+        relative_path = self.get_input_path(dirpath, input_file)
+
+        base, extension = os.path.splitext(file_path)
+        if os.path.exists(f"{base}_tmp{extension}"):
+            os.remove(f"{base}_tmp{extension}")
+
+        with self.lock:
+            self.failed_files.append(relative_path)
+
+            # The original is still in the input folder and is picked up by the next run
+            if not self.move_files:
+                for filename in [input_file, *sidecars]:
+                    if os.path.exists(os.path.join(dirpath, filename)):
+                        os.remove(os.path.join(dirpath, filename))
+                message = (f"{RED}[ERROR]{RESET} '{relative_path}' could not be processed and was "
+                           f"skipped, it will be tried again on the next run.")
+                report(lambda: custom_print(self.logger, message))
+                log_debug(self.logger, f"{error}")
+                return
+
+            registry = self._read_registry()
+            entry = registry.get(relative_path, {'attempts': 0})
+            entry['attempts'] += 1
+            entry['released'] = False
+            entry['error'] = str(error.original_exception if getattr(error, 'original_exception', None) else error)
+
+            entry['files'] = [relative_path] + [self.get_input_path(dirpath, sidecar) for sidecar in sidecars]
+            for filename, file_relative_path in zip([input_file, *sidecars], entry['files']):
+                self._move(os.path.join(dirpath, filename), os.path.join(self.quarantine_dir, file_relative_path))
+            quarantine_path = os.path.join(self.quarantine_dir, relative_path)
+
+            if entry['attempts'] > self.retries:
+                entry['next_retry'] = None
+                message = (f"{RED}[ERROR]{RESET} '{relative_path}' failed {entry['attempts']} times "
+                           f"and was left in '{os.path.dirname(quarantine_path)}'.")
+            else:
+                delay = self.backoff * 2 ** (entry['attempts'] - 1)
+                entry['next_retry'] = time.time() + delay
+                message = (f"{RED}[ERROR]{RESET} '{relative_path}' could not be processed and was "
+                           f"quarantined, retry {entry['attempts']} of {self.retries} in {format_time(int(delay))}.")
+            report(lambda: custom_print(self.logger, message))
+            log_debug(self.logger, f"{entry['error']}")
+
+            registry[relative_path] = entry
+            self._write_registry(registry)
+
+    def _move(self, source, destination):
+        if os.path.exists(source):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.move(source, destination)
+
+    def forget(self, dirpath, input_files):
+        # Files that made it through are no longer counted against their budget
+        if not self.move_files:
+            return
+        with self.lock:
+            registry = self._read_registry()
+            relative_paths = [self.get_input_path(dirpath, input_file) for input_file in input_files]
+            # A file that failed again in this run keeps its count
+            relative_paths = [path for path in relative_paths if path not in self.failed_files]
+            if any(relative_path in registry for relative_path in relative_paths):
+                for relative_path in relative_paths:
+                    registry.pop(relative_path, None)
+                self._write_registry(registry)
+
+    def release_due_files(self):
+        # Puts files whose backoff has passed back into the input folder
+        if not self.move_files:
+            return 0
+        with self.lock:
+            registry = self._read_registry()
+            released = 0
+            for relative_path, entry in list(registry.items()):
+                if not is_quarantine_entry_due(entry):
+                    continue
+                if not os.path.exists(os.path.join(self.quarantine_dir, relative_path)):
+                    # Removed by hand, nothing left to retry
+                    registry.pop(relative_path)
+                    continue
+                for file_relative_path in entry.get('files', [relative_path]):
+                    self._move(os.path.join(self.quarantine_dir, file_relative_path),
+                               os.path.join(self.input_dir, file_relative_path))
+                try:
+                    os.removedirs(os.path.dirname(os.path.join(self.quarantine_dir, relative_path)))
+                except OSError:
+                    pass
+                # Keeps its count until the retry either succeeds or fails again
+                entry['released'] = True
+                released += 1
+            self._write_registry(registry)
+            return released
@@ -0,0 +1,186 @@
+import os
+import copy
+import threading
+
+from modules.misc import *
+
+
+class RemuxPlan:
+    # Collects every change the stages want to make to one MKV file, so the
+    # file is only rewritten once, by a single mkvmerge run at the end. Until
+    # then all stages keep reading from the untouched original.
+    def __init__(self, filename):
+        self.filename = filename
+        self.audio_tracks = []
+        self.default_audio_track = None
+        self.replace_audio = False
+        self.replace_subtitles = False
+        self.external_tracks = []
+        self.clear_title = True
+        self.clear_video_name = True
+        self.default_video_track = True
+        self.strip_track_names = check_config(config, 'general', 'remove_all_title_names')
+        # Set when nothing rewrites the file after the remux, so it can be
+        # written straight into the output library
+        self.output_info = None
+        self.written_to_output = False
+        self.applied = False
+
+    def select_audio(self, audio_tracks, default_audio_track):
+        # An empty selection keeps every audio track
+        self.audio_tracks = list(audio_tracks)
+        self.default_audio_track = default_audio_track if audio_tracks else None
+
+    def add_external_track(self, track_file, language, track_name, default_track, forced_track=None):
+        self.external_tracks.append({
+            'file': track_file,
+            'language': language,
+            'track_name': track_name,
+            'default_track': default_track,
+            'forced_track': forced_track
+        })
+
+    def has_track_changes(self):
+        return bool(self.audio_tracks or self.replace_audio or self.replace_subtitles or self.external_tracks)
+
+    def is_metadata_only(self, file_info):
+        # True when no track is added or removed, so the changes can be made in place
+        if self.replace_audio or self.replace_subtitles or self.external_tracks:
+            return False
+        audio_track_ids = [track['id'] for track in file_info['tracks'] if track['type'] == 'audio']
+        return not self.audio_tracks or set(self.audio_tracks) == set(audio_track_ids)
+
+    def apply_to_file_info(self, file_info):
+        # The track listing the file will have once the audio selection is applied,
+        # still using the track IDs of the original file
+        file_info = copy.deepcopy(file_info)
+        if self.audio_tracks:
+            file_info['tracks'] = [track for track in file_info['tracks']
+                                   if track['type'] != 'audio' or track['id'] in self.audio_tracks]
+            for track in file_info['tracks']:
+                if track['id'] == self.default_audio_track:
+                    track['properties']['default_track'] = True
+        return file_info
+
+    def build_mkvmerge_command(self, file_info, output_filename):
+        source_tracks = [track for track in file_info['tracks']
+                         if not (track['type'] == 'audio' and (self.replace_audio or (
+                                 self.audio_tracks and track['id'] not in self.audio_tracks)))
+                         and not (track['type'] == 'subtitles' and self.replace_subtitles)]
+        video_tracks = [track for track in source_tracks if track['type'] == 'video']
+
+        command = ["mkvmerge", "--output", output_filename]
+        if self.clear_title:
+            command += ["--title", ""]
+
+        # Options for the original file
+        if self.replace_audio:
+            command += ["--no-audio"]
+        elif self.audio_tracks:
+            command += ["--atracks", ','.join(map(str, self.audio_tracks))]
+            if self.default_audio_track is not None:
+                command += ["--default-track", f"{self.default_audio_track}:yes"]
+        if self.replace_subtitles:
+            command += ["--no-subtitles"]
+        if video_tracks:
+            if self.default_video_track:
+                command += ["--default-track", f"{video_tracks[0]['id']}:yes"]
+            if self.clear_video_name and not self.strip_track_names:
+                command += ["--track-name", f"{video_tracks[0]['id']}:"]
+        if self.strip_track_names:
+            for track in source_tracks:
+                command += ["--track-name", f"{track['id']}:"]
+        command += [self.filename]
+
+        # External tracks, one input file each
+        for track in self.external_tracks:
+            command += ["--default-track", f"0:{'yes' if track['default_track'] else 'no'}",
+                        "--language", f"0:{track['language']}",
+                        "--track-name", f"0:{'' if self.strip_track_names else track['track_name']}"]
+            if track['forced_track'] is not None:
+                command += ["--forced-display-flag", f"0:{track['forced_track']}"]
+            command += [track['file']]
+        return command
+
+    def get_property_edits(self, file_info):
+        edits = MkvPropEdits(self.filename)
+        video_tracks = [track for track in file_info['tracks'] if track['type'] == 'video']
+
+        if self.clear_title:
+            edits.set_title('')
+        if self.strip_track_names:
+            for track in file_info['tracks']:
+                edits.set_track(track, 'name', '')
+        if video_tracks:
+            if self.clear_video_name:
+                edits.set_track(video_tracks[0], 'name', '')
+            if self.default_video_track:
+                edits.set_track(video_tracks[0], 'flag-default', 1)
+        for track in file_info['tracks']:
+            if track['id'] == self.default_audio_track:
+                edits.set_track(track, 'flag-default', 1)
+        return edits
+
+
+class MkvPropEdits:
+    # Collects the property edits for one file, so the header is rewritten by a
+    # single mkvpropedit run instead of one run per track
+    def __init__(self, filename):
+        self.filename = filename
+        self.edits = {}
+
+    def set(self, selector, name, value):
+        self.edits.setdefault(selector, {})[name] = value
+
+    def set_title(self, title):
+        self.set('info', 'title', title)
+
+    def set_track(self, track, name, value):
+        self.set(get_track_selector(track), name, value)
+
+    def has_edits(self):
+        return bool(self.edits)
+
+    def build_command(self):
+        command = ["mkvpropedit", self.filename]
+        for selector, properties in self.edits.items():
+            command += ["--edit", selector]
+            for name, value in properties.items():
+                command += ["--set", f"{name}={value}"]
+        return command
+
+
+def get_track_selector(track):
+    # mkvpropedit selects tracks by track number ('@n') or by 1-based position
+    number = track['properties'].get('number')
+    if number:
+        return f"track:@{number}"
+    return f"track:{track['id'] + 1}"
+
+
+remux_plans = {}
+remux_plans_lock = threading.Lock()
+
+
+def get_remux_plan(filename):
+    path = os.path.abspath(filename)
+    with remux_plans_lock:
+        if path not in remux_plans:
+            remux_plans[path] = RemuxPlan(filename)
+        return remux_plans[path]
+
+
+def peek_remux_plan(filename):
+    with remux_plans_lock:
+        return remux_plans.get(os.path.abspath(filename))
+
+
+def pop_remux_plan(filename):
+    with remux_plans_lock:
+        return remux_plans.pop(os.path.abspath(filename), None)
+
+
+def remux_plan_pending(filename):
+    with remux_plans_lock:
+        plan = remux_plans.get(os.path.abspath(filename))
+    return plan is not None and not plan.applied and plan.has_track_changes()
@@ -25,8 +25,11 @@ import psutil
 import select
 import pathlib
 import traceback
+import multiprocessing
 
 from modules.misc import *
+from modules.governor import *
+from modules.pools import *
 
 # Define a XML lock
 xml_file_lock = threading.Lock()
@@ -61,6 +64,30 @@ def is_valid_srt(file_path):
         return False
 
 
+# Worker processes for the pure Python subtitle passes. They hold the GIL for
+# their whole run, so threads only ever get one core's worth of text work done.
+TEXT_PROCESS_POOL = None
+text_process_pool_lock = threading.Lock()
+
+
+def get_text_process_pool():
+    global TEXT_PROCESS_POOL
+    with text_process_pool_lock:
+        if TEXT_PROCESS_POOL is None:
+            max_cpu_usage = int(check_config(config, 'general', 'max_cpu_usage'))
+            # A fork server keeps the workers from inheriting the locks of running threads
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['modules.subs'])
+            TEXT_PROCESS_POOL = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max(1, int(os.cpu_count() * max_cpu_usage / 100)), mp_context=context)
+        return TEXT_PROCESS_POOL
+
+
+def run_text_task(function, *args):
+    # Runs a module level function in the text process pool and waits for its result
+    return get_text_process_pool().submit(function, *args).result()
+
+
 def find_and_replace(input_file, replacement_file, output_file):
     # Read the input file content
     with open(input_file, 'r', encoding='utf-8') as file:
@@ -136,6 +163,12 @@ def _monitor_memory_usage(xvfb_pid, cmd_pid, limit_bytes):
 
 
 def run_with_xvfb(command, memory_per_thread):
+    # The OCR run may use up to memory_per_thread before it is killed
+    with command_reservation(command, cpu=1, memory=memory_per_thread, io=0):
+        return _run_with_xvfb(command, memory_per_thread)
+
+
+def _run_with_xvfb(command, memory_per_thread):
     """
     Launches Xvfb using -displayfd to auto-pick a free display, then runs `command`
     with DISPLAY set to that value. The `display_number` parameter is ignored for
@@ -251,6 +284,56 @@ def run_with_xvfb(command, memory_per_thread):
     return return_code
 
 
+def remove_font_tags(input_file):
+    # Remove any color tags (html) in subtitle
+    with open(input_file, 'r', encoding='utf-8') as file:
+        cleaned_content = re.sub(r'<font[^>]*>|</font>', '', file.read())
+    with open(f"{input_file}_tmp.srt", 'w', encoding='utf-8') as file:
+        file.write(cleaned_content)
+    os.remove(input_file)
+    shutil.move(f"{input_file}_tmp.srt", input_file)
+
+
+def remove_music_from_subtitle(input_file):
+    clean_invalid_utf8(input_file, f'{input_file}.tmp.srt')
+    os.remove(input_file)
+    shutil.move(f'{input_file}.tmp.srt', input_file)
+
+    subs = pysrt.open(input_file)
+    # Filter the subtitles in place, removing entries with '♪' in their text
+    subs = pysrt.SubRipFile([sub for sub in subs if '♪' not in sub.text])
+    subs.save(f"{input_file}.tmp.srt", encoding='utf-8')
+    shutil.move(f"{input_file}.tmp.srt", input_file)
+
+    # Remove text between * ... * in subtitles
+    subs = pysrt.open(input_file)
+    for sub in subs:
+        sub.text = re.sub(r'\s*\*[^*]+\*\s*', ' ', sub.text)
+        sub.text = re.sub(r'\s{2,}', ' ', sub.text)  # clean up double spaces
+        sub.text = sub.text.strip()
+    subs.save(f"{input_file}.tmp.srt", encoding='utf-8')
+    shutil.move(f"{input_file}.tmp.srt", input_file)
+
+    subs = Subtitles(input_file)
+    subs.filter(
+        rm_fonts=False,
+        rm_ast=False,
+        rm_music=True,
+        rm_effects=False,
+        rm_names=False,
+        rm_author=False,
+    )
+    subs.save()
+
+    clean_invalid_utf8(input_file, f'{input_file}.tmp.srt')
+    shutil.move(f"{input_file}.tmp.srt", input_file)
+
+    subs = pysrt.open(input_file)
+    subs = pysrt.SubRipFile([sub for sub in subs if not sub.text.isupper()])
+    subs.save(f"{input_file}.tmp.srt", encoding='utf-8')
+    shutil.move(f"{input_file}.tmp.srt", input_file)
+
+
 def remove_sdh_worker(logger, debug, input_file, remove_music, subtitleedit, memory_per_thread):
     base_lang_id_name_forced, _, original_extension = input_file.rpartition('.')
     base_id_name_forced, _, language = base_lang_id_name_forced.rpartition('_')
@@ -264,13 +347,7 @@ def remove_sdh_worker(logger, debug, input_file, remove_music, subtitleedit, mem
 
     redo_casing = check_config(config, 'subtitles', 'redo_casing')
 
-    # Remove any color tags (html) in subtitle
-    with open(input_file, 'r', encoding='utf-8') as file:
-        cleaned_content = re.sub(r'<font[^>]*>|</font>', '', file.read())
-    with open(f"{input_file}_tmp.srt", 'w', encoding='utf-8') as file:
-        file.write(cleaned_content)
-    os.remove(input_file)
-    shutil.move(f"{input_file}_tmp.srt", input_file)
+    run_text_task(remove_font_tags, input_file)
     subtitle_tmp = f"{input_file}_tmp.srt"
 
     if redo_casing:
@@ -286,19 +363,19 @@ def remove_sdh_worker(logger, debug, input_file, remove_music, subtitleedit, mem
         print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
 
     if language == 'eng':
-        current_replacements = find_and_replace(input_file, 'ocr-replacements/replacements_srt_eng_only.csv', subtitle_tmp)
+        current_replacements = run_text_task(find_and_replace, input_file, 'ocr-replacements/replacements_srt_eng_only.csv', subtitle_tmp)
         replacements = replacements + current_replacements
-        current_replacements = find_and_replace(subtitle_tmp, 'ocr-replacements/replacements_srt_only.csv', input_file)
+        current_replacements = run_text_task(find_and_replace, subtitle_tmp, 'ocr-replacements/replacements_srt_only.csv', input_file)
         os.remove(subtitle_tmp)
         replacements = replacements + current_replacements
     elif language == 'nor':
-        current_replacements = find_and_replace(input_file, 'ocr-replacements/replacements_srt_nor_only.csv', subtitle_tmp)
+        current_replacements = run_text_task(find_and_replace, input_file, 'ocr-replacements/replacements_srt_nor_only.csv', subtitle_tmp)
         replacements = replacements + current_replacements
-        current_replacements = find_and_replace(subtitle_tmp, 'ocr-replacements/replacements_srt_only.csv', input_file)
+        current_replacements = run_text_task(find_and_replace, subtitle_tmp, 'ocr-replacements/replacements_srt_only.csv', input_file)
         os.remove(subtitle_tmp)
         replacements = replacements + current_replacements
     else:
-        current_replacements = find_and_replace(input_file, 'ocr-replacements/replacements_srt_only.csv', subtitle_tmp)
+        current_replacements = run_text_task(find_and_replace, input_file, 'ocr-replacements/replacements_srt_only.csv', subtitle_tmp)
         os.rename(subtitle_tmp, input_file)
         replacements = replacements + current_replacements
 
@@ -309,43 +386,7 @@ def remove_sdh_worker(logger, debug, input_file, remove_music, subtitleedit, mem
     shutil.move(f"{input_file}_tmp.srt", input_file)
 
     if remove_music:
-        clean_invalid_utf8(input_file, f'{input_file}.tmp.srt')
-        os.remove(input_file)
-        shutil.move(f'{input_file}.tmp.srt', input_file)
-
-        subs = pysrt.open(input_file)
-        # Filter the subtitles in place, removing entries with '♪' in their text
-        subs = pysrt.SubRipFile([sub for sub in subs if '♪' not in sub.text])
-        subs.save(f"{input_file}.tmp.srt", encoding='utf-8')
-        shutil.move(f"{input_file}.tmp.srt", input_file)
-
-        # Remove text between * ... * in subtitles
-        subs = pysrt.open(input_file)
-        for sub in subs:
-            sub.text = re.sub(r'\s*\*[^*]+\*\s*', ' ', sub.text)
-            sub.text = re.sub(r'\s{2,}', ' ', sub.text)  # clean up double spaces
-            sub.text = sub.text.strip()
-        subs.save(f"{input_file}.tmp.srt", encoding='utf-8')
-        shutil.move(f"{input_file}.tmp.srt", input_file)
-
-        subs = Subtitles(input_file)
-        subs.filter(
-            rm_fonts=False,
-            rm_ast=False,
-            rm_music=True,
-            rm_effects=False,
-            rm_names=False,
-            rm_author=False,
-        )
-        subs.save()
-
-        clean_invalid_utf8(input_file, f'{input_file}.tmp.srt')
-        shutil.move(f"{input_file}.tmp.srt", input_file)
-
-        subs = pysrt.open(input_file)
-        subs = pysrt.SubRipFile([sub for sub in subs if not sub.text.isupper()])
-        subs.save(f"{input_file}.tmp.srt", encoding='utf-8')
-        shutil.move(f"{input_file}.tmp.srt", input_file)
+        run_text_task(remove_music_from_subtitle, input_file)
 
     if debug:
         print(f'\n{GREY}[UTC {get_timestamp()}] [SDH DEBUG]{GREEN} Current language is set to "{language}"{RESET}')
@@ -361,7 +402,7 @@ def remove_sdh(max_threads, logger, debug, input_files, remove_music, track_name
     if debug:
         print('\n')
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+    with worker_pool('tracks', max_threads) as executor:
         tasks = [executor.submit(remove_sdh_worker, logger, debug, input_file, remove_music,
                                  subtitleedit, memory_per_thread)
                  for i, input_file in enumerate(input_files)]
@@ -391,81 +432,101 @@ def remove_sdh(max_threads, logger, debug, input_files, remove_music, track_name
     return cleaned_track_names, all_replacements
 
 
-def convert_ass_to_srt(subtitle_files, main_audio_track_lang):
+def convert_ass_file_to_srt(file, main_audio_track_lang, keep_original_subtitles, remove_sdh):
     output_subtitles = []
-    errored_ass_subs = []
-    missing_subs_langs = []
-    keep_original_subtitles = check_config(config, 'subtitles', 'keep_original_subtitles')
-    remove_sdh = check_config(config, 'subtitles', 'always_remove_sdh')
+    errored_ass_sub = None
+    missing_subs_lang = None
 
-    for index, file in enumerate(subtitle_files):
-        if file.endswith('.ass'):
-            base_lang_id_name_forced, _, original_extension = file.rpartition('.')
-            base_id_name_forced, _, language = base_lang_id_name_forced.rpartition('_')
-            base_name_forced, _, track_id = base_id_name_forced.rpartition('_')
-            base_forced, _, name_encoded = base_name_forced.rpartition('_')
-            name_encoded = name_encoded.strip("'") if name_encoded.startswith("'") and name_encoded.endswith(
-                "'") else name_encoded
-            name = base64.b64decode(name_encoded).decode("utf-8")
-            base, _, forced = base_forced.rpartition('_')
+    base_lang_id_name_forced, _, original_extension = file.rpartition('.')
+    base_id_name_forced, _, language = base_lang_id_name_forced.rpartition('_')
+    base_name_forced, _, track_id = base_id_name_forced.rpartition('_')
+    base_forced, _, name_encoded = base_name_forced.rpartition('_')
+    name_encoded = name_encoded.strip("'") if name_encoded.startswith("'") and name_encoded.endswith(
+        "'") else name_encoded
+    name = base64.b64decode(name_encoded).decode("utf-8")
+    base, _, forced = base_forced.rpartition('_')
 
-            if name:
-                original_name_b64 = name_encoded
-            else:
-                original_name_b64 = base64.b64encode('Original'.encode("utf-8")).decode("utf-8")
+    if name:
+        original_name_b64 = name_encoded
+    else:
+        original_name_b64 = base64.b64encode('Original'.encode("utf-8")).decode("utf-8")
 
-            if forced == '1':
-                output_name = f'non-{main_audio_track_lang} dialogue'
-                output_name_b64 = base64.b64encode(output_name.encode("utf-8")).decode("utf-8")
-                original_subtitle = f"{base}_0_'{original_name_b64}'_{track_id}_{language}.{original_extension}"
-                final_subtitle = f"{base}_{forced}_'{output_name_b64}'_{track_id}_{language}.srt"
-            else:
-                full_language = pycountry.languages.get(alpha_3=language)
-                if full_language:
-                    output_name = name if name != 'Original' else full_language.name
-                else:
-                    output_name = name if name != 'Original' else ''
-                if remove_sdh:
-                    output_name = remove_sdh_cc_text(output_name)
-                    if 'SDH' in name.upper() or 'CC' in name.upper():
-                        if "(from " not in output_name:
-                            output_name = "{} (from {})".format(output_name, re.sub(r'[\[\]\(\)]', '', name))
+    if forced == '1':
+        output_name = f'non-{main_audio_track_lang} dialogue'
+        output_name_b64 = base64.b64encode(output_name.encode("utf-8")).decode("utf-8")
+        original_subtitle = f"{base}_0_'{original_name_b64}'_{track_id}_{language}.{original_extension}"
+        final_subtitle = f"{base}_{forced}_'{output_name_b64}'_{track_id}_{language}.srt"
+    else:
+        full_language = pycountry.languages.get(alpha_3=language)
+        if full_language:
+            output_name = name if name != 'Original' else full_language.name
+        else:
+            output_name = name if name != 'Original' else ''
+        if remove_sdh:
+            output_name = remove_sdh_cc_text(output_name)
+            if 'SDH' in name.upper() or 'CC' in name.upper():
+                if "(from " not in output_name:
+                    output_name = "{} (from {})".format(output_name, re.sub(r'[\[\]\(\)]', '', name))
+
+        output_name_b64 = base64.b64encode(output_name.encode("utf-8")).decode("utf-8")
+        original_subtitle = f"{base}_{forced}_'{original_name_b64}'_{track_id}_{language}.{original_extension}"
+        final_subtitle = f"{base}_{forced}_'{output_name_b64}'_{track_id}_{language}.srt"
+
+    os.rename(file, original_subtitle)
+    with open(original_subtitle) as ass_file:
+        srt_output = asstosrt.convert(ass_file)
+    with open(final_subtitle, "w") as srt_file:
+        srt_file.write(srt_output)
+
+    if is_valid_srt(final_subtitle):
+        if keep_original_subtitles:
+            output_subtitles = [final_subtitle, original_subtitle]
+        else:
+            output_subtitles = [final_subtitle]
+    else:
+        subtitle_file_info = decompose_subtitle_filename(original_subtitle)
+        errored_ass_sub = os.path.basename(f"{subtitle_file_info['base']}.{subtitle_file_info['extension']}")
+        missing_subs_lang = language
+        if keep_original_subtitles:
+            output_subtitles = [original_subtitle]
 
-                output_name_b64 = base64.b64encode(output_name.encode("utf-8")).decode("utf-8")
-                original_subtitle = f"{base}_{forced}_'{original_name_b64}'_{track_id}_{language}.{original_extension}"
-                final_subtitle = f"{base}_{forced}_'{output_name_b64}'_{track_id}_{language}.srt"
+    return output_subtitles, errored_ass_sub, missing_subs_lang
 
-            os.rename(file, original_subtitle)
-            ass_file = open(original_subtitle)
-            srt_output = asstosrt.convert(ass_file)
-            with open(final_subtitle, "w") as srt_file:
-                srt_file.write(srt_output)
-
-            if is_valid_srt(final_subtitle):
-                if keep_original_subtitles:
-                    output_subtitles = output_subtitles + [final_subtitle, original_subtitle]
-                else:
-                    output_subtitles = output_subtitles + [final_subtitle]
-            else:
-                subtitle_file_info = decompose_subtitle_filename(original_subtitle)
-                errored_ass_subs.append(os.path.basename(f"{subtitle_file_info['base']}.{subtitle_file_info['extension']}"))
-                missing_subs_langs.append(language)
-                if keep_original_subtitles:
-                    output_subtitles = output_subtitles + [original_subtitle]
 
+def convert_ass_to_srt(subtitle_files, main_audio_track_lang):
+    output_subtitles = []
+    errored_ass_subs = []
+    missing_subs_langs = []
+    keep_original_subtitles = check_config(config, 'subtitles', 'keep_original_subtitles')
+    remove_sdh = check_config(config, 'subtitles', 'always_remove_sdh')
+
+    # Every ASS file is converted in the text process pool at the same time
+    pool = get_text_process_pool()
+    tasks = {file: pool.submit(convert_ass_file_to_srt, file, main_audio_track_lang,
+                               keep_original_subtitles, remove_sdh)
+             for file in subtitle_files if file.endswith('.ass')}
+
+    for file in subtitle_files:
+        if file in tasks:
+            converted_subtitles, errored_ass_sub, missing_subs_lang = tasks[file].result()
+            output_subtitles = output_subtitles + converted_subtitles
+            if errored_ass_sub is not None:
+                errored_ass_subs.append(errored_ass_sub)
+                missing_subs_langs.append(missing_subs_lang)
         else:
             output_subtitles = output_subtitles + [file]
 
     return output_subtitles, errored_ass_subs, missing_subs_langs
 
 
-def resync_srt_subs(max_threads, debug, input_file, subtitle_files):
+def resync_srt_subs(max_threads, debug, input_file, subtitle_files, reference_stream=None):
     if debug:
         print('')
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+    with worker_pool('tracks', max_threads) as executor:
         # Create a list of tasks for each subtitle file
-        tasks = [executor.submit(resync_srt_subs_worker, debug, input_file, subfile, max_retries=3, retry_delay=2)
+        tasks = [executor.submit(resync_srt_subs_worker, debug, input_file, subfile, max_retries=3, retry_delay=2,
+                                 reference_stream=reference_stream)
                  for subfile in subtitle_files]
         # Wait for all tasks to complete
         for task in concurrent.futures.as_completed(tasks):
@@ -479,7 +540,7 @@ def resync_srt_subs(max_threads, debug, input_file, subtitle_files):
         print('')
 
 
-def resync_srt_subs_worker(debug, input_file, subtitle_filename, max_retries, retry_delay):
+def resync_srt_subs_worker(debug, input_file, subtitle_filename, max_retries, retry_delay, reference_stream=None):
     base_lang_id_name_forced, _, original_extension = subtitle_filename.rpartition('.')
     base_id_name_forced, _, language = base_lang_id_name_forced.rpartition('_')
     base_name_forced, _, track_id = base_id_name_forced.rpartition('_')
@@ -498,14 +559,17 @@ def resync_srt_subs_worker(debug, input_file, subtitle_filename, max_retries, re
 
     command = ["ffs", input_file, "--max-offset-seconds", "10",
                "-i", subtitle_filename, "-o", temp_filename]
+    if reference_stream:
+        command += ["--reference-stream", reference_stream]
 
     retries = 0
     while retries < max_retries:
         if debug:
             print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
 
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+        with command_reservation(command):
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = process.communicate()
         return_code = process.returncode
 
         if debug:
@@ -582,24 +646,39 @@ def extract_subs_in_mkv(max_threads, debug, filename, track_numbers, output_file
     if debug:
         print('\n')
 
-    results = [None] * len(track_numbers)  # Pre-allocate a list for the results in order
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-        # Create a dictionary to store futures with their respective indices
-        future_to_index = {
-            executor.submit(extract_subtitle, debug, filename, track, filetype, language, forced, name): i
-            for i, (track, filetype, language, forced, name) in
-            enumerate(zip(track_numbers, output_filetypes, subs_languages, subs_forced, subs_names))
-        }
+    if not track_numbers:
+        return []
 
-        # As each future completes, place the result in the corresponding index
-        for future in concurrent.futures.as_completed(future_to_index):
-            index = future_to_index[future]
-            results[index] = future.result()  # Store the result at the correct index
+    subtitle_filenames = [get_extracted_subtitle_filename(filename, track, filetype, language, forced, name)
+                          for track, filetype, language, forced, name in
+                          zip(track_numbers, output_filetypes, subs_languages, subs_forced, subs_names)]
+
+    # mkvextract takes every track in one run, so the file is only read once
+    command = ["mkvextract", filename, "tracks"]
+    command += [f"{track}:{subtitle_filename}" for track, subtitle_filename in
+                zip(track_numbers, subtitle_filenames)]
+
+    if debug:
+        print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
+
+    result = run_command(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print('')
+        print(f"{GREY}[UTC {get_timestamp()}] {RED}[ERROR]{RESET} {result.stdout}")
+        print(f"{RESET}")
+    result.check_returncode()
+
+    results = []
+    for subtitle_filename, output_filetype in zip(subtitle_filenames, output_filetypes):
+        if output_filetype == 'srt' and not is_valid_srt(subtitle_filename):
+            results.append(None)
+        else:
+            results.append(subtitle_filename)
 
     return results
 
 
-def extract_subtitle(debug, filename, track, output_filetype, language, forced, name):
+def get_extracted_subtitle_filename(filename, track, output_filetype, language, forced, name):
     if output_filetype in ('sup', 'sub', 'ass'):
         if not name:
             cleartext_name = 'Original'
@@ -610,24 +689,7 @@ def extract_subtitle(debug, filename, track, output_filetype, language, forced,
     base, _, _ = filename.rpartition('.')
     b64_name = base64.b64encode(cleartext_name.encode("utf-8")).decode("utf-8")
 
-    subtitle_filename = f"{base}_{forced}_'{b64_name}'_{track}_{language}.{output_filetype}"
-    command = ["mkvextract", filename, "tracks", f"{track}:{subtitle_filename}"]
-
-    if debug:
-        print(f"{GREY}[UTC {get_timestamp()}] {YELLOW}{' '.join(command)}{RESET}")
-
-    result = subprocess.run(command, capture_output=True, text=True)
-    if result.returncode != 0:
-        print('')
-        print(f"{GREY}[UTC {get_timestamp()}] {RED}[ERROR]{RESET} {result.stdout}")
-        print(f"{RESET}")
-    result.check_returncode()
-
-    if output_filetype == 'srt':
-        if not is_valid_srt(subtitle_filename):
-            return
-
-    return subtitle_filename
+    return f"{base}_{forced}_'{b64_name}'_{track}_{language}.{output_filetype}"
 
 
 def get_output_subtitle_string(filename, track_numbers, output_filetypes, subs_languages):
@@ -652,7 +714,7 @@ def ocr_subtitles(logger, max_threads, memory_per_thread, debug, subtitle_files,
     # Prepare to track the results in the order they were submitted
     results = [None] * len(subtitle_files)  # Placeholder list for results
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+    with worker_pool('tracks', max_threads) as executor:
         # Submit all tasks and store futures in a dictionary with their index
         future_to_index = {
             executor.submit(ocr_subtitle_worker, logger, memory_per_thread, debug, subtitle_files[i],
@@ -834,21 +896,21 @@ def ocr_subtitle_worker(logger, memory_per_thread, debug, file, main_audio_track
 
             if final_subtitle != 'ERROR':
                 if language == 'eng':
-                    current_replacements = find_and_replace(final_subtitle, 'ocr-replacements/replacements_eng_only.csv',
+                    current_replacements = run_text_task(find_and_replace, final_subtitle, 'ocr-replacements/replacements_eng_only.csv',
                                                             subtitle_tmp)
                     replacements = replacements + current_replacements
-                    current_replacements = find_and_replace(subtitle_tmp, 'ocr-replacements/replacements.csv', final_subtitle)
+                    current_replacements = run_text_task(find_and_replace, subtitle_tmp, 'ocr-replacements/replacements.csv', final_subtitle)
                     os.remove(subtitle_tmp)
                     replacements = replacements + current_replacements
                 elif language == 'nor':
-                    current_replacements = find_and_replace(final_subtitle, 'ocr-replacements/replacements_nor_only.csv',
+                    current_replacements = run_text_task(find_and_replace, final_subtitle, 'ocr-replacements/replacements_nor_only.csv',
                                                             subtitle_tmp)
                     replacements = replacements + current_replacements
-                    current_replacements = find_and_replace(subtitle_tmp, 'ocr-replacements/replacements.csv', final_subtitle)
+                    current_replacements = run_text_task(find_and_replace, subtitle_tmp, 'ocr-replacements/replacements.csv', final_subtitle)
                     os.remove(subtitle_tmp)
                     replacements = replacements + current_replacements
                 else:
-                    current_replacements = find_and_replace(final_subtitle, 'ocr-replacements/replacements.csv', subtitle_tmp)
+                    current_replacements = run_text_task(find_and_replace, final_subtitle, 'ocr-replacements/replacements.csv', subtitle_tmp)
                     os.rename(subtitle_tmp, final_subtitle)
                     replacements = replacements + current_replacements
 
@@ -889,7 +951,7 @@ def get_subtitle_tracks_metadata_lists(subtitle_files, max_threads):
     # Prepare to track the results in the order they were submitted
     results = [None] * len(subtitle_files)  # Placeholder list for results
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+    with worker_pool('tracks', max_threads) as executor:
         # Submit all tasks and store futures in a dictionary with their index
         future_to_index = {
             executor.submit(get_subtitle_tracks_metadata_lists_worker, subtitle_files[i]): i
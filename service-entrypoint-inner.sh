@@ -1,6 +1,21 @@
 #!/bin/bash
 
 log_file="/mkv-auto/logs/mkv-auto.log"
+quarantine_registry="/mkv-auto/files/input/.quarantine/quarantine.json"
+
+# Quarantined files are hidden from 'ls', a run is also started
+# once one of them is due to be retried
+quarantine_due() {
+    [ -f "$quarantine_registry" ] || return 1
+    /pre/venv/bin/python3 -c '
+import json, sys, time
+try:
+    registry = json.load(open(sys.argv[1]))
+except (OSError, ValueError):
+    sys.exit(1)
+sys.exit(0 if any(not entry.get("released") and entry.get("next_retry") is not None
+                  and entry["next_retry"] <= time.time() for entry in registry.values()) else 1)' "$quarantine_registry"
+}
 
 touch "$log_file"
 chmod 666 "$log_file"
@@ -14,7 +29,7 @@ while true; do
     fi
 
     if ! pgrep -f 'python3 -u mkv-auto.py' > /dev/null; then
-        if [ "$(ls /mkv-auto/files/input | wc -l)" -gt 0 ]; then
+        if [ "$(ls /mkv-auto/files/input | wc -l)" -gt 0 ] || quarantine_due; then
             cd /mkv-auto
             . /pre/venv/bin/activate
             python3 -u mkv-auto.py --service --move --silent --temp_folder /mkv-auto/files/tmp --log_file "$log_file" --input_folder /mkv-auto/files/input --output_folder /mkv-auto/files/output $DEBUG_FLAG